@@ -1,8 +1,8 @@
 
 
-from pytadbit.tadbit import tadbit, batch_tadbit
+from pytadbit.tadbit import tadbit, batch_tadbit, genome_tadbit
 from pytadbit.chromosome import Chromosome
-from pytadbit.experiment import Experiment
+from pytadbit.experiment import Experiment, merge_experiments
 from pytadbit.chromosome import load_chromosome
 from pytadbit.imp.structuralmodels import StructuralModels
 from pytadbit.imp.structuralmodels import load_structuralmodels
@@ -4,12 +4,15 @@
 
 """
 
-from os.path                           import exists
+from os                                import listdir, remove
+from os.path                           import exists, dirname, basename
+from os.path                           import join as pjoin
 from pytadbit.boundary_aligner.aligner import align
 from pytadbit                          import tadbit
 from pytadbit.utils.extraviews         import tadbit_savefig
 from pytadbit.utils.extraviews         import _tad_density_plot
 from pytadbit.experiment               import Experiment
+from pytadbit.parsers.hic_parser       import save_hic_matrix, load_hic_matrix
 from string                            import ascii_lowercase as letters
 from warnings                          import warn
 from copy                              import deepcopy as copy
@@ -34,7 +37,9 @@ def load_chromosome(in_f, fast=2):
     :param 2 fast: if fast=2 do not load the Hi-C data (in the case that they 
        were saved in a separate file see :func:`Chromosome.save_chromosome`).
        If fast is equal to 1, the weights will be skipped from load to save 
-       memory. Finally if fast=0, both the weights and Hi-C data will be loaded
+       memory. Finally if fast=0, both the weights and Hi-C data will be loaded.
+       Hi-C data saved in binary format is memory-mapped, and only read from
+       disk when accessed
     
     :returns: a Chromosome object
 
@@ -92,7 +97,11 @@ def load_chromosome(in_f, fast=2):
             raise Exception('ERROR: file %s not found\n' % (
                 dico['experiments'][name]['hi-c']))
         for name in dico['experiments']:
-            crm.get_experiment(name).hic_data = dicp[name]['hi-c']
+            hic_data = dicp[name]['hi-c']
+            if isinstance(hic_data, str):
+                # binary file, relative to the pickle
+                hic_data = load_hic_matrix(pjoin(dirname(in_f), hic_data))
+            crm.get_experiment(name).hic_data = hic_data
             if fast != 1:
                 crm.get_experiment(name).norm = dicp[name]['wght']
     elif not fast:
@@ -278,7 +287,10 @@ class Chromosome(object):
            weights data. The second file name will be extended by '_hic' (ie:
            with out_f='chromosome12.pik' we would obtain chromosome12.pik and
            chromosome12.pik_hic). When loaded :func:`load_chromosome` will
-           automatically search for both files
+           automatically search for both files. The Hi-C data itself is
+           stored in binary format, one file per experiment (ie:
+           chromosome12.pik_hic_0.npy, chromosome12.pik_hic_1.npy...), that
+           can be memory-mapped by :func:`load_chromosome`
         :param False force: overwrite the existing file
 
         """
@@ -288,7 +300,8 @@ class Chromosome(object):
                 'experiment_order': [xpr.name for xpr in self.experiments]}
         if divide:
             dicp = {}
-        for xpr in self.experiments:
+            hic_fs = set()
+        for num, xpr in enumerate(self.experiments):
             dico['experiments'][xpr.name] = {
                 'size'      : xpr.size,
                 'cond'      : xpr.conditions,
@@ -309,6 +322,11 @@ class Chromosome(object):
                 dicp[xpr.name] = {
                     'wght': xpr.norm,
                     'hi-c': xpr.hic_data}
+                if xpr.hic_data:
+                    hic_f = out_f + '_hic_%d.npy' % num
+                    save_hic_matrix(xpr.hic_data, hic_f)
+                    dicp[xpr.name]['hi-c'] = basename(hic_f)
+                    hic_fs.add(basename(hic_f))
                 dico['experiments'][xpr.name]['wght'] = None
                 dico['experiments'][xpr.name]['hi-c'] = None
             else:
@@ -330,6 +348,13 @@ class Chromosome(object):
             out = open(out_f + '_hic', 'w')
             dump(dicp, out)
             out.close()
+        if not fast and divide:
+            # binary files left by a previous save with more experiments
+            prefix = basename(out_f) + '_hic_'
+            for fname in listdir(dirname(out_f) or '.'):
+                if (fname.startswith(prefix) and fname.endswith('.npy') and
+                    fname[len(prefix):-4].isdigit() and not fname in hic_fs):
+                    remove(pjoin(dirname(out_f), fname))
 
 
     def align_experiments(self, names=None, verbose=False, randomize=False,
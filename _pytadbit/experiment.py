@@ -7,12 +7,19 @@
 from pytadbit.parsers.hic_parser         import read_matrix
 from pytadbit.utils.extraviews           import nicer
 from pytadbit.utils.extraviews           import tadbit_savefig
-from pytadbit.utils.tadmaths             import zscore
+from pytadbit.utils.tadmaths             import zscore, iterative_correction
+from pytadbit.utils.tadmaths             import ZScores
 from pytadbit.utils.hic_filtering        import hic_filtering_for_modelling
 from pytadbit.parsers.tad_parser         import parse_tads
 from warnings                            import warn
+from collections                         import OrderedDict
 from math                                import sqrt
-from numpy                               import log2, array
+from numpy                               import log2, array, asarray, zeros
+from numpy                               import isnan, where, ones, outer
+from numpy                               import divide, concatenate
+from numpy                               import fill_diagonal, result_type
+from numpy                               import arange, empty
+from gzip                                import GzipFile
 from pytadbit.imp.CONFIG                 import CONFIG
 
 try:
@@ -28,6 +35,85 @@ except ImportError:
     warn('matplotlib not found\n')
 
 
+def _coarsen(hic, size, fact):
+    """
+    Sum the cells of a flat square Hi-C matrix by blocks of fact x fact bins
+    (the last block may be smaller).
+    """
+    new_size = -(-size / fact)
+    hic = asarray(hic).reshape(size, size)
+    if new_size * fact != size:
+        padded = zeros((new_size * fact, new_size * fact), dtype=hic.dtype)
+        padded[:size, :size] = hic
+        hic = padded
+    return hic.reshape(new_size, fact, new_size, fact).sum(axis=3).sum(
+        axis=1).reshape(-1)
+
+
+def _fill_nans(hic_data):
+    """
+    Replace NaNs by zeros in all replicates (returns new arrays).
+    """
+    hic_data = [asarray(hic) for hic in hic_data]
+    return [where(isnan(hic), 0, hic) if hic.dtype.kind == 'f' else hic
+            for hic in hic_data]
+
+
+def merge_experiments(experiments, name=None, resolution=None,
+                      filter_columns=True, silent=True, replicates=True):
+    """
+    Sum the Hi-C data of several experiments (and of all their replicates)
+    into a new experiment. Experiments passed are not modified.
+
+    :param experiments: list of :class:`pytadbit.Experiment`
+    :param None name: name of the new experiment. By default the names of the
+       experiments joined by '+'
+    :param None resolution: resolution of the new experiment. By default the
+       lowest resolution of the experiments passed. It must be a multiple of
+       the original resolution of each of them
+    :param True filter_columns: filter the columns with unexpectedly high
+       content of low values in the summed matrix
+    :param True silent: does not warn for removed columns
+    :param True replicates: sum all the replicates of each experiment,
+       otherwise only the first one
+
+    :returns: a new :class:`pytadbit.Experiment` with a single replicate
+    """
+    if not experiments:
+        raise Exception('ERROR: no experiment to merge.\n')
+    resolution = resolution or max([xpr.resolution for xpr in experiments])
+    # data at the common resolution, without touching the experiments
+    matrices = [xpr._hic_at(resolution) for xpr in experiments]
+    size = matrices[0][0]
+    if any([siz != size for siz, _ in matrices]):
+        raise Exception('ERROR: experiments have different sizes at ' +
+                        'resolution %s.\n' % (resolution))
+    hics = [asarray(hic) for _, hic_data in matrices
+            for hic in (hic_data if replicates else hic_data[:1])]
+    hic_sum = zeros(size * size, dtype=result_type(*hics))
+    for hic in hics:
+        if hic.dtype.kind == 'f':
+            hic = where(isnan(hic), 0, hic)
+        hic_sum += hic
+    xpr = Experiment(name=name or '+'.join([x.name for x in experiments]),
+                     resolution=resolution, no_warn=True)
+    xpr.crm = experiments[0].crm
+    def join(values):
+        if all([val == values[0] for val in values[1:]]):
+            return values[0]
+        return '+'.join(['%s' % (val) for val in values])
+    for attr in ('identifier', 'cell_type', 'enzyme', 'exp_type'):
+        setattr(xpr, attr, join([getattr(x, attr) for x in experiments]))
+    for des in experiments[0].description:
+        if all([des in x.description for x in experiments[1:]]):
+            xpr.description[des] = join([x.description[des]
+                                         for x in experiments])
+    # filter columns with low counts (only once, on the summed data)
+    # -> can not be done using intersection of summed experiments
+    xpr.load_hic_data([hic_sum], filter_columns=filter_columns, silent=silent)
+    return xpr
+
+
 class Experiment(object):
     """
     Hi-C experiment.
@@ -65,6 +151,9 @@ class Experiment(object):
        the TADs
     :param True filter_columns: filter the columns with unexpectedly high 
        content of low values
+    :param None cache_budget: maximum memory (in bytes) used to keep the Hi-C
+       data computed at other resolutions than the original and the current
+       one (see :func:`Experiment.set_resolution`). By default all are kept
     :param None kw_descr: any other argument passed would be stored as
        complementary descriptive field. For example::
        
@@ -93,7 +182,8 @@ class Experiment(object):
     def __init__(self, name, resolution, hic_data=None, tad_def=None,
                  parser=None, no_warn=False, weights=None,
                  conditions=None, filter_columns=True, identifier=None,
-                 cell_type=None, enzyme=None, exp_type='Hi-C', **kw_descr):
+                 cell_type=None, enzyme=None, exp_type='Hi-C',
+                 cache_budget=None, **kw_descr):
         self.name            = name
         self.resolution      = resolution
         self.identifier      = identifier
@@ -110,16 +200,19 @@ class Experiment(object):
         self.size            = None
         self.tads            = {}
         self.norm            = None
+        self.bias            = None
         self._normalization  = None
         self._zeros          = None
         self._zscores        = {}
-        if hic_data:
+        self._pyramid        = OrderedDict()
+        self.cache_budget    = cache_budget
+        if hic_data is not None:
             self.load_hic_data(hic_data, parser,
                                filter_columns=filter_columns,
                                **kw_descr)
         if tad_def:
             self.load_tad_def(tad_def, weights=weights)
-        elif not hic_data and not no_warn:
+        elif hic_data is None and not no_warn:
             warn('WARNING: this is an empty shell, no data here.\n')
 
 
@@ -148,43 +241,11 @@ class Experiment(object):
 
     def __add__(self, other):
         """
-        sum Hi-C data of experiments into a new one.
+        sum Hi-C data of experiments into a new one (see
+        :func:`pytadbit.experiment.merge_experiments`). Only the first
+        replicate of each experiment is used.
         """
-        reso1, reso2 = self.resolution, other.resolution
-        if self.resolution == other.resolution:
-            resolution = self.resolution
-        else:
-            resolution = max(reso1, reso2)
-            self.set_resolution(resolution)
-            other.set_resolution(resolution)
-            
-        xpr = Experiment(name='%s+%s' % (self.name, other.name),
-                         resolution=resolution,
-                         hic_data=tuple([i + j for i, j in zip(
-                             self.hic_data[0], other.hic_data[0])]))
-        self.set_resolution(reso1)
-        other.set_resolution(reso2)
-        xpr.crm = self.crm
-        xpr.identifier  = self.identifier  if self.identifier  == other.identifier  else '%s+%s' % (self.identifier , other.identifier )
-        xpr.cell_type   = self.cell_type   if self.cell_type   == other.cell_type   else '%s+%s' % (self.cell_type  , other.cell_type  )
-        xpr.enzyme      = self.enzyme      if self.enzyme      == other.enzyme      else '%s+%s' % (self.enzyme     , other.enzyme     )
-        xpr.description = self.description if self.description == other.description else '%s+%s' % (self.description, other.description)
-        xpr.exp_type    = self.exp_type    if self.exp_type    == other.exp_type    else '%s+%s' % (self.exp_type   , other.exp_type   )
-        # filter columns with low counts
-        # -> can not be done using intersection of summed experiments
-        xpr._zeros, _ = hic_filtering_for_modelling(
-            xpr.get_hic_matrix(diagonal=False), silent=True)
-        # also remove columns with zeros in the diagonal
-        xpr._zeros.update(dict([(i, None) for i in xrange(xpr.size)
-                                if not xpr.hic_data[0][i*xpr.size+i]]))
-        for des in self.description:
-            if not des in other.description:
-                continue
-            if self.description[des] == other.description[des]:
-                xpr.description[des] = self.description[des]
-            else:
-                xpr.description[des] = '%s+%s' % (self.description[des], other.description[des])
-        return xpr
+        return merge_experiments([self, other], replicates=False)
 
 
     def set_resolution(self, resolution, keep_original=True):
@@ -193,10 +254,13 @@ class Experiment(object):
         Experiment._ori_hic and replace the Experiment.hic_data
         with the data corresponding to new data 
         (:func:`pytadbit.Chromosome.compare_condition`).
+        All replicates are rebinned, and the data at each resolution is kept,
+        so that going back to an already computed resolution is immediate.
 
         :param resolution: an integer representing the resolution. This number
            must be a multiple of the original resolution, and higher than it
         :param True keep_original: either to keep or not the original data
+           (and the data computed at other resolutions)
 
         """
         if resolution < self._ori_resolution:
@@ -206,62 +270,105 @@ class Experiment(object):
                             '  otherwise it is too complicated for me :P')
         if resolution == self.resolution:
             return
-        # if we want to go back to original resolution
-        if resolution == self._ori_resolution:
-            self.hic_data   = self._ori_hic
-            self.size       = self._ori_size
-            self.resolution = self._ori_resolution
-            return
         # if current resolution is the original one
         if self.resolution == self._ori_resolution:
             self._ori_hic = self.hic_data[:]
+        self._pyramid.setdefault(self.resolution, {}).update(
+            hic_data=self.hic_data, size=self.size, zeros=self._zeros)
+        level = self._pyramid_level(resolution)
         self.resolution = resolution
-        fact = self.resolution / self._ori_resolution
-        # super for!
-        size = int(sqrt(len(self._ori_hic[0])))
-        self.hic_data = [[]]
-        self.size     = size / fact
-        rest = size % fact
-        if rest:
-            self.size += 1
-        for i in xrange(0, size, fact):
-            for j in xrange(0, size, fact):
-                val = 0
-                for k in xrange(fact):
-                    if i + k >= size:
-                        break
-                    for l in  xrange(fact):
-                        if j + l >= size:
-                            break
-                        val += self._ori_hic[0][(i + k) * size + j + l]
-                self.hic_data[0].append(val)
-        # we need to recalculate zeros:
-        if self._zeros:
-            self._zeros, has_nans = hic_filtering_for_modelling(
-                self.get_hic_matrix(diagonal=False), silent=True)
-            if has_nans: # to make it simple
-                for i in xrange(len(self.hic_data[0])):
-                    if repr(self.hic_data[0][i]) == 'nan':
-                        self.hic_data[0] = tuple(list(self.hic_data[0][:i]) +
-                                                 [0] +
-                                                 list(self.hic_data[0][i + 1:]))
-            # Also remove columns where there is no data in the diagonal
-            self._zeros.update(dict([(i, None) for i in xrange(self.size)
-                                     if not self.hic_data[0][i*self.size+i]]))
-        # hic_data needs always to be stored as tuple
-        self.hic_data[0] = tuple(self.hic_data[0])
+        if 'hic_data' in level:
+            # already computed (the original resolution is always there)
+            self.hic_data = level['hic_data']
+            self.size     = level['size']
+            self._zeros   = level['zeros']
+        else:
+            self.hic_data = level['raw']
+            self.size = int(sqrt(len(self.hic_data[0])))
+            # we need to recalculate zeros:
+            if self._zeros:
+                self._zeros, has_nans = hic_filtering_for_modelling(
+                    self.get_hic_matrix(diagonal=False, as_array=True),
+                    silent=True)
+                if has_nans: # to make it simple
+                    self.hic_data = _fill_nans(self.hic_data)
+                # Also remove columns where there is no data in the diagonal
+                self._zeros.update(dict([(i, None) for i in xrange(self.size)
+                                         if not self.hic_data[0][i*self.size+i]]))
+            level.update(hic_data=self.hic_data, size=self.size,
+                         zeros=self._zeros)
         if not keep_original:
             del(self._ori_hic)
+            self._pyramid.clear()
+        else:
+            self._evict_resolutions()
+
+
+    def _pyramid_level(self, resolution):
+        """
+        Level of the pyramid of Hi-C data at a given resolution (marked as the
+        most recently used). A level is a dictionary with:
+
+        - raw: the Hi-C data (all replicates, NaNs not replaced), computed from
+          the closest finer level already available
+        - hic_data, size and zeros: once the experiment has been set at this
+          resolution, the Hi-C data (NaNs replaced), size and filtered
+          columns used
+        """
+        ori = self._pyramid.setdefault(self._ori_resolution, {})
+        if not 'raw' in ori:
+            ori['raw'] = (self.hic_data
+                          if self.resolution == self._ori_resolution
+                          else self._ori_hic)
+        if resolution in self._pyramid:
+            level = self._pyramid.pop(resolution)
+        else:
+            level = {}
+        if not 'raw' in level and not 'hic_data' in level:
+            finer = max([res for res in self._pyramid
+                         if not resolution % res and
+                         'raw' in self._pyramid[res]])
+            size = int(sqrt(len(self._pyramid[finer]['raw'][0])))
+            level['raw'] = [_coarsen(hic, size, resolution / finer)
+                            for hic in self._pyramid[finer]['raw']]
+        self._pyramid[resolution] = level
+        return level
+
+
+    def _evict_resolutions(self):
+        """
+        Forget the least recently used resolutions until the memory used by
+        Hi-C data at other resolutions than the original and current ones
+        fits in Experiment.cache_budget.
+        """
+        if self.cache_budget is None:
+            return
+        def nbytes(res):
+            level = self._pyramid[res]
+            arrays = dict([(id(hic), hic) for hic in
+                           list(level.get('raw', [])) +
+                           list(level.get('hic_data', []))])
+            return sum([getattr(hic, 'nbytes', 0) for hic in arrays.values()])
+        evictable = [res for res in self._pyramid
+                     if not res in (self._ori_resolution, self.resolution)]
+        used = sum([nbytes(res) for res in evictable])
+        for res in evictable:
+            if used <= self.cache_budget:
+                break
+            used -= nbytes(res)
+            del(self._pyramid[res])
 
 
     def load_hic_data(self, hic_data, parser=None, wanted_resolution=None,
                       data_resolution=None, filter_columns=True, silent=False,
-                      **kwargs):
+                      sparse=False, base=0, size=None, **kwargs):
         """
         Add a Hi-C experiment to the Chromosome object.
         
         :param None hic_data: whether a file or a list of lists corresponding to
-           the Hi-C data
+           the Hi-C data. Files with (bin1, bin2, count) triplets (with
+           sparse=True), and scipy sparse matrices are also accepted
+           (see :func:`pytadbit.parsers.hic_parser.read_matrix`)
         :param name: name of the experiment
         :param False force: overwrite the experiments loaded under the same 
            name
@@ -287,10 +394,16 @@ class Experiment(object):
         :param True filter_columns: filter the columns with unexpectedly high content
            of low values
         :param False silent: does not warn for removed columns
+        :param False sparse: the file contains (bin1, bin2, count) triplets
+        :param 0 base: index of the first bin in a sparse file
+        :param None size: number of bins in a sparse file, by default the
+           highest bin index
         
         """
-        nums, size = read_matrix(hic_data, parser=parser)
+        nums, size = read_matrix(hic_data, parser=parser, sparse=sparse,
+                                 base=base, size=size)
         self.hic_data = nums
+        self._pyramid.clear()
         self._ori_size       = self.size       = size
         self._ori_resolution = self.resolution = data_resolution or self._ori_resolution
         wanted_resolution = wanted_resolution or self.resolution
@@ -300,13 +413,10 @@ class Experiment(object):
         #                  if sum(self.hic_data[0][raw:raw + self.size]) <= 100]
         if filter_columns:
             self._zeros, has_nans = hic_filtering_for_modelling(
-                self.get_hic_matrix(diagonal=False), silent=silent)
+                self.get_hic_matrix(diagonal=False, as_array=True),
+                silent=silent)
             if has_nans: # to make it simple
-                for i in xrange(len(self.hic_data[0])):
-                    if repr(self.hic_data[0][i]) == 'nan':
-                        self.hic_data[0] = tuple(list(self.hic_data[0][:i]) +
-                                                 [0] +
-                                                 list(self.hic_data[0][i + 1:]))
+                self.hic_data = _fill_nans(self.hic_data)
             # Also remove columns where there is no data in the diagonal
             self._zeros.update(dict([(i, None) for i in xrange(self.size)
                                      if not self.hic_data[0][i*self.size+i]]))
@@ -334,17 +444,20 @@ class Experiment(object):
             self._normalization = 'visibility'
         
 
-    def normalize_hic(self, silent=False):
+    def normalize_hic(self, silent=False, replicates=False,
+                      method='visibility', tolerance=1e-5, max_iter=1000):
         """
         Normalize the Hi-C data. This normalization step does the same of
         the :func:`pytadbit.tadbit.tadbit` function (default parameters),
 
         It fills the Experiment.norm variable with the Hi-C values divided by
-        the calculated weight.
+        the calculated weight, and the Experiment.bias variable with the bias
+        of each bin (the weight of a cell being the product of the biases of
+        its row and column).
 
-        The weight of a given cell in column i and row j corresponds to the
-        square root of the product of the sum of column i by the sum of row
-        j.
+        With the 'visibility' method, the weight of a given cell in column i
+        and row j corresponds to the square root of the product of the sum of
+        column i by the sum of row j.
 
         normalization is done according to this formula:
 
@@ -354,40 +467,86 @@ class Experiment(object):
                                  {\\sum^N_{i=0}(matrix(i,J)) \\times \\sum^N_{j=0}(matrix(I,j))}
  
         with N being the number or rows/columns of the Hi-C matrix in both
-        cases.
+        cases. Filtered columns (see
+        :func:`pytadbit.utils.hic_filtering.hic_filtering_for_modelling`) are
+        not taken into account, and their normalized values are set to zero.
+
+        With the 'ICE' method, biases are found iteratively so that all rows
+        of the normalized matrix sum to the same value (see
+        :func:`pytadbit.utils.tadmaths.iterative_correction`).
+
+        :param False silent: does not warn when previous weights are replaced
+        :param False replicates: normalize each replicate separately, and
+           store one normalized matrix per replicate in Experiment.norm. By
+           default only the first replicate is normalized
+        :param visibility method: normalization method, either 'visibility'
+           or 'ICE'
+        :param 1e-5 tolerance: for the 'ICE' method, maximum relative
+           deviation of the row sums of the normalized matrix from their mean
+        :param 1000 max_iter: for the 'ICE' method, maximum number of
+           iterations
         """
 
         if not self.hic_data:
             raise Exception('ERROR: No Hi-C data loaded\n')
+        if not method.lower() in ('visibility', 'ice'):
+            raise Exception('ERROR: normalization method should be ' +
+                            '"visibility" or "ICE"\n')
         if self.norm and not silent:
             warn('WARNING: removing previous weights\n')
-        rowsums = [0 for _ in xrange(self.size)]
-        for i in xrange(self.size):
-            if i in self._zeros: continue
-            isi = i * self.size
-            for j in xrange(self.size):
-                if j in self._zeros: continue
-                rowsums[i] += self.hic_data[0][isi + j]
-        self.norm = [[0. for _ in xrange(self.size * self.size)]]
-
-        total = sum(rowsums)
-        func = lambda x, y: float(rowsums[x] * rowsums[y]) / total
-        for i in xrange(self.size):
-            if i in self._zeros: continue
-            for j in xrange(self.size):
-                if j in self._zeros: continue
-                try:
-                    self.norm[0][i * self.size + j] = (
-                        self.hic_data[0][i * self.size + j] / func(i, j))
-                except ZeroDivisionError:
-                    continue
-        self._normalization = 'visibility'
+        size = self.size
+        mask = ones(size, dtype=bool)
+        mask[[i for i in (self._zeros or {}) if i < size]] = False
+        self.norm = []
+        self.bias = []
+        for hic in self.hic_data if replicates else self.hic_data[:1]:
+            hic = asarray(hic).reshape(size, size)
+            if method.lower() == 'ice':
+                bias, iterations = iterative_correction(
+                    hic, mask, tolerance=tolerance, max_iter=max_iter)
+                if iterations > max_iter:
+                    warn('WARNING: ICE normalization did not converge\n')
+                valid = bias != 0
+                inv = zeros(size)
+                inv[valid] = 1. / bias[valid]
+                norm = hic * inv[:, None]
+                norm *= inv
+                norm[~valid] = 0
+                norm[:, ~valid] = 0
+                self.norm.append(norm.reshape(-1))
+                self.bias.append(bias)
+                continue
+            # sum of the non filtered columns, in the non filtered rows
+            rowsums = hic.sum(axis=1) - hic[:, ~mask].sum(axis=1)
+            rowsums[~mask] = 0
+            total = rowsums.sum()
+            if not total:
+                self.norm.append(zeros(size * size))
+                self.bias.append(zeros(size))
+                continue
+            # products of integer row sums could overflow
+            rowsums = rowsums.astype(float)
+            expected = outer(rowsums, rowsums)
+            expected /= total
+            valid = rowsums != 0
+            expected[~valid] = 1
+            expected[:, ~valid] = 1
+            norm = divide(hic, expected, out=expected)
+            norm[~valid] = 0
+            norm[:, ~valid] = 0
+            self.norm.append(norm.reshape(-1))
+            self.bias.append(rowsums / sqrt(total))
+        self._normalization = 'ICE' if method.lower() == 'ice' else 'visibility'
 
 
     def get_hic_zscores(self, normalized=True, zscored=True, remove_zeros=False):
         """
         Normalize the Hi-C raw data. The result will be stored into
-        the private Experiment._zscore list.
+        the private Experiment._zscores, a
+        :class:`pytadbit.utils.tadmaths.ZScores` object holding the values of
+        the upper triangle of the matrix in a flat array, that can also be
+        used as a dictionary of dictionaries (Experiment._zscores[str(i)][str(j)]
+        with i < j).
 
         :param True normalized: whether to normalize the result using the
            weights (see :func:`normalize_hic`)
@@ -396,43 +555,51 @@ class Experiment(object):
            interaction are informative.
 
         """
-        values = {}
-        zeros  = {}
-        self._zscores = {}
-        if normalized:
-            for i in xrange(self.size):
-                # zeros are rows or columns having a zero in the diagonal
-                if i in self._zeros:
-                    continue
-                for j in xrange(i + 1, self.size):
-                    if j in self._zeros:
-                        continue
-                    if (not self.hic_data[0][i * self.size + j]
-                        and remove_zeros):
-                        zeros[(i, j)] = None
-                        continue
-                    values[(i, j)] = self.norm[0][i * self.size + j]
-        else:
-            for i in xrange(self.size):
-                if i in self._zeros:
-                    continue
-                for j in xrange(i + 1, self.size):
-                    if j in self._zeros:
-                        continue
-                    values[(i, j)] = self.hic_data[0][i * self.size + j]
+        self._zscores = self._region_zscores(0, self.size, normalized=normalized,
+                                             zscored=zscored,
+                                             remove_zeros=remove_zeros)
+
+
+    def _region_mask(self, start, end):
+        """
+        :returns: array of booleans, False for the filtered columns, of the
+           region between bins start (included) and end (excluded)
+        """
+        mask = ones(end - start, dtype=bool)
+        mask[[i - start for i in (self._zeros or {}) if start <= i < end]] = False
+        return mask
+
+
+    def _region_zscores(self, start, end, normalized=True, zscored=True,
+                        remove_zeros=False):
+        """
+        Z-scores of the region between bins start (included) and end
+        (excluded), computed on views of the Hi-C data and of the weights (no
+        copy of the full matrix). See :func:`get_hic_zscores`.
+
+        :returns: a :class:`pytadbit.utils.tadmaths.ZScores` object
+        """
+        siz = self.size
+        size = end - start
+        mask = self._region_mask(start, end)
+        hic = asarray(self.hic_data[0]).reshape(siz, siz)[start:end, start:end]
+        data = (asarray(self.norm[0]).reshape(siz, siz)[start:end, start:end]
+                if normalized else hic)
+        # upper triangle of the matrix, row after row
+        values = concatenate([data[i, i + 1:] for i in xrange(size)]
+                             ).astype(float)
+        # zeros are rows or columns having a zero in the diagonal
+        valid = concatenate([mask[i + 1:] & mask[i] for i in xrange(size)])
+        if normalized and remove_zeros:
+            valid &= concatenate([hic[i, i + 1:] != 0 for i in xrange(size)])
         # compute Z-score
         if zscored:
-            zscore(values)
-        for i in xrange(self.size):
-            if i in self._zeros:
-                continue
-            for j in xrange(i + 1, self.size):
-                if j in self._zeros:
-                    continue
-                if (i, j) in zeros and remove_zeros:
-                    continue
-                self._zscores.setdefault(str(i), {})
-                self._zscores[str(i)][str(j)] = values[(i, j)]
+            zscores = values[valid]
+            zscore(zscores)
+            values[valid] = zscores
+        values[~valid] = float('nan')
+        return ZScores(values, size, integers=not (
+            normalized or zscored or data.dtype.kind == 'f'))
 
 
     def model_region(self, start=1, end=None, n_models=5000, n_keep=1000,
@@ -499,7 +666,7 @@ class Experiment(object):
         :returns: a :class:`pytadbit.imp.structuralmodels.StructuralModels` object.
 
         """
-        if self._normalization != 'visibility':
+        if not self._normalization:
             warn('WARNING: normalizing according to visibility method')
             self.normalize_hic()
         if not end:
@@ -594,61 +761,45 @@ class Experiment(object):
 
     def _sub_experiment_zscore(self, start, end):
         """
-        Get the z-score of a sub-region of an  experiment.
-
-        TODO: find a nicer way to do this...
+        Get the z-score of a sub-region of an  experiment. Weights and
+        filtered columns are those of the full experiment, and only the
+        region is read from them (no copy of the full matrix).
 
         :param start: first bin to model (bin number)
-        :param end: first bin to model (bin number)
+        :param end: last bin to model (bin number, inclusive)
 
-        :returns: z-score and raw values of the experiment
+        :returns: z-score (:class:`pytadbit.utils.tadmaths.ZScores`) and
+           normalized values of the region (list of lists, with NaN for the
+           diagonal, filtered columns and null interactions)
         """
-        if self._normalization != 'visibility':
+        if not self._normalization:
             warn('WARNING: normalizing according to visibility method')
             self.normalize_hic()
-        from pytadbit import Chromosome
-        matrix = self.get_hic_matrix()
         if start < 1:
             raise ValueError('start should be higher than 1\n')
         start -= 1 # things starts at 0 for python. we keep the end coordinate
                    # at its original value because it is inclusive
-        new_matrix = [[matrix[i][j] for i in xrange(start, end)]
-                      for j in xrange(start, end)]
-        tmp = Chromosome('tmp')
-        tmp.add_experiment('exp1', hic_data=[new_matrix],
-                           resolution=self.resolution, filter_columns=False)
-        exp = tmp.experiments[0]
-        # We want the weights and zeros calculated in the full chromosome
-        siz = self.size
-        exp.norm = [[self.norm[0][i + siz * j] for i in xrange(start, end)
-                     for j in xrange(start, end)]]
-        exp._zeros = dict([(z - start, None) for z in self._zeros
-                           if start <= z <= end - 1])
-        if len(exp._zeros) == (end - start):
+        end = min(end, self.size)
+        mask = self._region_mask(start, end)
+        if not mask.any():
             raise Exception('ERROR: no interaction found in selected regions')
-        # ... but the z-scores in this particular region
-        exp.get_hic_zscores(remove_zeros=False)
-        values = [[float('nan') for _ in xrange(exp.size)]
-                  for _ in xrange(exp.size)]
-        for i in xrange(exp.size):
-            # zeros are rows or columns having a zero in the diagonal
-            if i in exp._zeros:
-                continue
-            for j in xrange(i + 1, exp.size):
-                if j in exp._zeros:
-                    continue
-                if (not exp.hic_data[0][i * exp.size + j] 
-                    or not exp.hic_data[0][i * exp.size + j]):
-                    continue
-                values[i][j] = exp.norm[0][i * exp.size + j]
-                values[j][i] = exp.norm[0][i * exp.size + j]
-        return exp._zscores, values
+        # weights and zeros are those calculated in the full chromosome, but
+        # the z-scores are calculated in this particular region
+        zscores = self._region_zscores(start, end, remove_zeros=False)
+        siz = self.size
+        hic  = asarray(self.hic_data[0]).reshape(siz, siz)[start:end, start:end]
+        norm = asarray(self.norm[0]).reshape(siz, siz)[start:end, start:end]
+        valid = outer(mask, mask) & (hic != 0)
+        fill_diagonal(valid, False)
+        values = where(valid, norm, float('nan'))
+        return zscores, values.tolist()
 
 
     def write_interaction_pairs(self, fname, normalized=True, zscored=True,
                                 diagonal=False, cutoff=None, header=False,
                                 true_position=False, uniq=True,
-                                remove_zeros=False, focus=None):
+                                remove_zeros=False, focus=None, gzip=False,
+                                binary=False, chunk=100000):
         """
         Creates a tab separated file with all the pairwise interactions.
         
@@ -662,84 +813,149 @@ class Experiment(object):
            otherwise, genomic bin.
         :param None focus: writes interactions between the start and stop bin
            passed to this parameter.
+        :param False gzip: compress the output file with gzip
+        :param False binary: instead of text, write consecutive records of two
+           64 bit integers (elt1, elt2) and a 64 bit float (value), in
+           little-endian (no header is written). The file can be read with
+           ``numpy.fromfile(fname, dtype=[('elt1', '<i8'), ('elt2', '<i8'),
+           ('value', '<f8')])``
+        :param 100000 chunk: number of interaction pairs formatted in memory
+           before being written to the file
            
         """
         if not self._zscores and zscored:
             self.get_hic_zscores()
         if not self.norm and normalized:
             raise Exception('Experiment not normalized.')
-        # write to file
-        out = open(fname, 'w')
-        if header:
-            out.write('elt1\telt2\t%s\n' % ('zscore' if zscored else 
-                                            'normalized hi-c' if normalized 
-                                            else 'raw hi-c'))
         if focus:
             start, end = focus[0], focus[1] + 1
         else:
             start, end = 0, self.size
+        valid = ones(self.size, dtype=bool)
+        valid[[i for i in (self._zeros or {}) if i < self.size]] = False
+        if zscored:
+            integers = self._zscores.integers
+        else:
+            integers = False
+            mtrx = asarray(self.norm[0] if normalized else
+                           self.hic_data[0]).reshape(self.size, self.size)
+        # write to file
+        if gzip:
+            out = GzipFile(fname, 'wb')
+        else:
+            out = open(fname, 'wb' if binary else 'w')
+        if header and not binary:
+            out.write('elt1\telt2\t%s\n' % ('zscore' if zscored else 
+                                            'normalized hi-c' if normalized 
+                                            else 'raw hi-c'))
+        buf = []
+        buffered = 0
         for i in xrange(start, end):
-            if i in self._zeros:
+            if not valid[i]:
                 continue
-            newstart = i if uniq else 0
-            for j in xrange(newstart, end):
-                if j in self._zeros:
-                    continue
-                if not diagonal and i == j:
-                    continue
-                if zscored:
-                    try:
-                        if self._zscores[str(i)][str(j)] < cutoff:
-                            continue
-                        if self._zscores[str(i)][str(j)] == -99:
-                            continue
-                    except KeyError:
-                        continue
-                    val = self._zscores[str(i)][str(j)]
-                elif normalized:
-                    val = self.norm[0][self.size*i+j]
-                else:
-                    val = self.hic_data[0][self.size*i+j]
-                if remove_zeros and not val:
-                    continue
-                if true_position:
-                    out.write('%s\t%s\t%s\n' % (self.resolution * (i + 1),
-                                                self.resolution * (j + 1), val))
-                else:
-                    out.write('%s\t%s\t%s\n' % (i + 1 - start, j + 1 - start, val))
+            newstart = i if uniq else start
+            if zscored:
+                # z-scores are only defined for the upper triangle
+                newstart = max(newstart, i + 1)
+                cols = arange(newstart, end)
+                vals = self._zscores._row(i)[newstart - i - 1:end - i - 1]
+                keep = valid[cols] & ~isnan(vals) & (vals != -99)
+                if cutoff is not None:
+                    keep &= vals >= cutoff
+            else:
+                cols = arange(newstart, end)
+                vals = mtrx[i, newstart:end]
+                keep = valid[cols]
+                if not diagonal:
+                    keep &= cols != i
+            if remove_zeros:
+                keep &= vals != 0
+            cols = cols[keep]
+            if not len(cols):
+                continue
+            vals = vals[keep]
+            if integers:
+                vals = vals.astype(int)
+            if true_position:
+                elt1, cols = self.resolution * (i + 1), self.resolution * (
+                    cols + 1)
+            else:
+                elt1, cols = i + 1 - start, cols + 1 - start
+            if binary:
+                recs = empty(len(cols), dtype=[('elt1', '<i8'), ('elt2', '<i8'),
+                                               ('value', '<f8')])
+                recs['elt1'] = elt1
+                recs['elt2'] = cols
+                recs['value'] = vals
+                buf.append(recs.tostring())
+            else:
+                # one formatting operation per row
+                cells = [elt1] * (3 * len(cols))
+                cells[1::3] = cols.tolist()
+                cells[2::3] = vals.tolist()
+                buf.append('%s\t%s\t%s\n' * len(cols) % tuple(cells))
+            buffered += len(cols)
+            if buffered >= chunk:
+                out.write(''.join(buf))
+                buf = []
+                buffered = 0
+        out.write(''.join(buf))
         out.close()
 
 
-    def get_hic_matrix(self, focus=None, diagonal=True):
+    def _hic_at(self, resolution=None):
+        """
+        Size and Hi-C data (all replicates) at a given resolution, without
+        changing the resolution of the experiment.
+        """
+        if resolution is None or resolution == self.resolution:
+            return self.size, self.hic_data
+        if resolution % self._ori_resolution:
+            raise Exception('New resolution might be a multiple original.\n')
+        level = self._pyramid_level(resolution)
+        if 'hic_data' in level:
+            return level['size'], level['hic_data']
+        hic_data = level['raw']
+        self._evict_resolutions()
+        return int(sqrt(len(hic_data[0]))), hic_data
+
+
+    def get_hic_matrix(self, focus=None, diagonal=True, resolution=None,
+                       as_array=False):
         """
         Return the Hi-C matrix.
 
         :param None focus: if a tuple is passed (start, end), wil return a Hi-C
            matrix starting at start, and ending at end (all inclusive).
-        :param True diagonal: replace the values in the diagonal by one. Used
-           for the filtering in order to smooth the distribution of mean values
-
-        :returns: list of lists representing the Hi-C data matrix of the
-           current experiment
+        :param True diagonal: if False, replace the values in the diagonal by
+           one (or zero for null values). Used for the filtering in order to
+           smooth the distribution of mean values
+        :param None resolution: resolution of the matrix returned (a multiple
+           of the original one). By default the current resolution. The
+           resolution of the experiment is not changed
+        :param False as_array: return a 2-D numpy array instead of a list of
+           lists. With diagonal=True, this array is a view on the Hi-C data of
+           the experiment (no copy is done, and it must not be modified)
+
+        :returns: list of lists (or numpy array) representing the Hi-C data
+           matrix of the current experiment
         """
-        siz = self.size
-        hic = self.hic_data[0]
+        siz, hic = self._hic_at(resolution)
         if focus:
             start, end = focus
             start -= 1
         else:
             start = 0
             end   = siz
-        if diagonal:
-            return [[hic[i + siz * j] for i in xrange(start, end)]
-                    for j in xrange(start, end)]
-        else:
-            mtrx = [[hic[i + siz * j] for i in xrange(start, end)]
-                    for j in xrange(start, end)]
-            for i in xrange(start, end):
-                mtrx[i][i] = 1 if mtrx[i][i] else 0
+        mtrx = asarray(hic[0]).reshape(siz, siz)[start:end, start:end]
+        if not diagonal:
+            mtrx = mtrx.copy()
+            diag = mtrx.diagonal() != 0
+            fill_diagonal(mtrx, diag)
+        if as_array:
             return mtrx
-            
+        return mtrx.tolist()
+
 
     def print_hic_matrix(self, print_it=True):
         """
@@ -761,7 +977,8 @@ class Experiment(object):
 
     def view(self, tad=None, focus=None, paint_tads=False, axe=None,
              show=True, logarithm=True, normalized=False, relative=True,
-             decorate=True, savefig=None, where='both', clim=None):
+             decorate=True, savefig=None, where='both', clim=None,
+             resolution=None):
         """
         Visualize the matrix of Hi-C interactions
 
@@ -796,7 +1013,23 @@ class Experiment(object):
            of the file name will determine the desired format).
         :param None clim: tuple with minimum and maximum value range for color
            scale. I.e. clim=(-4, 10)
+        :param None resolution: show the Hi-C data at this resolution (a
+           multiple of the original one), without changing the resolution of
+           the experiment. Positions in focus are then bins at this
+           resolution. Not compatible with normalized and paint_tads, nor
+           with the TADs of the experiment
         """
+        if resolution is not None and resolution != self.resolution:
+            if normalized or paint_tads or tad:
+                raise Exception('ERROR: normalized data and TADs are only ' +
+                                'available at the current resolution\n')
+            tmp = Experiment(self.name, resolution, no_warn=True)
+            tmp.crm = self.crm
+            tmp.size, tmp.hic_data = self._hic_at(resolution)
+            return tmp.view(focus=focus, axe=axe, show=show,
+                            logarithm=logarithm, relative=relative,
+                            decorate=decorate, savefig=savefig, where=where,
+                            clim=clim)
         if logarithm:
             fun = log2
         else:
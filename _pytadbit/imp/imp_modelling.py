@@ -7,11 +7,12 @@ from pytadbit.imp.CONFIG           import CONFIG, NROUNDS, STEPS, LSTEPS
 from pytadbit.imp.structuralmodels import StructuralModels
 from pytadbit.imp.impmodel         import IMPmodel
 from scipy                         import polyfit
-from math                          import fabs, pow as power
-from cPickle                       import load, dump
+from math                          import fabs, ceil, pow as power
+from pytadbit.imp.modelstore       import ModelStore
 from sys                           import stdout
-from os.path                       import exists
+from heapq                         import heappush, heappushpop
 import multiprocessing as mu
+import numpy           as np
 
 
 import IMP.core
@@ -32,7 +33,8 @@ IMP.set_log_level(IMP.SILENT)
 def generate_3d_models(zscores, resolution, nloci, start=1, n_models=5000,
                        n_keep=1000, close_bins=1, n_cpus=1, keep_all=False,
                        verbose=0, outfile=None, config=CONFIG['dmel_01'],
-                       values=None, experiment=None, coords=None):
+                       values=None, experiment=None, coords=None,
+                       pool=None):
     """
     This function generates three-dimensional models starting from Hi-C data. 
     The final analysis will be performed on the n_keep top models.
@@ -62,10 +64,21 @@ def generate_3d_models(zscores, resolution, nloci, start=1, n_models=5000,
        difference) a particle pair must be in order to be considered as
        neighbors (e.g. 1 means consecutive particles)
     :param n_cpus: number of CPUs to use
+    :param None pool: a :py:class:`multiprocessing.Pool` where to generate the
+       models. It is not closed, so it can be reused by successive calls (e.g.
+       when optimizing the parameters). By default a pool of n_cpus processes
+       is created and closed by each call
     :param False verbose: if set to True, information about the distance, force
        and Z-score between particles will be printed
     :param None values: the normalized Hi-C data in a list of lists (equivalent 
        to a square matrix)
+    :param None outfile: path to a :class:`pytadbit.imp.modelstore.ModelStore`
+       where to append the models as they are generated (nothing is returned
+       in this case). Models already in the store (same random initial
+       number) are not generated again, thus an interrupted run can be
+       resumed, and several runs (e.g. using different start values) can
+       write to the same store. The models can be loaded with
+       :func:`pytadbit.imp.structuralmodels.load_structuralmodels`
     :param CONFIG['dmel_01'] config: a dictionary containing the standard 
        parameters used to generate the models. The dictionary should contain
        the keys kforce, lowrdist, maxdist, upfreq and lowfreq. Examples can be
@@ -110,141 +123,250 @@ def generate_3d_models(zscores, resolution, nloci, start=1, n_models=5000,
 
     """
 
-    # Main config parameters
-    global CONFIG
-    CONFIG = config
-    
-    # Particles initial radius
-    global RADIUS
-    RADIUS = float(resolution * CONFIG['scale']) / 2
-    CONFIG['lowrdist'] = RADIUS * 2.
-    
-
-    if CONFIG['lowrdist'] > CONFIG['maxdist']:
-        raise Exception('ERROR: we must prevent you from doing this for ' +
-                        'the safe of our universe...\n' + 
-                        'In this case, maxdist must be higher than %s\n' % (
-                            CONFIG['lowrdist']) +
-                        '   -> resolution times scale -- %s*%s)' % (
-                            resolution, CONFIG['scale']))
-
-    # get SLOPE and regression for all particles of the z-score data
-    global SLOPE, INTERCEPT
-    zsc_vals = [zscores[i][j] for i in zscores for j in zscores[i]
-                if abs(int(i) - int(j)) > 1] # condition is to avoid
-                                             # taking into account selfies
-                                             # and neighbors
-    zmin = min(zsc_vals)
-    zmax = max(zsc_vals)
-    SLOPE, INTERCEPT   = polyfit([zmin, zmax], [CONFIG['maxdist'],
-                                                CONFIG['lowrdist']], 1)
-    # get SLOPE and regression for neighbors of the z-score data
-    global NSLOPE, NINTERCEPT
-    xarray = [zscores[i][j] for i in zscores for j in zscores[i]
-              if abs(int(i) - int(j)) <= (close_bins + 1)]
-    yarray = [RADIUS * 2 for _ in xrange(len(xarray))]
-    NSLOPE, NINTERCEPT = polyfit(xarray, yarray, 1)
-    
-    global LOCI, NLOCI
-    # if z-scores are generated outside TADbit they may not start at zero
-    first = min([int(j) for i in zscores for j in zscores[i]] +
-                [int(i) for i in zscores])
-    
-    LOCI  = range(first, nloci + 1 + first)
-    NLOCI = len(LOCI)
-    
-    # Z-scores
-    global PDIST
-    PDIST = zscores
-
-    # random inital number
-    global START
-    START = start
-
-    models, bad_models = multi_process_model_generation(
-        n_cpus, n_models, n_keep, keep_all, verbose)
+    # the problem is passed explicitly to the workers, so that several
+    # modelling jobs can run at the same time
+    problem = ModellingProblem(zscores, resolution, nloci, config=config,
+                               close_bins=close_bins)
 
     try:
         xpr = experiment
         crm = xpr.crm
-        for i, m in enumerate(models.values() + bad_models.values()):
-            m['description'] = {'identifier'     : xpr.identifier,
-                                'chromosome'     : coords['crm'],
-                                'start'          : xpr.resolution * coords['start'],
-                                'end'            : xpr.resolution * coords['end'],
-                                'species'        : crm.species,
-                                'cell type'      : xpr.cell_type,
-                                'experiment type': xpr.exp_type,
-                                'resolution'     : xpr.resolution,
-                                'assembly'       : crm.assembly}
-            for desc in xpr.description:
-                m['description'][desc] = xpr.description[desc]
-            for desc in crm.description:
-                m['description'][desc] = xpr.description[desc]
-            m['index'] = i
+        description = {'identifier'     : xpr.identifier,
+                       'chromosome'     : coords['crm'],
+                       'start'          : xpr.resolution * coords['start'],
+                       'end'            : xpr.resolution * coords['end'],
+                       'species'        : crm.species,
+                       'cell type'      : xpr.cell_type,
+                       'experiment type': xpr.exp_type,
+                       'resolution'     : xpr.resolution,
+                       'assembly'       : crm.assembly}
+        for desc in xpr.description:
+            description[desc] = xpr.description[desc]
+        for desc in crm.description:
+            description[desc] = xpr.description[desc]
     except AttributeError: # case we are doing optimization
-        for i, m in enumerate(models.values() + bad_models.values()):
-            m['index'] = i
+        description = None
+
     if outfile:
-        if exists(outfile):
-            old_models, old_bad_models = load(open(outfile))
-        else:
-            old_models, old_bad_models = {}, {}
-        models.update(old_models)
-        bad_models.update(old_bad_models)
-        out = open(outfile, 'w')
-        dump((models, bad_models), out)
-        out.close()
-    else:
-        return StructuralModels(NLOCI, models, bad_models, resolution,
-                                original_data=values, zscores=zscores,
-				config=CONFIG, experiment=experiment)
+        store = ModelStore(outfile)
+        store.append_metadata({'nloci'        : problem.nloci,
+                               'n_keep'       : n_keep,
+                               'resolution'   : resolution,
+                               'original_data': values,
+                               'zscores'      : zscores,
+                               'config'       : problem.config})
+        multi_process_model_generation(
+            problem, n_cpus, n_models, n_keep, keep_all, verbose, start=start,
+            store=store, description=description, pool=pool)
+        return
+
+    models, bad_models = multi_process_model_generation(
+        problem, n_cpus, n_models, n_keep, keep_all, verbose, start=start,
+        pool=pool)
+
+    for i, m in enumerate(models.values() + bad_models.values()):
+        if description:
+            m['description'] = dict(description)
+        m['index'] = i
+    return StructuralModels(problem.nloci, models, bad_models, resolution,
+                            original_data=values, zscores=zscores,
+                            config=problem.config, experiment=experiment)
 
 
-def multi_process_model_generation(n_cpus, n_models, n_keep, keep_all, verbose):
+class ModellingProblem(object):
+    """
+    Everything needed to generate a model, except the random seed: the
+    Z-scores, the particles and the parameters used to convert Z-scores into
+    distances. This object is sent to the workers generating the models.
+
+    :param zscores: the dictionary of the Z-score values calculated from the
+       Hi-C pairwise interactions
+    :param resolution:  number of nucleotides per Hi-C bin
+    :param nloci: number of particles to model
+    :param CONFIG['dmel_01'] config: a dictionary containing the standard
+       parameters used to generate the models (it is copied, not modified)
+    :param 1 close_bins: number of particles away a particle pair must be in
+       order to be considered as neighbors
+    """
+    def __init__(self, zscores, resolution, nloci, config=CONFIG['dmel_01'],
+                 close_bins=1):
+        self.config = dict(config)
+        # Particles initial radius
+        self.radius = float(resolution * self.config['scale']) / 2
+        self.config['lowrdist'] = self.radius * 2.
+
+        if self.config['lowrdist'] > self.config['maxdist']:
+            raise Exception('ERROR: we must prevent you from doing this for ' +
+                            'the safe of our universe...\n' +
+                            'In this case, maxdist must be higher than %s\n' % (
+                                self.config['lowrdist']) +
+                            '   -> resolution times scale -- %s*%s)' % (
+                                resolution, self.config['scale']))
+
+        # get slope and regression for all particles of the z-score data
+        zsc_vals = [zscores[i][j] for i in zscores for j in zscores[i]
+                    if abs(int(i) - int(j)) > 1] # condition is to avoid
+                                                 # taking into account selfies
+                                                 # and neighbors
+        zmin = min(zsc_vals)
+        zmax = max(zsc_vals)
+        self.slope, self.intercept = polyfit([zmin, zmax],
+                                             [self.config['maxdist'],
+                                              self.config['lowrdist']], 1)
+        # get slope and regression for neighbors of the z-score data
+        xarray = [zscores[i][j] for i in zscores for j in zscores[i]
+                  if abs(int(i) - int(j)) <= (close_bins + 1)]
+        yarray = [self.radius * 2 for _ in xrange(len(xarray))]
+        self.nslope, self.nintercept = polyfit(xarray, yarray, 1)
+
+        # if z-scores are generated outside TADbit they may not start at zero
+        first = min([int(j) for i in zscores for j in zscores[i]] +
+                    [int(i) for i in zscores])
+        self.loci  = range(first, nloci + 1 + first)
+        self.nloci = len(self.loci)
+
+        # Z-scores
+        self.pdist = zscores
+
+        # restraints are the same for all the models
+        self.restraints = self.compile_restraints()
+
+    def compile_restraints(self):
+        """
+        Computes the restraints between all pairs of particles. This table is
+        shared by all the models generated (only the random seed changes).
+
+        :returns: a tuple with an array of pairs of particle indexes, an
+           array with the kind of restraint of each pair (see
+           :func:`pairRestraint`), an array of distances and an array of forces
+        """
+        pairs, kinds, dists, kforces = [], [], [], []
+        names = [str(locus) for locus in self.loci]
+        for i in xrange(self.nloci):
+            for j in xrange(i + 1, self.nloci):
+                restraint = pairRestraint(self, names[i], names[j],
+                                          self.loci[i], self.loci[j])
+                if restraint is None:
+                    continue
+                pairs.append((i, j))
+                kinds.append(restraint[0])
+                dists.append(restraint[1])
+                kforces.append(restraint[2])
+        return (np.array(pairs, dtype=np.int32).reshape(-1, 2),
+                np.array(kinds, dtype=np.int8),
+                np.array(dists, dtype=float),
+                np.array(kforces, dtype=float))
+
+    def distConseq12(self, freq):
+        """
+        Function mapping the Z-scores into distances for neighbor fragments
+        """
+        return (self.nslope * freq) + self.nintercept
+
+    def distance(self, freq):
+        """
+        Function mapping the Z-scores into distances for non-neighbor fragments
+        """
+        return (self.slope * freq) + self.intercept
+
+
+MAX_BATCH = 100
+
+
+def multi_process_model_generation(problem, n_cpus, n_models, n_keep,
+                                   keep_all, verbose, start=1, store=None,
+                                   description=None, pool=None):
     """
     Parallelize the
     :func:`pytadbit.imp.imp_model.StructuralModels.generate_IMPmodel`.
 
+    Models are consumed as soon as they are generated, and only the best
+    n_keep are kept in memory (unless keep_all is True).
+
+    :param problem: a :class:`ModellingProblem`
     :param n_cpus: number of CPUs to use
     :param n_models: number of models to generate
+    :param n_keep: number of models to keep (the ones with lowest objective
+       function value)
+    :param keep_all: whether or not to keep the discarded models
+    :param 1 start: random seed of the first model
+    :param None store: a :class:`pytadbit.imp.modelstore.ModelStore` where to
+       append the models generated (instead of returning them). The models
+       already in the store are not generated
+    :param None description: dictionary describing the models (only used when
+       storing them)
+    :param None pool: a :py:class:`multiprocessing.Pool` where to generate the
+       models (it is not closed, and can be used for several problems). By
+       default a pool of n_cpus processes is created for this call only
     """
-    pool = mu.Pool(n_cpus)
-    jobs = {}
-    for rand_init in xrange(START, n_models + START):
-        jobs[rand_init] = pool.apply_async(_do_it, args=(rand_init, verbose))
-
-    pool.close()
-    pool.join()
-
-    results = []
-    for rand_init in xrange(START, n_models + START):
-        results.append((rand_init, jobs[rand_init].get()))
+    # a few batches of seeds per CPU, in order to balance the load without
+    # paying the communication for each model (batches are kept small, as
+    # they are held in memory until consumed)
+    rand_inits = range(start, n_models + start)
+    if store is not None:
+        done = store.rand_inits()
+        rand_inits = [rand_init for rand_init in rand_inits
+                      if not rand_init in done]
+    chunk = min(int(ceil(float(len(rand_inits)) / (n_cpus * 4))),
+                MAX_BATCH) or 1
+    # the problem is sent with each batch, so that the same workers can
+    # generate the models of different problems
+    tasks = [(problem, rand_inits[i:i + chunk], verbose)
+             for i in xrange(0, len(rand_inits), chunk)]
+    # the worst model kept is on top of the heap, ties are resolved by seed
+    # (the lowest seed is preferred)
+    best = []
+    discarded = []
+    own_pool = pool is None
+    if own_pool:
+        pool = mu.Pool(n_cpus)
+    try:
+        for batch in pool.imap_unordered(_generate_batch, tasks):
+            if store is not None:
+                for _, m in batch:
+                    if description:
+                        m['description'] = dict(description)
+                store.append(batch)
+                continue
+            for rand_init, m in batch:
+                item = (-m['objfun'], -rand_init, m)
+                if len(best) < n_keep:
+                    heappush(best, item)
+                    continue
+                item = heappushpop(best, item)
+                if keep_all:
+                    discarded.append(item)
+    finally:
+        if own_pool:
+            pool.terminate()
+            pool.join()
 
     models = {}
     bad_models = {}
-    for i, (_, m) in enumerate(
-        sorted(results, key=lambda x: x[1]['objfun'])[:n_keep]):
+    for i, (_, _, m) in enumerate(sorted(best, reverse=True)):
         models[i] = m
     if keep_all:
-        for i, (_, m) in enumerate(
-        sorted(results, key=lambda x: x[1]['objfun'])[n_keep:]):
-            bad_models[i+n_keep] = m
+        for i, (_, _, m) in enumerate(sorted(discarded, reverse=True)):
+            bad_models[i + n_keep] = m
     return models, bad_models
 
 
-def _do_it(num, verbose):
+def _generate_batch(args):
     """
-    Workaround in order pass to the multiprocessing queue a pickable object.
+    Generates the models of a batch of random seeds (top-level function, in
+    order to be passed to the multiprocessing pool).
     """
-    return generate_IMPmodel(num, verbose)
+    problem, rand_inits, verbose = args
+    return [(rand_init, generate_IMPmodel(rand_init, problem, verbose))
+            for rand_init in rand_inits]
 
 
-def generate_IMPmodel(rand_init, verbose=0):
+def generate_IMPmodel(rand_init, problem, verbose=0):
     """
     Generates one IMP model
     
     :param rand_init: random number kept as model key, for reproducibility.
+    :param problem: a :class:`ModellingProblem`
 
     :returns: a model, that is a dictionary with the log of the objective
        function value optimization, and the coordinates of each particles.
@@ -258,16 +380,16 @@ def generate_IMPmodel(rand_init, verbose=0):
              'ps'    : None,
              'pps'   : None}
     model['ps'] = ListSingletonContainer(IMP.core.create_xyzr_particles(
-        model['model'], NLOCI, RADIUS, 100000))
+        model['model'], problem.nloci, problem.radius, 100000))
     model['ps'].set_name("")
 
     # initialize each particles
-    for i in range(0, NLOCI):
+    for i in range(0, problem.nloci):
         p = model['ps'].get_particle(i)
-        p.set_name(str(LOCI[i]))
+        p.set_name(str(problem.loci[i]))
         # radius = diameter/2 (0.01/2)
         # computed following the relationship with the 30nm vs 40nm fiber
-        newrk = RADIUS
+        newrk = problem.radius
         p.set_value(model['rk'], newrk)
 
     # Restraints between pairs of LOCI proportional to the PDIST
@@ -279,11 +401,11 @@ def generate_IMPmodel(rand_init, verbose=0):
         model['pps']  = IMP.kernel.ParticlePairsTemp()
 
     # CALL BIG FUNCTION
-    addAllHarmonics(model, verbose=verbose)
+    addAllHarmonics(model, problem, verbose=verbose)
 
     # Setup an excluded volume restraint between a bunch of particles
     # with radius
-    r = IMP.core.ExcludedVolumeRestraint(model['ps'], CONFIG['kforce'])
+    r = IMP.core.ExcludedVolumeRestraint(model['ps'], problem.config['kforce'])
     model['model'].add_restraint(r)
 
     if verbose == 3:
@@ -324,10 +446,10 @@ def generate_IMPmodel(rand_init, verbose=0):
     stopCount = 10
     endLoopValue = 0.00001
     # alpha is a parameter that takes into account the number of particles in
-    # the model (NLOCI).
+    # the model (problem.nloci).
     # The multiplier (in this case is 1.0) is used to give a different weight
     # to the number of particles
-    alpha = 1.0 * NLOCI
+    alpha = 1.0 * problem.nloci
     # During the firsts hightemp iterations, do not stop the optimization
     hightemp = int(0.025 * NROUNDS)
     for i in range(0, hightemp):
@@ -399,99 +521,91 @@ def generate_IMPmodel(rand_init, verbose=0):
     return result
 
 
-def addAllHarmonics(model, verbose=False):
+def addAllHarmonics(model, problem, verbose=False):
     """
-    Add harmonics to all pair of particles.
+    Add harmonics to all pair of particles, as listed in the restraint table
+    of the problem (see :func:`ModellingProblem.compile_restraints`).
     """
-    for i in range(NLOCI):
+    pairs, kinds, dists, kforces = problem.restraints
+    for (i, j), kind, dist, kforce in zip(pairs.tolist(), kinds.tolist(),
+                                          dists.tolist(), kforces.tolist()):
         p1 = model['ps'].get_particle(i)
-        x = p1.get_name()
-        num_loci1 = int(x)
-
-        for j in range(i+1, NLOCI):
-            p2 = model['ps'].get_particle(j)
-            y = p2.get_name()
-            num_loci2 = int(y)
+        p2 = model['ps'].get_particle(j)
+        log = _ADD_RESTRAINT[kind](model, p1, p2, dist, kforce)
+        if verbose:
+            stdout.write(log)
 
-            log = addHarmonicPair(model, p1, p2, x, y, j, num_loci1, num_loci2)
-            if verbose:
-                stdout.write(log)
-                
 
-def addHarmonicPair(model, p1, p2, x, y, j, num_loci1, num_loci2):
+def pairRestraint(problem, x, y, num_loci1, num_loci2):
     """
-    add harmonic to a given pair of particles
+    Restraint to apply between a given pair of particles
 
-    :param model: a model dictionary that contains IMP model, singleton
-       containers...
-    :param p1: first particle
-    :param p2: second particle
+    :param problem: a :class:`ModellingProblem`
     :param x: first particle name
     :param y: second particle name
-    :param j: id of second particle
     :param num_loci1: index of the first particle
     :param num_loci2: index of the second particle
+
+    :returns: None if no restraint is needed, otherwise the kind of restraint
+       (HARMONIC_NEIGHBOR, HARMONIC_UPPER, HARMONIC or HARMONIC_LOWER), the
+       distance and the force of the restraint
     """
+    pdist  = problem.pdist
+    config = problem.config
     seqdist = num_loci2 - num_loci1
-    log = ''
     # SHORT RANGE DISTANCE BETWEEN TWO CONSECUTIVE LOCI
     if (seqdist == 1):
-        if (x in PDIST and y in PDIST[x]
-            and float(PDIST[x][y]) > CONFIG['upfreq']):
-            kforce1 = CONFIG['kforce']
-            log += addHarmonicNeighborsRestraints(model, p1, p2, kforce1)
+        if (x in pdist and y in pdist[x]
+            and float(pdist[x][y]) > config['upfreq']):
+            kforce1 = config['kforce']
+            return (HARMONIC_NEIGHBOR, problem.distConseq12(pdist[x][y]),
+                    kforce1)
             #prin t"harmo1\t%s\t%s\t%f\t%f" % ( x, y, dist1, kforce1)
         else:
-            kforce1 = CONFIG['kforce']
-            dist1 = (p1.get_value(model['rk']) + p2.get_value(model['rk']))
-            log += addHarmonicUpperBoundRestraints(model, p1, p2,
-                                                   dist1, kforce1)
+            kforce1 = config['kforce']
+            dist1 = (problem.radius + problem.radius)
+            return (HARMONIC_UPPER, dist1, kforce1)
             #print "upper1\t%s\t%s\t%f\t%f" % ( x, y, dist1, kforce1)
 
             # SHORT RANGE DISTANCE BETWEEN TWO SEQDIST = 2
     elif (seqdist == 2):
-#        if (x in PDIST and y in PDIST[x] and float(PDIST[x][y]) > CONFIG['upfreq']):
-#            kforce2 = CONFIG['kforce']
+#        if (x in pdist and y in pdist[x] and float(pdist[x][y]) > config['upfreq']):
+#            kforce2 = config['kforce']
 #            log += addHarmonicNeighborsRestraints(model, p1, p2, kforce2)
 #        else:
 #            p3 = model['ps'].get_particle(j-1)
-#            kforce2 = CONFIG['kforce']
+#            kforce2 = config['kforce']
 #            dist2 = (p1.get_value(model['rk']) + p2.get_value(model['rk'])
 #                    + 2.0 * p3.get_value(model['rk']))
 #            log += addHarmonicUpperBoundRestraints(model, p1, p2,
 #                                                   dist2, kforce2)
 #            #print "upper2\t%s\t%s\t%f\t%f" % ( x, y, dist2, kforce2)
-        p3 = model['ps'].get_particle(j-1)
-        kforce2 = CONFIG['kforce']
-        dist2 = (p1.get_value(model['rk']) + p2.get_value(model['rk'])
-                + 2.0 * p3.get_value(model['rk']))
-        log += addHarmonicUpperBoundRestraints(model, p1, p2,
-                                               dist2, kforce2)
+        kforce2 = config['kforce']
+        dist2 = (problem.radius + problem.radius + 2.0 * problem.radius)
+        return (HARMONIC_UPPER, dist2, kforce2)
         #print "upper2\t%s\t%s\t%f\t%f" % ( x, y, dist2, kforce2)
 
     else:
 
         # LONG RANGE DISTANCE DISTANCE BETWEEN TWO NON-CONSECUTIVE LOCI
-        if (x in PDIST and y in PDIST[x]):
+        if (x in pdist and y in pdist[x]):
             # FREQUENCY > UPFREQ
-            if (float(PDIST[x][y]) > CONFIG['upfreq']):
-                kforce3 = kForce(float(PDIST[x][y]))
-                log += addHarmonicRestraints(model, p1, p2,
-                                             float(PDIST[x][y]), kforce3)
+            if (float(pdist[x][y]) > config['upfreq']):
+                kforce3 = kForce(float(pdist[x][y]))
+                return (HARMONIC, problem.distance(float(pdist[x][y])), kforce3)
                 #print "harmo3\t%s\t%s\t%f\t%f" % ( x, y, dist3, kforce3)
             # FREQUENCY > LOW THIS HAS TO BE THE THRESHOLD FOR
             # "PHYSICAL INTERACTIONS"
-            elif (float(PDIST[x][y]) < CONFIG['lowfreq']):
-                kforce3 = kForce(float(PDIST[x][y]))
-                log += addHarmonicLowerBoundRestraints(model, p1, p2,
-                                                       float(PDIST[x][y]),
-                                                       kforce3)
+            elif (float(pdist[x][y]) < config['lowfreq']):
+                kforce3 = kForce(float(pdist[x][y]))
+                return (HARMONIC_LOWER, problem.distance(float(pdist[x][y])),
+                        kforce3)
            #print "lower3\t%s\t%s\t%f\t%f" % ( x, y, dist3, kforce3)
             else:
-                return log
+                return None
 
-        # X IN PDIST BY Y NOT IN PDIST[X]
-        elif (x in PDIST): # and y not in PDIST[x]):
+        # X IN pdist BY Y NOT IN pdist[X]
+        elif (x in pdist): # and y not in pdist[x]):
             if (num_loci2 > num_loci1):
                 prev_num = num_loci2 - 1
                 pnext_num = num_loci2 + 1
@@ -501,54 +615,51 @@ def addHarmonicPair(model, p1, p2, x, y, j, num_loci1, num_loci2):
             prev = str(prev_num)
             pnext = str(pnext_num)
 
-            if (prev in PDIST[x] and pnext in PDIST[x]):
-                virt_freq = (float(PDIST[x][prev]) +
-                             float(PDIST[x][pnext])) / 2.0
-                if (virt_freq > CONFIG['upfreq']):
+            if (prev in pdist[x] and pnext in pdist[x]):
+                virt_freq = (float(pdist[x][prev]) +
+                             float(pdist[x][pnext])) / 2.0
+                if (virt_freq > config['upfreq']):
                     kforce4 = 0.5 * kForce(virt_freq)
-                    log += addHarmonicRestraints(model, p1, p2,
-                                                 virt_freq, kforce4)
+                    return (HARMONIC, problem.distance(virt_freq), kforce4)
                     #print "harmo4\t%s\t%s\t%f\t%f" % ( x, y, dist4, kforce4)
-                elif (virt_freq < CONFIG['lowfreq']):
+                elif (virt_freq < config['lowfreq']):
                     kforce4 = 0.5 * kForce(virt_freq)
-                    log += addHarmonicLowerBoundRestraints(model, p1, p2,
-                                                           virt_freq, kforce4)
+                    return (HARMONIC_LOWER, problem.distance(virt_freq),
+                            kforce4)
                     #print "lower4\t%s\t%s\t%f\t%f" % ( x, y, dist4, kforce4)
                 else:
-                    return log
+                    return None
 
-            elif (pnext in PDIST[x]):
-                virt_freq = float(PDIST[x][pnext])
-                if (virt_freq > CONFIG['upfreq']):
+            elif (pnext in pdist[x]):
+                virt_freq = float(pdist[x][pnext])
+                if (virt_freq > config['upfreq']):
                     kforce4 = 0.5 * kForce(virt_freq)
-                    log += addHarmonicRestraints(model, p1, p2,
-                                                 virt_freq, kforce4)
+                    return (HARMONIC, problem.distance(virt_freq), kforce4)
                     #print "harmo5\t%s\t%s\t%f\t%f" % ( x, y, dist4, kforce4)
-                elif (virt_freq < CONFIG['lowfreq']):
+                elif (virt_freq < config['lowfreq']):
                     kforce4 = 0.5 * kForce(virt_freq)
-                    log += addHarmonicLowerBoundRestraints(model, p1, p2,
-                                                           virt_freq, kforce4)
+                    return (HARMONIC_LOWER, problem.distance(virt_freq),
+                            kforce4)
                     #print "lower5\t%s\t%s\t%f\t%f" % ( x, y, dist4, kforce4)
                 else:
-                    return log
+                    return None
 
-            elif (prev in PDIST[x]):
-                virt_freq = float(PDIST[x][prev])
-                if (virt_freq > CONFIG['upfreq']):
+            elif (prev in pdist[x]):
+                virt_freq = float(pdist[x][prev])
+                if (virt_freq > config['upfreq']):
                     kforce4 = 0.5 * kForce(virt_freq)
-                    log += addHarmonicRestraints(model, p1, p2,
-                                                 virt_freq, kforce4)
+                    return (HARMONIC, problem.distance(virt_freq), kforce4)
                     #print "harmo6\t%s\t%s\t%f\t%f" % ( x, y, dist4, kforce4)
-                elif (virt_freq < CONFIG['lowfreq']):
+                elif (virt_freq < config['lowfreq']):
                     kforce4 = 0.5 * kForce(virt_freq)
-                    log += addHarmonicLowerBoundRestraints(model, p1, p2,
-                                                           virt_freq, kforce4)
+                    return (HARMONIC_LOWER, problem.distance(virt_freq),
+                            kforce4)
                     #print "lower6\t%s\t%s\t%f\t%f" % ( x, y, dist4, kforce4)
                 else:
-                    return log
+                    return None
 
             else:
-                return log
+                return None
 
         # MISSING DATA (X)
         else:
@@ -568,83 +679,65 @@ def addHarmonicPair(model, p1, p2, x, y, j, num_loci1, num_loci2):
             pnext = str(pnext_num)
 
             # CASE 1
-            if (xprev in PDIST and xpnext in PDIST):
-                if (y in PDIST[xprev] and y in PDIST[xpnext]):
-                    virt_freq = (float(PDIST[xprev][y]) +
-                                 float(PDIST[xpnext][y]) ) / 2.0
+            if (xprev in pdist and xpnext in pdist):
+                if (y in pdist[xprev] and y in pdist[xpnext]):
+                    virt_freq = (float(pdist[xprev][y]) +
+                                 float(pdist[xpnext][y]) ) / 2.0
                     kforce4 = 0.5 * kForce(virt_freq)
-                elif (y in PDIST[xprev]):
-                    virt_freq = float(PDIST[xprev][y])
+                elif (y in pdist[xprev]):
+                    virt_freq = float(pdist[xprev][y])
                     kforce4 = 0.5 * kForce(virt_freq)
-                elif (y in PDIST[xpnext]):
-                    virt_freq = float(PDIST[xpnext][y])
+                elif (y in pdist[xpnext]):
+                    virt_freq = float(pdist[xpnext][y])
                     kforce4 = 0.5 * kForce(virt_freq)
                 else:
-                    return log
-
-                if (virt_freq > CONFIG['upfreq']):
-                    log += addHarmonicRestraints(model, p1, p2,
-                                                 virt_freq, kforce4)
-                elif (virt_freq < CONFIG['lowfreq']):
-                    log += addHarmonicLowerBoundRestraints(model, p1, p2,
-                                                           virt_freq, kforce4)
+                    return None
+
+                if (virt_freq > config['upfreq']):
+                    return (HARMONIC, problem.distance(virt_freq), kforce4)
+                elif (virt_freq < config['lowfreq']):
+                    return (HARMONIC_LOWER, problem.distance(virt_freq),
+                            kforce4)
                     #print "lower7\t%s\t%s\t%f\t%f" % ( x, y, dist4, kforce4)
                 else:
-                    return log
+                    return None
 
             # CASE 2
-            elif (xprev in PDIST and y in PDIST[xprev]):
-                virt_freq = float(PDIST[xprev][y])
-                if (virt_freq > CONFIG['upfreq']):
+            elif (xprev in pdist and y in pdist[xprev]):
+                virt_freq = float(pdist[xprev][y])
+                if (virt_freq > config['upfreq']):
                     kforce4 = 0.5 * kForce(virt_freq)
-                    log += addHarmonicRestraints(model, p1, p2,
-                                                 virt_freq, kforce4)
+                    return (HARMONIC, problem.distance(virt_freq), kforce4)
                     #print "harmo8\t%s\t%s\t%f\t%f" % ( x, y, dist4, kforce4)
-                elif (virt_freq < CONFIG['lowfreq']):
+                elif (virt_freq < config['lowfreq']):
                     kforce4 = 0.5 * kForce(virt_freq)
-                    log += addHarmonicLowerBoundRestraints(model, p1, p2,
-                                                           virt_freq, kforce4)
+                    return (HARMONIC_LOWER, problem.distance(virt_freq),
+                            kforce4)
                     #print "lower8\t%s\t%s\t%f\t%f" % ( x, y, dist4, kforce4)
                 else:
-                    return log
+                    return None
 
             # CASE 3
-            elif (xpnext in PDIST and y in PDIST[xpnext]):
-                virt_freq = float(PDIST[xpnext][y])
-                if (virt_freq > CONFIG['upfreq']):
+            elif (xpnext in pdist and y in pdist[xpnext]):
+                virt_freq = float(pdist[xpnext][y])
+                if (virt_freq > config['upfreq']):
                     kforce4 = 0.5 * kForce(virt_freq)
-                    log += addHarmonicRestraints(model, p1, p2,
-                                                 virt_freq, kforce4)
+                    return (HARMONIC, problem.distance(virt_freq), kforce4)
                     #print "harmo9\t%s\t%s\t%f\t%f" % ( x, y, dist4, kforce4)
-                elif (virt_freq < CONFIG['lowfreq']):
+                elif (virt_freq < config['lowfreq']):
                     kforce4 = 0.5 * kForce(virt_freq)
-                    log += addHarmonicLowerBoundRestraints(model, p1, p2,
-                                                           virt_freq, kforce4)
+                    return (HARMONIC_LOWER, problem.distance(virt_freq),
+                            kforce4)
                     #print "lower9\t%s\t%s\t%f\t%f" % ( x, y, dist4, kforce4)
                 else:
-                    return log
+                    return None
 
             else:
-                return log
-    return log
-
-
-def distConseq12(freq):
-    """
-    Function mapping the Z-scores into distances for neighbor fragments
-    """
-    return (NSLOPE * freq) + NINTERCEPT
-
+                return None
+    return None
 
-def distance(freq):
-    """
-    Function mapping the Z-scores into distances for non-neighbor fragments
-    """
-    return (SLOPE * freq) + INTERCEPT
 
-
-def addHarmonicNeighborsRestraints(model, p1, p2, kforce):
-    dist = distConseq12(PDIST[p1.get_name()][p2.get_name()])
+def addHarmonicNeighborsRestraints(model, p1, p2, dist, kforce):
     p = IMP.ParticlePair(p1, p2)
     model['pps'].append(p)
     dr = IMP.core.DistanceRestraint(IMP.core.Harmonic(dist, kforce),p1, p2)
@@ -664,8 +757,7 @@ def addHarmonicUpperBoundRestraints(model, p1, p2, dist, kforce):
                                         dist, kforce)
 
 
-def addHarmonicRestraints(model, p1, p2, freq, kforce):
-    dist = distance(freq)
+def addHarmonicRestraints(model, p1, p2, dist, kforce):
     p = IMP.ParticlePair(p1, p2)
     model['pps'].append(p)
     dr = IMP.core.DistanceRestraint(IMP.core.Harmonic(dist, kforce),p1, p2)
@@ -673,8 +765,7 @@ def addHarmonicRestraints(model, p1, p2, freq, kforce):
     return "addHa\t%s\t%s\t%f\t%f\n" % (p1.get_name(), p2.get_name(),
                                         dist, kforce)
 
-def addHarmonicLowerBoundRestraints(model, p1, p2, freq, kforce):
-    dist = distance(freq)
+def addHarmonicLowerBoundRestraints(model, p1, p2, dist, kforce):
     p = IMP.ParticlePair(p1, p2)
     model['pps'].append(p)
     dr = IMP.core.DistanceRestraint(IMP.core.HarmonicLowerBound(dist, kforce),
@@ -684,6 +775,15 @@ def addHarmonicLowerBoundRestraints(model, p1, p2, freq, kforce):
                                         dist, kforce)
 
 
+# kinds of restraints in the restraint table of a ModellingProblem
+HARMONIC_NEIGHBOR, HARMONIC_UPPER, HARMONIC, HARMONIC_LOWER = range(4)
+
+_ADD_RESTRAINT = {HARMONIC_NEIGHBOR: addHarmonicNeighborsRestraints,
+                  HARMONIC_UPPER   : addHarmonicUpperBoundRestraints,
+                  HARMONIC         : addHarmonicRestraints,
+                  HARMONIC_LOWER   : addHarmonicLowerBoundRestraints}
+
+
 def kForce(freq):
     """
     Function to assign to each restraint a force proportional to the underlying
@@ -8,12 +8,12 @@ from pytadbit.utils.extraviews      import color_residues, chimera_view
 from pytadbit.utils.extraviews      import tadbit_savefig, plot_3d_model
 from pytadbit.utils.three_dim_stats import generate_sphere_points
 from pytadbit.utils.three_dim_stats import fast_square_distance
-from pytadbit.utils.three_dim_stats import build_mesh
+from pytadbit.utils.three_dim_stats import build_mesh, list_of_floats
 from pytadbit.utils.extraviews      import tad_coloring
 from pytadbit.utils.extraviews      import tad_border_coloring
 from pytadbit.utils.tadmaths        import newton_raphson
 from scipy.interpolate              import spline
-from numpy                          import linspace
+from numpy                          import linspace, ndarray
 from warnings                       import warn
 from re                             import findall, compile as compil
 from math                           import sqrt, pi
@@ -161,9 +161,33 @@ class IMPmodel(dict):
     - log_objfun: The list of IMP objective function values
     - objfun: The final objective function value of the corresponding model
     - rand_init: Random number generator feed (needed for model reproducibility)
-    - x, y, z: 3D coordinates of each particles. Each represented as a list
+    - x, y, z: 3D coordinates of each particles. Each represented as a list,
+      or, for the models of a
+      :class:`pytadbit.imp.structuralmodels.StructuralModels`, as a view on
+      the array holding the coordinates of all the models
 
     """
+    def __setitem__(self, key, value):
+        # coordinates viewing the array of a StructuralModels (the one the
+        # model was bound to) are updated in place, so the model stays in the
+        # array. Any other array (e.g. of the user) is replaced, not modified
+        if key in ('x', 'y', 'z'):
+            coords = self.get(key)
+            bound = self.__dict__.get('_array')
+            if (bound is not None and isinstance(coords, ndarray) and
+                coords.base is bound and len(value) == len(coords)):
+                coords[:] = value
+                return
+        dict.__setitem__(self, key, value)
+
+
+    def __getstate__(self):
+        # the array of the StructuralModels is neither copied nor pickled
+        state = dict(self.__dict__)
+        state.pop('_array', None)
+        return state
+
+
     def __str__(self):
         try:
             return ('IMP model ranked %s (%s particles) with: \n' +
@@ -569,7 +593,8 @@ class IMPmodel(dict):
         """
 
         points, dots, superdots, points2dots = build_mesh(
-            self['x'], self['y'], self['z'], len(self), nump, radius,
+            list_of_floats(self['x']), list_of_floats(self['y']),
+            list_of_floats(self['z']), len(self), nump, radius,
             superradius, include_edges)
 
         
@@ -745,8 +770,8 @@ class IMPmodel(dict):
                 str(self['radius']) +
                 '\" note=\"%s\"/>\n')
         for i in xrange(len(self['x'])):
-            out += form % (i + 1,
-                           self['x'][i], self['y'][i], self['z'][i],
+            out += form % (i + 1, float(self['x'][i]),
+                           float(self['y'][i]), float(self['z'][i]),
                            color[i][0], color[i][1], color[i][2], i + 1)
         form = ('<link id1=\"%s\" id2=\"%s\" r=\"1\" ' +
                 'g=\"1\" b=\"1\" radius=\"' + str(10) +
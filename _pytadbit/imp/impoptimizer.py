@@ -144,52 +144,59 @@ class IMPoptimizer(object):
                                        if not my_round(i) in self.scale_range] +
                                       self.scale_range)
         
-        # grid search
+        # grid search (the models of all the points are generated by the
+        # same processes)
         models = {}
         count = 0
-        for scale in [my_round(i) for i in scale_arange]:
-            for maxdist in [my_round(i) for i in maxdist_arange]:
-                for upfreq in [my_round(i) for i in upfreq_arange]:
-                    for lowfreq in [my_round(i) for i in lowfreq_arange]:
-                        if (scale, maxdist, upfreq, lowfreq) in self.results:
-                            continue
-                        if not self.cutoff:
-                            cutoff = int(2 * self.resolution * float(scale))
-                        else:
-                            cutoff = self.cutoff
-                        tmp = {'kforce'   : 5,
-                               'lowrdist' : 100,
-                               'maxdist'  : int(maxdist),
-                               'upfreq'   : float(upfreq),
-                               'lowfreq'  : float(lowfreq),
-                               'scale'    : float(scale)}
-                        tdm = generate_3d_models(self.zscores, self.resolution,
-                                                 self.nloci, self.n_models,
-                                                 self.n_keep, config=tmp,
-                                                 n_cpus=n_cpus,
-                                                 values=self.values,
-                                                 close_bins=self.close_bins)
-                        count += 1
-                        if verbose:
-                            verb = '%5s  %s %s %s %s ' % (
-                                count, upfreq, lowfreq, maxdist, scale)
-                        try:
-                            result = tdm.correlate_with_real_data(
-                                cutoff=cutoff, corr=corr,
-                                off_diag=off_diag)[0]
+        pool = mu.Pool(n_cpus)
+        try:
+            for scale in [my_round(i) for i in scale_arange]:
+                for maxdist in [my_round(i) for i in maxdist_arange]:
+                    for upfreq in [my_round(i) for i in upfreq_arange]:
+                        for lowfreq in [my_round(i) for i in lowfreq_arange]:
+                            key = (scale, maxdist, upfreq, lowfreq)
+                            if key in self.results:
+                                continue
+                            if not self.cutoff:
+                                cutoff = int(2 * self.resolution *
+                                             float(scale))
+                            else:
+                                cutoff = self.cutoff
+                            tmp = {'kforce'   : 5,
+                                   'lowrdist' : 100,
+                                   'maxdist'  : int(maxdist),
+                                   'upfreq'   : float(upfreq),
+                                   'lowfreq'  : float(lowfreq),
+                                   'scale'    : float(scale)}
+                            tdm = generate_3d_models(
+                                self.zscores, self.resolution, self.nloci,
+                                self.n_models, self.n_keep, config=tmp,
+                                n_cpus=n_cpus, pool=pool, values=self.values,
+                                close_bins=self.close_bins)
+                            count += 1
                             if verbose:
-                                if verbose == 2:
-                                    stderr.write(verb + str(result) + '\n')
-                                else:
-                                    print verb + str(result)
-                        except Exception, e:
-                            print 'ERROR %s' % e
-                            continue
-                        # store
-                        self.results[(scale, maxdist, upfreq, lowfreq)] = result
-                        if savedata:
-                            models[(scale, maxdist, upfreq, lowfreq)
-                                   ] = tdm._reduce_models(minimal=True)
+                                verb = '%5s  %s %s %s %s ' % (
+                                    count, upfreq, lowfreq, maxdist, scale)
+                            try:
+                                result = tdm.correlate_with_real_data(
+                                    cutoff=cutoff, corr=corr,
+                                    off_diag=off_diag)[0]
+                                if verbose:
+                                    if verbose == 2:
+                                        stderr.write(verb + str(result) + '\n')
+                                    else:
+                                        print verb + str(result)
+                            except Exception, e:
+                                print 'ERROR %s' % e
+                                continue
+                            # store
+                            self.results[key] = result
+                            if savedata:
+                                models[key] = tdm._reduce_models(minimal=True)
+        finally:
+            pool.terminate()
+            pool.join()
+
         if savedata:
             out = open(savedata, 'w')
             dump(models, out)
@@ -0,0 +1,263 @@
+"""
+18 Oct 2026
+
+Append-only on-disk store of IMP models.
+"""
+from cPickle     import dumps, loads, HIGHEST_PROTOCOL
+from struct      import Struct
+from zlib        import crc32
+from collections import MutableMapping
+from fcntl       import flock, LOCK_EX
+from os          import open as os_open, write, close
+from os          import O_WRONLY, O_APPEND, O_CREAT
+from os.path     import exists, getsize
+
+# each record is: magic, crc32 of the payload, length of the payload, random
+# initial number and objective function of the model, followed by the
+# pickled payload
+_HEADER = Struct('<4sIQqd')
+_MODEL  = 'TBMM' # a model
+_META   = 'TBMD' # information about the modelling run (nloci, config...)
+
+
+def is_model_store(path_f):
+    """
+    :param path_f: path to a file
+
+    :returns: True if the file is a :class:`ModelStore`
+    """
+    if not exists(path_f):
+        return False
+    return open(path_f, 'rb').read(4) in (_MODEL, _META)
+
+
+class ModelStore(object):
+    """
+    Append-only file of IMP models, with one record per model keyed by its
+    random initial number.
+
+    Records are written with a single system call while holding a lock on the
+    file, so several modelling jobs (e.g. batches of random initial numbers
+    run on a cluster) can append to the same store. A record left incomplete
+    by a killed job is skipped when reading the store, the job can be resumed
+    (models already in the store are not generated again, see
+    :func:`pytadbit.imp.imp_modelling.generate_3d_models`).
+
+    :param path_f: path to the store (created at first write)
+    """
+
+    def __init__(self, path_f):
+        self.path = path_f
+        if exists(path_f) and getsize(path_f) and not is_model_store(path_f):
+            raise Exception('ERROR: %s is not a model store.\n' % (path_f))
+
+
+    def __len__(self):
+        return len(self.index())
+
+
+    def __iter__(self):
+        for rand_init, (offset, length, _) in sorted(self.index().items()):
+            yield rand_init, self.read(offset, length)
+
+
+    def _write(self, records):
+        data = ''.join(records)
+        fd = os_open(self.path, O_WRONLY | O_APPEND | O_CREAT, 0644)
+        try:
+            flock(fd, LOCK_EX) # released when closed
+            while data:
+                data = data[write(fd, data):]
+        finally:
+            close(fd)
+
+
+    def append(self, models):
+        """
+        Adds models to the store.
+
+        :param models: a list of tuples (random initial number, model)
+        """
+        records = []
+        for rand_init, model in models:
+            payload = dumps(model, HIGHEST_PROTOCOL)
+            records.append(_HEADER.pack(_MODEL, crc32(payload) & 0xffffffff,
+                                        len(payload), int(rand_init),
+                                        model['objfun']) + payload)
+        if records:
+            self._write(records)
+
+
+    def append_metadata(self, metadata):
+        """
+        Adds information about a modelling run (the last one added is the one
+        returned by :func:`ModelStore.metadata`).
+
+        :param metadata: a dictionary
+        """
+        payload = dumps(metadata, HIGHEST_PROTOCOL)
+        self._write([_HEADER.pack(_META, crc32(payload) & 0xffffffff,
+                                  len(payload), -1, 0.) + payload])
+
+
+    def _records(self):
+        """
+        Reads the headers of all the records (payloads are skipped).
+
+        :returns: a list of tuples (magic, offset of the payload, length of
+           the payload, random initial number, objective function)
+        """
+        records = []
+        if not exists(self.path):
+            return records
+        size = getsize(self.path)
+        fh = open(self.path, 'rb')
+        pos = 0
+        while pos + _HEADER.size <= size:
+            fh.seek(pos)
+            magic, _, length, rand_init, objfun = _HEADER.unpack(
+                fh.read(_HEADER.size))
+            end = pos + _HEADER.size + length
+            if magic in (_MODEL, _META) and end <= size:
+                fh.seek(end)
+                # the next record should start just after this one
+                if end == size or fh.read(4) in (_MODEL, _META):
+                    records.append((magic, pos + _HEADER.size, length,
+                                    rand_init, objfun))
+                    pos = end
+                    continue
+            # incomplete record: jump to the next one
+            pos = _next_record(fh, pos + 1)
+        fh.close()
+        return records
+
+
+    def index(self):
+        """
+        :returns: a dictionary with, for each random initial number, the
+           offset and length of the model in the file, and its objective
+           function value (if a model was stored twice, the first one is kept)
+        """
+        index = {}
+        for magic, offset, length, rand_init, objfun in self._records():
+            if magic == _MODEL and not rand_init in index:
+                index[rand_init] = (offset, length, objfun)
+        return index
+
+
+    def rand_inits(self):
+        """
+        :returns: the set of random initial numbers of the models stored
+        """
+        return set(self.index())
+
+
+    def read(self, offset, length):
+        """
+        Reads one record of the store.
+
+        :param offset: position of the payload in the file
+        :param length: length of the payload
+
+        :returns: the object stored
+        """
+        fh = open(self.path, 'rb')
+        fh.seek(offset - _HEADER.size)
+        _, crc, _, _, _ = _HEADER.unpack(fh.read(_HEADER.size))
+        payload = fh.read(length)
+        fh.close()
+        if crc32(payload) & 0xffffffff != crc:
+            raise Exception('ERROR: corrupted model in %s (position %s).\n' % (
+                self.path, offset))
+        return loads(payload)
+
+
+    def metadata(self):
+        """
+        :returns: the information stored about the last modelling run
+        """
+        metas = [rec for rec in self._records() if rec[0] == _META]
+        if not metas:
+            return None
+        return self.read(*metas[-1][1:3])
+
+
+    def ranked_models(self, n_keep=None):
+        """
+        Ranks the models stored according to their objective function value
+        (models are not read from the file until they are used).
+
+        :param None n_keep: number of models to be returned as 'best models',
+           by default all
+
+        :returns: two dictionaries, one with the n_keep best models and the
+           other with the rest, both keyed by rank
+        """
+        index = self.index()
+        ranked = [index[r][:2] for r in sorted(index, key=lambda r: (
+            index[r][2], r))]
+        if n_keep is None:
+            n_keep = len(ranked)
+        return (StoredModels(self, ranked[:n_keep]),
+                StoredModels(self, ranked[n_keep:], first=n_keep))
+
+
+def _next_record(fh, pos, block=1 << 20):
+    """
+    Position of the next magic number in the file, starting at pos (or the
+    end of the file).
+    """
+    while True:
+        fh.seek(pos)
+        data = fh.read(block + 3)
+        if len(data) < 4:
+            return pos + len(data)
+        found = [i for i in (data.find(_MODEL), data.find(_META)) if i >= 0]
+        if found:
+            return pos + min(found)
+        pos += block
+
+
+class StoredModels(MutableMapping):
+    """
+    Dictionary of models, keyed by rank, read from a :class:`ModelStore` only
+    when accessed (and then kept in memory).
+
+    :param store: a :class:`ModelStore`
+    :param records: list of (offset, length) of the models, sorted by rank
+    :param 0 first: rank of the first model
+    """
+
+    def __init__(self, store, records, first=0):
+        self._store   = store
+        self._records = dict([(first + i, rec)
+                              for i, rec in enumerate(records)])
+        self._models  = {}
+
+
+    def __getitem__(self, rank):
+        if not rank in self._models:
+            model = self._store.read(*self._records[rank])
+            model['index'] = rank
+            self._models[rank] = model
+        return self._models[rank]
+
+
+    def __setitem__(self, rank, model):
+        self._models[rank] = model
+        self._records.pop(rank, None)
+
+
+    def __delitem__(self, rank):
+        if not rank in self._models and not rank in self._records:
+            raise KeyError(rank)
+        self._models.pop(rank, None)
+        self._records.pop(rank, None)
+
+
+    def __iter__(self):
+        return iter(sorted(set(self._records) | set(self._models)))
+
+
+    def __len__(self):
+        return len(set(self._records) | set(self._models))
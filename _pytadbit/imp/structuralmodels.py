@@ -6,20 +6,24 @@
 from pytadbit.utils.three_dim_stats import calc_consistency, mass_center
 from pytadbit.utils.three_dim_stats import dihedral, calc_eqv_rmsd
 from pytadbit.utils.three_dim_stats import get_center_of_mass, distance
+from pytadbit.utils.three_dim_stats import list_of_floats
 from pytadbit.utils.tadmaths        import calinski_harabasz, nozero_log_list
 from pytadbit.utils.extraviews      import plot_3d_model
 from pytadbit.utils.extraviews      import chimera_view, tadbit_savefig
 from pytadbit.utils.extraviews      import augmented_dendrogram, plot_hist_box
 from pytadbit.imp.impmodel          import IMPmodel
+from pytadbit.imp.modelstore        import ModelStore, is_model_store
 from pytadbit.centroid              import centroid_wrapper
 from pytadbit.aligner3d             import aligner3d_wrapper
 from cPickle                        import load, dump
+from copy                           import copy
 from subprocess                     import Popen, PIPE
 from math                           import acos, degrees, pi, sqrt
 from numpy                          import median as np_median
 from numpy                          import mean as np_mean
 from numpy                          import std as np_std, log2
 from numpy                          import array, cross, dot, ma, isnan
+from numpy                          import empty, ndarray, fill_diagonal
 from numpy                          import histogram, linspace
 from numpy.linalg                   import norm
 from scipy.cluster.hierarchy        import linkage, fcluster
@@ -37,16 +41,30 @@ except ImportError:
     warn('matplotlib not found\n')
 
 
-def load_structuralmodels(path_f):
+def load_structuralmodels(path_f, n_keep=None):
     """
     Loads :class:`pytadbit.imp.structuralmodels.StructuralModels` from a file
     (generated with
-    :class:`pytadbit.imp.structuralmodels.StructuralModels.save_models`).
+    :class:`pytadbit.imp.structuralmodels.StructuralModels.save_models`), or
+    from a :class:`pytadbit.imp.modelstore.ModelStore` (generated with the
+    outfile parameter of
+    :func:`pytadbit.imp.imp_modelling.generate_3d_models`). In the latter case
+    the models are read from the store only when needed.
     
-    :param path: to the pickled StructuralModels object.
+    :param path: to the pickled StructuralModels object, or to the store.
+    :param None n_keep: number of best models, only used when loading from a
+       store (by default the n_keep used to generate the models)
 
     :returns: a :class:`pytadbit.imp.imp_model.StructuralModels`.
     """
+    if is_model_store(path_f):
+        store = ModelStore(path_f)
+        meta = store.metadata()
+        models, bad_models = store.ranked_models(n_keep or meta['n_keep'])
+        return StructuralModels(
+            nloci=meta['nloci'], models=models, bad_models=bad_models,
+            resolution=meta['resolution'], original_data=meta['original_data'],
+            config=meta['config'], zscores=meta['zscores'])
     svd = load(open(path_f))
     return StructuralModels(
         nloci=svd['nloci'], models=svd['models'], bad_models=svd['bad_models'],
@@ -54,6 +72,46 @@ def load_structuralmodels(path_f):
         clusters=svd['clusters'], config=svd['config'], zscores=svd['zscore'])
 
 
+def _bind_coordinates(model, coords):
+    """
+    Replaces the coordinates of a model by views on an array, and marks the
+    model as bound to the array owning them (so that new coordinates are
+    written in this array).
+
+    :param model: an :class:`pytadbit.imp.impmodel.IMPmodel`
+    :param coords: array of shape (nloci, 3), view on the array of the models
+    """
+    for k, key in enumerate(('x', 'y', 'z')):
+        dict.__setitem__(model, key, coords[:, k])
+    if isinstance(model, IMPmodel):
+        model._array = model['x'].base
+
+
+def _unbind_coordinates(model):
+    """
+    Replaces the coordinates of a model by lists (the model no longer uses
+    the array of a StructuralModels object).
+
+    :param model: an :class:`pytadbit.imp.impmodel.IMPmodel`
+    """
+    for key in ('x', 'y', 'z'):
+        if isinstance(model[key], ndarray):
+            dict.__setitem__(model, key, model[key].tolist())
+    if isinstance(model, IMPmodel):
+        model.__dict__.pop('_array', None)
+
+
+def _square_distances(coords):
+    """
+    :param coords: array of shape (nloci, 3) with the coordinates of a model
+
+    :returns: array with the square of the distance between each pair of
+       particles
+    """
+    dif = coords[:, None, :] - coords[None, :, :]
+    return dif[:, :, 0]**2 + dif[:, :, 1]**2 + dif[:, :, 2]**2
+
+
 class StructuralModels(object):
     """
     This class contains three-dimensional models generated from a single Hi-C
@@ -78,6 +136,10 @@ class StructuralModels(object):
     :param None config: a dictionary containing the parameter to be used for the
        generation of three dimensional models.
 
+    The coordinates of the 'best models' are stored in a single array of shape
+    (number of models, nloci, 3), the coordinates of each model being views on
+    this array.
+
     """
 
     def __init__(self, nloci, models, bad_models, resolution,
@@ -93,6 +155,8 @@ class StructuralModels(object):
         self._zscores       = zscores       # only used for plotting
         self._config        = config or {}
         self.experiment     = experiment
+        self._coords        = None # coordinates of all the models
+        self._rows          = {}   # row of each model in self._coords
 
 
     def __getitem__(self, nam):
@@ -115,6 +179,49 @@ class StructuralModels(object):
         for m in self.__models:
             yield self.__models[m]
 
+
+    def _bind_models(self):
+        """
+        Stores the coordinates of the models in a single array, and replaces
+        the coordinates of each model by views on this array.
+        """
+        models = [(m, self.__models[m]) for m in self.__models]
+        coords = empty((len(models), self.nloci, 3))
+        for row, (m, model) in enumerate(models):
+            for k, key in enumerate(('x', 'y', 'z')):
+                if len(model[key]) != self.nloci:
+                    raise Exception(('ERROR: model %s has %s particles, ' +
+                                     '%s expected.\n') % (
+                                        m, len(model[key]), self.nloci))
+                coords[row, :, k] = model[key]
+        for row, (m, model) in enumerate(models):
+            _bind_coordinates(model, coords[row])
+        self._coords = coords
+        self._rows   = dict([(m, (row, model))
+                             for row, (m, model) in enumerate(models)])
+
+
+    def _coordinates(self, models=None):
+        """
+        Coordinates of a group of models.
+
+        :param None models: list of models (by default all)
+
+        :returns: an array of shape (number of models, nloci, 3)
+        """
+        if models is None:
+            models = [m for m in self.__models]
+        for m in models:
+            row, model = self._rows.get(m, (None, None))
+            # model replaced, or its coordinates replaced by lists
+            if (model is not self.__models[m] or
+                any([model[key].base is not self._coords
+                     if isinstance(model[key], ndarray) else True
+                     for key in ('x', 'y', 'z')])):
+                self._bind_models()
+                break
+        return self._coords[[self._rows[m][0] for m in models]]
+
     def __len__(self):
         return len(self.__models)
 
@@ -158,16 +265,13 @@ class StructuralModels(object):
         else:
             models = [m for m in self.__models]
         ref_model = models[0] if reference_model is None else reference_model
-        firstx, firsty, firstz = (self[ref_model]['x'],
-                                  self[ref_model]['y'],
-                                  self[ref_model]['z'])
+        # the coordinates are read by the aligner from the array
+        firstx, firsty, firstz = self._coordinates([ref_model])[0].T
         aligned = []
         for sec in models[1 if reference_model is None else 0:]:
+            secx, secy, secz = self._coordinates([sec])[0].T
             coords = aligner3d_wrapper(firstx, firsty, firstz,
-                                       self[sec]['x'],
-                                       self[sec]['y'],
-                                       self[sec]['z'],
-                                       self.nloci)
+                                       secx, secy, secz, self.nloci)
             if in_place:
                 self[sec]['x'], self[sec]['y'], self[sec]['z'] = coords
             else:
@@ -177,8 +281,9 @@ class StructuralModels(object):
             mass_center(self[ref_model]['x'], self[ref_model]['y'],
                         self[ref_model]['z'])
         else:
-            x, y, z = (self[ref_model]['x'][:], self[ref_model]['y'][:],
-                       self[ref_model]['z'][:])
+            x, y, z = (list_of_floats(self[ref_model]['x']),
+                       list_of_floats(self[ref_model]['y']),
+                       list_of_floats(self[ref_model]['z']))
             mass_center(x, y, z)
             aligned.insert(ref_model, (x, y, z))
             return aligned
@@ -230,9 +335,9 @@ class StructuralModels(object):
             models = [self[str(m)]['index'] for m in self.clusters[cluster]]
         else:
             models = [m for m in self.__models]
-        idx = centroid_wrapper([self[x]['x'] for x in models],
-                               [self[x]['y'] for x in models],
-                               [self[x]['z'] for x in models],
+        coords = self._coordinates(models)
+        idx = centroid_wrapper(coords[:, :, 0], coords[:, :, 1],
+                               coords[:, :, 2],
                                self.nloci, len(models), int(verbose), 0)
         return models[idx]
 
@@ -260,9 +365,9 @@ class StructuralModels(object):
             models = [self[str(m)]['index'] for m in self.clusters[cluster]]
         else:
             models = [m for m in self.__models]
-        idx = centroid_wrapper([self[x]['x'] for x in models],
-                               [self[x]['y'] for x in models],
-                               [self[x]['z'] for x in models],
+        coords = self._coordinates(models)
+        idx = centroid_wrapper(coords[:, :, 0], coords[:, :, 1],
+                               coords[:, :, 2],
                                self.nloci, len(models), int(verbose), 1)
         avgmodel = IMPmodel((('x', idx[0]), ('y', idx[1]), ('z', idx[2]),
                              ('rand_init', 'avg'), ('objfun', None),
@@ -674,18 +779,15 @@ class StructuralModels(object):
             models = [self[str(m)]['index'] for m in self.clusters[cluster]]
         else:
             models = [m for m in self.__models]
-        matrix = [[float('nan') for _ in xrange(self.nloci)]
-                  for _ in xrange(self.nloci)]
         if not cutoff:
             cutoff = int(2 * self.resolution * self._config['scale'])
         cutoff = cutoff**2
-        for i in xrange(self.nloci):
-            for j in xrange(i + 1, self.nloci):
-                val = len([k for k in self.__square_3d_dist(
-                    i + 1, j + 1, models=models)
-                           if k < cutoff])
-                matrix[i][j] = matrix[j][i] = float(val) / len(models)  # * 100
-        return matrix
+        counts = 0
+        for coords in self._coordinates(models):
+            counts = counts + (_square_distances(coords) < cutoff)
+        matrix = counts / float(len(models))  # * 100
+        fill_diagonal(matrix, float('nan'))
+        return matrix.tolist()
 
 
     def define_best_models(self, nbest):
@@ -705,6 +807,10 @@ class StructuralModels(object):
         self.__models = dict([(i, tmp_models[i]) for i in xrange(nbest)])
         self._bad_models = dict([(i, tmp_models[i]) for i in
                                  xrange(nbest, len(tmp_models))])
+        for model in self._bad_models.values():
+            _unbind_coordinates(model)
+        self._coords = None
+        self._rows   = {}
 
 
     def deconvolve(self, fact=0.75, dcutoff=None, method='mcl',
@@ -1027,14 +1133,10 @@ class StructuralModels(object):
         if not cutoff:
             cutoff = int(2 * self.resolution * self._config['scale'])
         cutoff2 = cutoff**2
-        for i in xrange(self.nloci):
-            for m in models:
-                val = 0
-                for j in xrange(self.nloci):
-                    if i == j:
-                        continue
-                    val += self.__square_3d_dist(i + 1, j + 1,
-                                                 models=[m])[0] < cutoff2
+        for coords in self._coordinates(models):
+            close = _square_distances(coords) < cutoff2
+            fill_diagonal(close, False)
+            for i, val in enumerate(close.sum(axis=1).tolist()):
                 interactions[i].append(val)
         distsk = {1: interactions}
         for k in (steps[1:] if steps[0]==1 else steps):
@@ -2078,11 +2180,9 @@ class StructuralModels(object):
             models = [self[str(m)]['index'] for m in self.clusters[cluster]]
         else:
             models = [m for m in self.__models]
-        models = [self[mdl] for mdl in models]
-        return [(mdl['x'][part1] - mdl['x'][part2])**2 +
-                (mdl['y'][part1] - mdl['y'][part2])**2 +
-                (mdl['z'][part1] - mdl['z'][part2])**2
-                for mdl in models]
+        coords = self._coordinates(models)
+        dif = coords[:, part1] - coords[:, part2]
+        return (dif[:, 0]**2 + dif[:, 1]**2 + dif[:, 2]**2).tolist()
 
 
     def objective_function_model(self, model, log=False, smooth=True, axe=None,
@@ -2228,10 +2328,12 @@ class StructuralModels(object):
         if minimal:
             for m in self.__models:
                 self.__models[m]['log_objfun'] = None
-            to_save['models']        = self.__models
-        else:
-            to_save['models']        = self.__models
-        to_save['bad_models']    = self._bad_models
+        # models read from a store are loaded, and coordinates saved as lists
+        to_save['models']        = {}
+        for m in self.__models:
+            to_save['models'][m] = copy(self.__models[m])
+            _unbind_coordinates(to_save['models'][m])
+        to_save['bad_models']    = dict(self._bad_models)
         to_save['nloci']         = self.nloci
         to_save['clusters']      = self.clusters
         to_save['resolution']    = self.resolution
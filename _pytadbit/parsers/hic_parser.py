@@ -3,9 +3,18 @@ November 7, 2013.
 
 """
 
-from warnings import warn
+from warnings import warn, catch_warnings, simplefilter
+from itertools import chain, islice
 from math import sqrt
+from array import array
+from numpy import ndarray, asarray, frombuffer, fromstring, empty, intc, isnan
+from numpy import floor, fill_diagonal, ascontiguousarray, zeros, intp, add
+from numpy import triu, tril, concatenate, result_type, load
+from numpy.lib.format import open_memmap
 from pytadbit.parsers.gzopen import gzopen
+from tempfile import mkstemp
+from os import close, rename, remove, chmod, umask
+from os.path import dirname, abspath, exists
 
 
 # Exception to handle failed autoread.
@@ -14,108 +23,253 @@ class AutoReadFail(Exception):
 
 # Helper functions for the autoreader.
 def is_asymmetric(matrix):
-    maxn = len(matrix)
-    for i in range(maxn):
-        maxi = matrix[i] # slightly more efficient
-        for j in range(i+1, maxn):
-            if maxi[j] != matrix[j][i]: return True
-    return False
+    """
+    :param matrix: square numpy array
+
+    :returns: True if the matrix is not symmetric (NaNs count as asymmetric)
+    """
+    return bool((matrix != matrix.T).any())
+
 
 def symmetrize(matrix):
-    maxn = len(matrix)
-    for i in range(maxn):
-        for j in range(i+1, maxn):
-            matrix[i][j] = matrix[j][i] = matrix[i][j] + matrix[j][i]
+    """
+    Sum the matrix with its transpose, leaving the diagonal untouched.
+
+    :param matrix: square numpy array
+
+    :returns: the symmetrized matrix (a new array)
+    """
+    diag = matrix.diagonal().copy()
+    matrix = matrix + matrix.T
+    fill_diagonal(matrix, diag)
+    return matrix
+
+
+def _is_number(item):
+    if item.lower() in ('na', 'nan'):
+        return True
+    try:
+        float(item)
+    except ValueError:
+        return False
+    return True
+
+
+def _parse_row(line, skip, ncol):
+    """
+    Parse the numeric part of a line (skipping the first 'skip' fields) into
+    an array of floats. NA values are returned as NaN.
+    """
+    if skip:
+        fields = line.split(None, skip)
+        if len(fields) <= skip:
+            raise AutoReadFail('ERROR: unequal column number')
+        line = fields[-1]
+    with catch_warnings():
+        # numpy complains when it stops at non numeric characters
+        simplefilter('ignore')
+        row = fromstring(line, dtype=float, sep=' ')
+    if len(row) == ncol:
+        return row
+    # slow path, only reached with 'NA' values or malformed lines
+    fields = line.split()
+    if len(fields) != ncol:
+        raise AutoReadFail('ERROR: unequal column number')
+    try:
+        return asarray([float('nan') if a.lower() in ('na', 'nan')
+                        else float(a) for a in fields], dtype=float)
+    except ValueError:
+        raise AutoReadFail('ERROR: non numeric values')
 
 
 def autoreader(f):
     """
     Auto-detect matrix format of HiC data file.
-    
+
+    The format is sniffed from the first two lines, then the rows are parsed
+    one by one into a preallocated array, so the file is never held in memory
+    as text. Supported formats are pure numeric matrices, with or without a
+    header line, and with or without row information columns at the beginning
+    of each line.
+    Sparse files, with (bin1, bin2, count) triplets, are not detected: they
+    have to be read with :func:`pytadbit.parsers.hic_parser.sparsereader`
+    (sparse=True in :func:`pytadbit.parsers.hic_parser.read_matrix`).
+
     :param f: an iterable (typically an open file).
-    
-    :returns: A tuple with integer values and the dimension of
-       the matrix.
-    """
-
-    # Skip initial comment lines and read in the whole file
-    # as a list of lists.
-    for line in f:
-        if line[0] != '#': break
-    items = [line.split()] + [line.split() for line in f]
-
-    # Count the number of elements per line after the first.
-    # Wrapping in a set is a trick to make sure that every line
-    # has the same number of elements.
-    S = set([len(line) for line in items[1:]])
-    ncol = S.pop()
-    # If the set 'S' is not empty, at least two lines have a
-    # different number of items.
-    if S: raise AutoReadFail('ERROR: unequal column number')
-
-    nrow = len(items)
-    # Auto-detect the format, there are only 4 cases.
-    if ncol == nrow:
-        if all([item.isdigit() for item in items[0]]):
-            # Case 1: pure integer matrix.
-            header = False
-            trim = 0
-        else:
-            # Case 2: matrix with row and column names.
-            header = True
-            trim = 1
+
+    :returns: a flat numpy array (of integers, or of floats if NaNs were
+       found) with the values of the matrix, and the dimension of the matrix.
+    """
+    lines = (line for line in f
+             if line and line[0] != '#' and not line.isspace())
+    try:
+        first = next(lines)
+        second = next(lines)
+    except StopIteration:
+        raise AutoReadFail('ERROR: not enough lines')
+    first_items = first.split()
+    second_items = second.split()
+    ncol = len(second_items)
+    # a header either has a different number of columns than the data rows,
+    # or ends with a column name instead of a value
+    if len(first_items) != ncol or not _is_number(first_items[-1]):
+        rows = lines
     else:
-        if len(items[0]) == len(items[1]):
-            # Case 3: matrix with row information.
-            header = False
-            trim = ncol - nrow
+        rows = chain([second], lines)
+        second = first
+    # leading non numeric columns carry row information; numeric ones (e.g.
+    # bin coordinates) are detected at the end, when the number of rows
+    # is known
+    skip = 0
+    while skip < ncol and not _is_number(second_items[skip]):
+        skip += 1
+    width = ncol - skip
+    if width <= 0:
+        raise AutoReadFail('ERROR: non numeric values')
+    # the matrix is square, so it cannot have more rows than values per line
+    matrix = empty((width, width), dtype=intc)
+    non_int = False
+    nan_cells = []
+    nrow = 0
+    for line in chain([second], rows):
+        if nrow >= width:
+            if width == 3:
+                raise AutoReadFail('ERROR: non square matrix (use ' +
+                                   'sparse=True to read (bin1, bin2, ' +
+                                   'count) triplets)')
+            raise AutoReadFail('ERROR: non square matrix')
+        row = _parse_row(line, skip, width)
+        nans = isnan(row)
+        if nans.any():
+            nan_cells.extend((nrow, j) for j in nans.nonzero()[0])
+            row[nans] = 0
+        rounded = floor(row + .5)
+        if not non_int and (rounded != row).any():
+            non_int = True
+        matrix[nrow] = rounded
+        nrow += 1
+    # remove extra columns of row information
+    trim = width - nrow
+    if trim:
+        matrix = matrix[:nrow, trim:]
+    if non_int:
+        # Dekker data 2009, uses integer but puts a comma...
+        warn('WARNING: non integer values')
+    if nan_cells:
+        # Some data may contain 'NaN' or 'NA'
+        matrix = matrix.astype(float)
+        cells = [(i, j - trim) for i, j in nan_cells if j >= trim]
+        if cells:
+            matrix[tuple(zip(*cells))] = float('nan')
+            warn('WARNING: NA or NaN founds, set to zero')
+
+    if is_asymmetric(matrix):
+        warn('WARNING: input matrix not symmetric: symmetrizing')
+        matrix = symmetrize(matrix)
+
+    return ascontiguousarray(matrix).reshape(-1), nrow
+
+
+def sparse_to_matrix(bins1, bins2, counts, size=None):
+    """
+    Densify Hi-C interaction counts given in coordinate format.
+
+    :param bins1: array with the 0-based bin index of the rows
+    :param bins2: array with the 0-based bin index of the columns
+    :param counts: array with the interaction counts
+    :param None size: number of rows/columns of the matrix. By default the
+       highest bin index plus one
+
+    :returns: a flat numpy array (of integers, or of floats if NaNs were
+       found) with the values of the matrix, and the dimension of the matrix.
+    """
+    bins1 = asarray(bins1, dtype=intp)
+    bins2 = asarray(bins2, dtype=intp)
+    counts = asarray(counts)
+    if size is None:
+        size = int(max(bins1.max(), bins2.max())) + 1 if len(counts) else 0
+    if len(counts) and (min(bins1.min(), bins2.min()) < 0 or
+                        max(bins1.max(), bins2.max()) >= size):
+        raise AutoReadFail('ERROR: bin index out of matrix')
+    if counts.dtype.kind == 'f':
+        if isnan(counts).any():
+            warn('WARNING: NA or NaN founds, set to zero')
+            matrix = zeros((size, size), dtype=float)
         else:
-            # Case 4: matrix with header and row information.
-            header = True
-            trim = ncol - nrow + 1
+            rounded = floor(counts + .5)
+            if (rounded != counts).any():
+                # Dekker data 2009, uses integer but puts a comma...
+                warn('WARNING: non integer values')
+            counts = rounded
+            matrix = zeros((size, size), dtype=intc)
+    else:
+        matrix = zeros((size, size), dtype=intc)
+    add.at(matrix, (bins1, bins2), counts)
+    if is_asymmetric(matrix):
+        # usually only one half of the matrix is given
+        if triu(matrix, 1).any() and tril(matrix, -1).any():
+            warn('WARNING: input matrix not symmetric: symmetrizing')
+        matrix = symmetrize(matrix)
+    return matrix.reshape(-1), size
 
-    # Remove header line if needed.
-    if header:
-        del(items[0])
-        nrow -= 1
 
-    # Get the numeric values and remove extra columns
-    try:
-        items = [[int(a) for a in line[trim:]] for line in items]
-    except ValueError:
-        try:
-            # Dekker data 2009, uses integer but puts a comma... 
-            items = [[int(float(a)+.5) for a in line[trim:]] for line in items]
-            warn('WARNING: non integer values')
-        except ValueError:
-            try:
-                # Some data may contain 'NaN' or 'NA'
-                items = [
-                    [float('nan') if a.lower() in ['na', 'nan']
-                     else int(float(a)+.5) for a in line[trim:]]
-                for line in items]
-                warn('WARNING: NA or NaN founds, set to zero')
-            except ValueError:
-                raise AutoReadFail('ERROR: non numeric values')
-
-    # Check that the matrix is square.
-    ncol -= trim
-    if ncol != nrow: raise AutoReadFail('ERROR: non square matrix')
-
-    if is_asymmetric(items):
-        warn('WARNING: input matrix not symmetric: symmetrizing')
-        symmetrize(items)
+def sparsereader(f, size=None, skip=0, base=0):
+    """
+    Read Hi-C data in sparse format, with one (bin1, bin2, count) triplet per
+    line, and build the dense matrix directly from them. Interactions may be
+    given for one half of the matrix only.
 
-    return tuple([a for line in items for a in line]), ncol
+    :param f: an iterable (typically an open file).
+    :param None size: number of rows/columns of the matrix. By default the
+       highest bin index (empty bins at the end of the matrix are then lost)
+    :param 0 skip: number of leading (non-numeric) columns to ignore
+    :param 0 base: index of the first bin, 0, or 1 for the files written by
+       :func:`pytadbit.experiment.Experiment.write_interaction_pairs`
+
+    :returns: a flat numpy array (of integers, or of floats if NaNs were
+       found) with the values of the matrix, and the dimension of the matrix.
+    """
+    lines = (line for line in f
+             if line and line[0] != '#' and not line.isspace())
+    blocks = []
+    while True:
+        block = list(islice(lines, 100000))
+        if not block:
+            break
+        if skip:
+            block = [line.split(None, skip)[-1] for line in block]
+        with catch_warnings():
+            simplefilter('ignore')
+            values = fromstring(' '.join(block), dtype=float, sep=' ')
+        if len(values) != 3 * len(block):
+            # header line, 'NA' values or malformed lines
+            if not blocks and not _is_number(block[0].split()[-1]):
+                block = block[1:]
+            values = asarray([_parse_row(line, 0, 3) for line in block])
+        blocks.append(values.reshape(-1, 3))
+    if not blocks:
+        raise AutoReadFail('ERROR: not enough lines')
+    triplets = concatenate(blocks)
+    del blocks
+    bins = triplets[:, :2]
+    if (bins != floor(bins)).any():
+        raise AutoReadFail('ERROR: non integer bin indices')
+    bins = bins.astype(intp) - base
+    return sparse_to_matrix(bins[:, 0], bins[:, 1], triplets[:, 2], size=size)
 
 
-def read_matrix(things, parser=None):
+def read_matrix(things, parser=None, sparse=False, base=0, size=None):
     """
     Read and checks a matrix from a file (using
     :func:`pytadbit.parser.hic_parser.autoreader`) or a list.
 
     :param things: might be either a file name, a file handler, a list of them
-        or a list of list (all with same length)
+        or a list of list (all with same length). Numpy arrays, memoryviews or
+        :py:mod:`array` objects of integers are also accepted; these are kept
+        as they are (flattened, without copy) and passed directly to the
+        TADbit C library. Files (gzipped or not) may also contain sparse data
+        as (bin1, bin2, count) triplets (with sparse=True), and scipy sparse
+        matrices are accepted as well
     :param None parser: a parser function that returns a tuple of lists representing the data matrix,
         with this file example.tsv:
         ::
@@ -129,12 +283,19 @@ def read_matrix(things, parser=None):
         the output of parser('example.tsv') might be:
         ``([629, 86, 159, 100, 164, 612, 216, 111, 88, 175, 437, 146, 105, 110,
         105, 278])``
+    :param False sparse: files contain (bin1, bin2, count) triplets (see
+       :func:`pytadbit.parsers.hic_parser.sparsereader`)
+    :param 0 base: index of the first bin in sparse files
+    :param None size: number of rows/columns of the matrix in sparse files, by
+       default the highest bin index
 
 
     :returns: the corresponding matrix concatenated into a huge list, also
         returns number or rows
 
     """
+    if not parser and sparse:
+        parser = lambda f: sparsereader(f, size=size, base=base)
     parser = parser or autoreader
     if type(things) is not list:
         things = [things]
@@ -169,6 +330,31 @@ def read_matrix(things, parser=None):
             if int(siz) != siz:
                 raise AttributeError('ERROR: matrix should be square.\n')
             sizes.append(int(siz))
+        elif hasattr(thing, 'tocoo'):
+            # scipy sparse matrices are densified without intermediate copies
+            row, col = thing.shape
+            if row != col:
+                raise AttributeError('ERROR: matrix should be square.\n')
+            thing = thing.tocoo()
+            matrix, size = sparse_to_matrix(thing.row, thing.col, thing.data,
+                                            size=row)
+            matrices.append(matrix)
+            sizes.append(size)
+        elif isinstance(thing, (ndarray, array, memoryview)) and not (
+            'matrix' in str(type(thing))):
+            # buffer-like objects are not converted to python integers
+            if isinstance(thing, array):
+                thing = frombuffer(thing, dtype=thing.typecode)
+            thing = asarray(thing)
+            if thing.ndim == 2:
+                row, col = thing.shape
+                if row != col:
+                    raise AttributeError('ERROR: matrix should be square.\n')
+            siz = sqrt(thing.size)
+            if int(siz) != siz:
+                raise AttributeError('ERROR: matrix should be square.\n')
+            matrices.append(thing.reshape(-1))
+            sizes.append(int(siz))
         elif 'matrix' in str(type(thing)):
             try:
                 row, col = thing.shape
@@ -185,3 +371,53 @@ def read_matrix(things, parser=None):
     raise Exception('All matrices must have the same size ' +
                     '(same chromosome and same bins).')
 
+
+
+def save_hic_matrix(hic_data, fname):
+    """
+    Save Hi-C data in binary format (a numpy .npy file, with one row per
+    replicate), so that it can be memory-mapped back with
+    :func:`pytadbit.parsers.hic_parser.load_hic_matrix`.
+
+    :param hic_data: list of flat Hi-C matrices (one per replicate), all with
+       the same number of cells
+    :param fname: path to the output file
+    """
+    hic_data = [asarray(matrix).reshape(-1) for matrix in hic_data]
+    if not all([len(matrix) == len(hic_data[0]) for matrix in hic_data]):
+        raise Exception('ERROR: all matrices must have the same size.\n')
+    # the data may be memory-mapped from fname itself: write a new file
+    # and replace the old one only once done
+    fd, tmp_f = mkstemp(suffix='.npy', dir=dirname(abspath(fname)))
+    close(fd)
+    mask = umask(0)
+    umask(mask)
+    chmod(tmp_f, 0666 & ~mask)
+    try:
+        out = open_memmap(tmp_f, mode='w+', dtype=result_type(*hic_data),
+                          shape=(len(hic_data), len(hic_data[0])))
+        for i, matrix in enumerate(hic_data):
+            out[i] = matrix
+        out.flush()
+        del out
+        rename(tmp_f, fname)
+    finally:
+        # only left if the data could not be written
+        if exists(tmp_f):
+            remove(tmp_f)
+
+
+def load_hic_matrix(fname, mmap=True):
+    """
+    Load Hi-C data saved with
+    :func:`pytadbit.parsers.hic_parser.save_hic_matrix`.
+
+    :param fname: path to the file
+    :param True mmap: memory-map the file (read-only) instead of reading it.
+       Data is then only read from disk when accessed, and shared between
+       the processes using the same file
+
+    :returns: a list of flat Hi-C matrices (one per replicate)
+    """
+    data = load(fname, mmap_mode='r' if mmap else None)
+    return [data[i] for i in xrange(len(data))]
@@ -4,12 +4,16 @@
 
 """
 
-from os import path, listdir
+from os import path, listdir, makedirs
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from collections import Sequence
+from numpy import frombuffer, intc, float64, asarray, zeros
 from pytadbit.parsers.hic_parser import read_matrix
 from pytadbit.tadbit_py import _tadbit_wrapper
 
 
-def tadbit(x, n_cpus=1, verbose=True, max_tad_size="max",
+def tadbit(x, n_cpus=1, verbose=True, max_tad_size="auto",
            no_heuristic=False, get_weights=False, **kwargs):
     """
     The TADbit algorithm works on raw chromosome interaction count data.
@@ -29,11 +33,16 @@ def tadbit(x, n_cpus=1, verbose=True, max_tad_size="max",
     :param x: a square matrix of interaction counts in the HI-C data or a list
        of such matrices for replicated experiments. The counts must be evenly
        sampled and not normalized. x might be either a list of list, a path to
-       a file or a file handler
+       a file, a file handler or a numpy array (integer arrays are passed to
+       the C library without any copy)
     :param 1 n_cpus: The number of CPUs to allocate to TADbit. If
        n_cpus='max' the total number of CPUs will be used
     :param auto max_tad_size: an integer defining maximum size of TAD. Default
-       (auto) defines it as the number of rows/columns
+       (auto) defines it as the number of rows/columns. Longer slices are
+       neither computed nor stored, so lower values save memory and time.
+       The limit holds for all the steps (including the heuristic and the
+       refinement of the breaks), so TADs span at most max_tad_size + 1
+       rows/columns with data
     :param False no_heuristic: whether to use or not some heuristics
     :param False get_weights: either to return the weights corresponding to the
        Hi-C count (weights are a normalization dependent of the count of each
@@ -42,12 +51,12 @@ def tadbit(x, n_cpus=1, verbose=True, max_tad_size="max",
     :returns: the :py:func:`list` of topologically associated domains'
        boundaries, and the corresponding list associated log likelihoods.
        Depending on the value of the get_weights parameter, may also return
-       weights.
+       weights (a :class:`TadbitWeights`, computed only when accessed).
     """
     nums, size = read_matrix(x)
     n_cpus = n_cpus if n_cpus != 'max' else 0
-    max_tad_size = size if max_tad_size is "auto" else max_tad_size
-    _, nbks, passages, _, _, bkpts, weights = \
+    max_tad_size = size if max_tad_size == "auto" else max_tad_size
+    _, nbks, passages, _, _, bkpts, rowsums = \
        _tadbit_wrapper(nums,             # list of lists representing matrices
                        size,             # size of one row/column
                        len(nums),        # number of matrices
@@ -56,10 +65,13 @@ def tadbit(x, n_cpus=1, verbose=True, max_tad_size="max",
                        max_tad_size,     # max_tad_size
                        kwargs.get('ntads', 0),
                        int(no_heuristic),# heuristic 0/1
+                       1,                # return C arrays
                        )
+    passages = frombuffer(passages, dtype=intc)
+    bkpts    = frombuffer(bkpts, dtype=intc).reshape(-1, size)
 
-    breaks = [i for i in xrange(size) if bkpts[i + nbks * size] == 1]
-    scores = [p for p in passages if p > 0]
+    breaks = (bkpts[nbks] == 1).nonzero()[0].tolist()
+    scores = passages[passages > 0].astype(float).tolist()
 
     result = {'start': [], 'end'  : [], 'score': []}
     for brk in xrange(len(breaks)+1):
@@ -68,16 +80,75 @@ def tadbit(x, n_cpus=1, verbose=True, max_tad_size="max",
         result['score'].append(scores[brk] if brk < len(breaks) else None)
 
     if get_weights:
-        # in tadbit we are not using directly weights, but the
-        # multiplication by the real value
-        oks = [i for i in xrange(size) if nums[0][i*size+i]]
-        total = sum([nums[0][i*size+j] for i in oks for j in oks])
-        tadbit_weights = [[i/j*total if j else 0.0 for i, j in
-                           zip(nums[k], weights[k])] for k in xrange(len(nums))]
-        return result, tadbit_weights
+        return result, TadbitWeights(nums, size, [frombuffer(rsum)
+                                                  for rsum in rowsums])
     return result
 
 
+class TadbitWeights(Sequence):
+    """
+    Hi-C counts divided by the weights used by TADbit, for each replicate,
+    computed only when accessed (and then kept in memory). Weights are the
+    products of the row/column sums computed by the C library (null for the
+    rows and columns removed), and the counts are multiplied by the total
+    count of the first replicate.
+
+    :param nums: list of matrices (replicates) as returned by
+       :func:`pytadbit.parsers.hic_parser.read_matrix`
+    :param size: number of rows/columns of the matrices
+    :param rowsums: list with, for each replicate, the row/column sums
+       returned by :func:`pytadbit.tadbit_py._tadbit_wrapper`
+
+    Each item is a numpy array of the normalized counts (flat, as the input
+    matrices). Pickled, the weights are stored as a list of arrays.
+    """
+
+    def __init__(self, nums, size, rowsums):
+        self._nums    = nums
+        self._size    = size
+        self._rowsums = rowsums
+        self._wghts   = {}
+        self._total   = None
+
+
+    def total(self):
+        """
+        Sum of the counts of the first replicate, between rows and columns
+        with data in its diagonal.
+        """
+        if self._total is None:
+            mat = asarray(self._nums[0]).reshape(self._size, self._size)
+            oks = mat.diagonal().nonzero()[0]
+            self._total = mat[oks][:, oks].sum()
+        return self._total
+
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[i] for i in xrange(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if not k in self._wghts:
+            if not 0 <= k < len(self):
+                raise IndexError('replicate index out of range')
+            rsum = self._rowsums[k]
+            weights = (rsum[:, None] * rsum).reshape(-1)
+            num = asarray(self._nums[k]).reshape(-1)
+            wghts = zeros(self._size * self._size, dtype=float64)
+            nonull = weights != 0
+            wghts[nonull] = num[nonull] / weights[nonull] * self.total()
+            self._wghts[k] = wghts
+        return self._wghts[k]
+
+
+    def __len__(self):
+        return len(self._rowsums)
+
+
+    def __reduce__(self):
+        return list, (list(self), )
+
+
 def batch_tadbit(directory, parser=None, **kwargs):
     """
     Use tadbit on directories of data files.
@@ -126,6 +197,85 @@ def batch_tadbit(directory, parser=None, **kwargs):
     return tadbit(matrix, **kwargs)
 
 
+def genome_tadbit(matrices, resolution, exp_name='hic', n_cpus=1,
+                  n_jobs=None, outdir=None, verbose=False, **kwargs):
+    """
+    Use tadbit on all the chromosomes of a genome.
+
+    Chromosomes are processed in parallel threads (the TADbit C library does
+    not hold the Python interpreter), the largest first. The CPUs are divided
+    between the chromosomes processed at the same time (n_jobs), and the
+    threads of :func:`tadbit` for each of them.
+
+    :param matrices: a :py:func:`dict` with chromosome names as keys, and the
+       corresponding Hi-C data as values (a path to a file, a list of paths for
+       replicated experiments or a matrix, as passed to
+       :func:`pytadbit.Chromosome.add_experiment`)
+    :param resolution: resolution of the Hi-C experiments
+    :param 'hic' exp_name: name of the experiment created in each
+       :class:`pytadbit.Chromosome`
+    :param 1 n_cpus: The number of CPUs to allocate to TADbit. If
+       n_cpus='max' the total number of CPUs will be used
+    :param None n_jobs: number of chromosomes processed at the same time. By
+       default, as many as CPUs (or chromosomes if there are less)
+    :param None outdir: if given, each :class:`pytadbit.Chromosome` is saved in
+       this directory (see :func:`pytadbit.Chromosome.save_chromosome`), under
+       the name of the chromosome, and is not kept in memory
+    :param False verbose: print the name of each chromosome processed
+    :param kwargs: arguments passed to :func:`pytadbit.Chromosome.find_tad`
+       (e.g. max_tad_size, no_heuristic)
+
+    :returns: a :py:func:`dict` with chromosome names as keys and
+       :class:`pytadbit.Chromosome` objects as values, or, if outdir is given,
+       the paths to the saved objects
+    """
+    if n_cpus == 'max':
+        n_cpus = cpu_count()
+    n_jobs = min(n_jobs or n_cpus, len(matrices)) or 1
+    crm_cpus = max(1, n_cpus / n_jobs)
+    names = sorted(matrices, key=lambda x: _hic_data_size(matrices[x]),
+                   reverse=True)
+
+    def _find_tads(name):
+        if verbose:
+            print 'Searching TADs in chromosome %s' % name
+        crm = Chromosome(name)
+        crm.add_experiment(exp_name, resolution, hic_data=matrices[name],
+                           silent=True)
+        crm.find_tad(exp_name, n_cpus=crm_cpus, verbose=False, **kwargs)
+        if not outdir:
+            return crm
+        out_f = path.join(outdir, str(name))
+        crm.save_chromosome(out_f, fast=False, force=True)
+        return out_f
+
+    # local import to avoid circular imports
+    from pytadbit.chromosome import Chromosome
+    if outdir and not path.exists(outdir):
+        makedirs(outdir)
+    pool = ThreadPool(n_jobs)
+    try:
+        results = pool.map(_find_tads, names, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(names, results))
+
+
+def _hic_data_size(hic_data):
+    """
+    Estimates the size of Hi-C data (used to process large chromosomes
+    first).
+    """
+    if isinstance(hic_data, basestring):
+        return path.getsize(hic_data) if path.isfile(hic_data) else 0
+    if isinstance(hic_data, (list, tuple)):
+        if all([isinstance(h, basestring) for h in hic_data]):
+            return sum([_hic_data_size(h) for h in hic_data])
+        return len(hic_data)
+    return getattr(hic_data, 'size', 0)
+
+
 def print_result_r(result, write=True):
     """
     Print a table summarizing the TADs found by tadbit. This function outputs
@@ -711,6 +711,61 @@ def compare_models(sm1, sm2, cutoff=150,
     plt.show()
 
 
+def _tad_heights(xpr, normalized=True):
+    """
+    Relative Hi-C count in each TAD of an experiment: the interactions inside
+    the TAD divided by the ones expected from the mean count at each distance.
+
+    :param xpr: a :class:`pytadbit.Experiment`
+    :param True normalized: use the normalized data if available
+
+    :returns: a dictionary with the height of each TAD (1 for all of them if
+       there is no Hi-C data)
+    """
+    zeros = xpr._zeros or {}
+    if normalized and xpr.norm:
+        norms = xpr.norm[0]
+    elif xpr.hic_data:
+        if normalized:
+            warn("WARNING: weights not available, using raw data")
+        norms = xpr.hic_data[0]
+    else:
+        warn("WARNING: raw Hi-C data not available, " +
+             "TAD's height fixed to 1")
+        norms = None
+    diags = []
+    siz = xpr.size
+    sp1 = siz + 1
+    if norms is not None:
+        for k in xrange(1, siz):
+            s_k = siz * k
+            diags.append(sum([norms[i * sp1 + s_k]
+                             if not (i in zeros
+                                     or (i + k) in zeros) else 0.
+                              for i in xrange(siz - k)]) / (siz - k))
+    heights = {}
+    for tad in xpr.tads:
+        start, end = (int(xpr.tads[tad]['start']) + 1,
+                      int(xpr.tads[tad]['end']) + 1)
+        if norms is not None:
+            matrix = sum([norms[i + siz * j]
+                         if not (i in zeros
+                                 or j in zeros) else 0.
+                          for i in xrange(start - 1, end - 1)
+                          for j in xrange(i + 1, end - 1)])
+        try:
+            if norms is not None:
+                height = float(matrix) / sum(
+                    [diags[i-1] * (end - start - i)
+                     for i in xrange(1, end - start)])
+            else:
+                height = 1.
+        except ZeroDivisionError:
+            height = 0.
+        heights[tad] = height
+    return heights
+
+
 def _tad_density_plot(xpr, maxys=None, fact_res=1., axe=None,
                      focus=None, extras=None, normalized=True,
                      savefig=None, shape='ellipse'):
@@ -752,45 +807,11 @@ def _tad_density_plot(xpr, maxys=None, fact_res=1., axe=None,
             raise NotImplementedError(
                 '%s not valid, use one of ellipse, rectangle or triangle')
     maxys = maxys if type(maxys) is list else []
-    zeros = xpr._zeros or {}
-    if normalized and xpr.norm:
-        norms = xpr.norm[0]
-    elif xpr.hic_data:
-        if normalized:
-            warn("WARNING: weights not available, using raw data")
-        norms = xpr.hic_data[0]
-    else:
-        warn("WARNING: raw Hi-C data not available, " +
-             "TAD's height fixed to 1")
-        norms = None
-    diags = []
-    siz = xpr.size
-    sp1 = siz + 1
-    if norms:
-        for k in xrange(1, siz):
-            s_k = siz * k
-            diags.append(sum([norms[i * sp1 + s_k]
-                             if not (i in zeros
-                                     or (i + k) in zeros) else 0.
-                              for i in xrange(siz - k)]) / (siz - k))
+    heights = _tad_heights(xpr, normalized=normalized)
     for tad in xpr.tads:
         start, end = (int(xpr.tads[tad]['start']) + 1,
                       int(xpr.tads[tad]['end']) + 1)
-        if norms:
-            matrix = sum([norms[i + siz * j]
-                         if not (i in zeros
-                                 or j in zeros) else 0.
-                          for i in xrange(start - 1, end - 1)
-                          for j in xrange(i + 1, end - 1)])
-        try:
-            if norms:
-                height = float(matrix) / sum(
-                    [diags[i-1] * (end - start - i)
-                     for i in xrange(1, end - start)])
-            else:
-                height = 1.
-        except ZeroDivisionError:
-            height = 0.
+        height = heights[tad]
         maxys.append(height)
         start = float(start) / fact_res  # facts[iex]
         end   = float(end) / fact_res  # facts[iex]
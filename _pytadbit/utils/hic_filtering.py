@@ -21,40 +21,70 @@ def get_r2 (fun, X, Y, *args):
     return 1 - sserr/sstot
 
 
+def _as_matrix(matrx):
+    """
+    Hi-C matrix given as list of lists, numpy array or scipy sparse matrix,
+    returned as a 2-D numpy array or as a CSR matrix (arrays are not copied).
+    """
+    if hasattr(matrx, 'tocsr'):
+        return matrx.tocsr()
+    return np.asarray(matrx)
+
+
+def _column_sums(matrx):
+    """
+    sum of each column of a (symmetric) Hi-C matrix
+    """
+    return np.asarray(_as_matrix(matrx).sum(axis=1)).ravel()
+
+
+def _histogram(cols, nbins):
+    """
+    number of values in each of nbins bins between the minimum and the maximum
+    of cols
+    """
+    y = np.linspace(cols.min(), cols.max(), nbins)
+    x = np.bincount(np.digitize(cols, y), minlength=nbins + 1)[1:nbins + 1]
+    return y, x
+
+
+def _bads_below(sums, root, keep_sums=False):
+    """
+    label as bad the columns with sums lower than the root
+    """
+    return dict([(i, sums.item(i) if keep_sums else None)
+                 for i in np.flatnonzero(sums < root).tolist()])
+
+
 def filter_by_zero_count(matrx, draw_hist=False):
     """
     fits the distribution of Hi-C interaction count by column in the matrix to
     a polynomial. Then searches for the first possible 
     """
     nbins = 100
-    # get sum of columns
-    cols = []
-    for c in sorted(matrx, key=sum):
-        cols.append(len(c) - c.count(0))
-    cols = np.array(cols)
+    matrx = _as_matrix(matrx)
+    sums = _column_sums(matrx)
+    # number of non-null cells of columns, sorted by sum of columns
+    if hasattr(matrx, 'getnnz'):
+        cols = matrx.getnnz(axis=1)
+    else:
+        cols = np.count_nonzero(matrx, axis=1)
+    cols = cols[np.argsort(sums, kind='mergesort')]
     if draw_hist:
         plt.figure(figsize=(9, 9))
     median = np.median(cols)
     # mad = np.median([abs(median - c ) for c in cols])
     best =(None, None, None, None)
     # bin the sum of columns
-    xmin = min(cols)
-    xmax = max(cols)
-    y = np.linspace(xmin, xmax, nbins)
-    hist = np.digitize(cols, y)
-    x = [sum(hist == i) for i in range(1, nbins + 1)]
+    y, x = _histogram(cols, nbins)
     if draw_hist:
         hist = plt.hist(cols, bins=100, alpha=.3, color='grey')
     xp = range(0, cols[-1])
     # check if the binning is correct
     # we want at list half of the bins with some data
-    while list(x).count(0) > 2*len(x)/3:
+    while (x == 0).sum() > 2*len(x)/3:
         cols = cols[:-1]
-        xmin = min(cols)
-        xmax = max(cols)
-        y = np.linspace(xmin, xmax, nbins)
-        hist = np.digitize(cols, y)
-        x = [sum(hist == i) for i in range(1, nbins + 1)]
+        y, x = _histogram(cols, nbins)
         if draw_hist:
             plt.clf()
             hist = plt.hist(cols, bins=100, alpha=.3, color='grey')
@@ -94,49 +124,39 @@ def filter_by_zero_count(matrx, draw_hist=False):
         plt.ylim(0, plt.ylim()[1])
         plt.show()
     # label as bad the columns with sums lower than the root
-    bads = {}
-    for i, col in enumerate(matrx):
-        if sum(col) < root:
-            bads[i] = None
+    bads = _bads_below(sums, root)
     # now stored in Experiment._zeros, used for getting more accurate z-scores
     return bads
 
 
-def filter_by_mean(matrx, draw_hist=False, silent=False):
+def filter_by_mean(matrx, draw_hist=False, silent=False, sums=None):
     """
     fits the distribution of Hi-C interaction count by column in the matrix to
     a polynomial. Then searches for the first possible 
+
+    :param None sums: sum of each column, if already computed
     """
     nbins = 100
     # get sum of columns
-    cols = []
-    for c in sorted(matrx, key=sum):
-        cols.append(sum(c))
-    cols = np.array(cols)
+    if sums is None:
+        sums = _column_sums(matrx)
+    cols = np.sort(sums)
     if draw_hist:
         plt.figure(figsize=(9, 9))
     median = np.median(cols)
     # mad = np.median([abs(median - c ) for c in cols])
     best =(None, None, None, None)
     # bin the sum of columns
-    xmin = min(cols)
-    xmax = max(cols)
-    y = np.linspace(xmin, xmax, nbins)
-    hist = np.digitize(cols, y)
-    x = [sum(hist == i) for i in range(1, nbins + 1)]
+    y, x = _histogram(cols, nbins)
     if draw_hist:
         hist = plt.hist(cols, bins=100, alpha=.3, color='grey')
     xp = range(0, int(cols[-1]))
     # check if the binning is correct
     # we want at list half of the bins with some data
     try:
-        while list(x).count(0) > len(x)/2:
+        while (x == 0).sum() > len(x)/2:
             cols = cols[:-1]
-            xmin = min(cols)
-            xmax = max(cols)
-            y = np.linspace(xmin, xmax, nbins)
-            hist = np.digitize(cols, y)
-            x = [sum(hist == i) for i in range(1, nbins + 1)]
+            y, x = _histogram(cols, nbins)
             if draw_hist:
                 plt.clf()
                 hist = plt.hist(cols, bins=100, alpha=.3, color='grey')
@@ -190,10 +210,7 @@ def filter_by_mean(matrx, draw_hist=False, silent=False):
         plt.ylim(0, plt.ylim()[1])
         plt.show()
     # label as bad the columns with sums lower than the root
-    bads = {}
-    for i, col in enumerate(matrx):
-        if sum(col) < root:
-            bads[i] = sum(col)
+    bads = _bads_below(sums, root, keep_sums=True)
     # now stored in Experiment._zeros, used for getting more accurate z-scores
     if bads and not silent:
         warn('\nWARNING: removing columns having less than %s count:\n %s' %(
@@ -203,34 +220,28 @@ def filter_by_mean(matrx, draw_hist=False, silent=False):
     return bads
 
 
-def filter_by_stdev(matrx):
-    means = [np.mean(c) for c in matrx]
+def filter_by_stdev(matrx, sums=None):
+    if sums is None:
+        sums = _column_sums(matrx)
+    means = sums / float(len(sums))
     mean = np.mean(means)
     stde = np.std(means)
     root = mean - stde * 1.25
     # label as bad the columns with sums lower than the root
-    bads = {}
-    for i, col in enumerate(matrx):
-        if sum(col) < root:
-            bads[i] = None
+    bads = _bads_below(sums, root)
     # now stored in Experiment._zeros, used for getting more accurate z-scores
     return bads
 
 
-def filter_by_mad(matrx):
+def filter_by_mad(matrx, sums=None):
     # get sum of columns
-    cols = []
-    for c in sorted(matrx, key=sum):
-        cols.append(sum(c))
-    cols = np.array(cols)
-    median = np.median(cols)
-    mad = np.median([abs(median - c ) for c in cols])
+    if sums is None:
+        sums = _column_sums(matrx)
+    median = np.median(sums)
+    mad = np.median(np.abs(median - sums))
     root = median - mad * 1.5
     # label as bad the columns with sums lower than the root
-    bads = {}
-    for i, col in enumerate(matrx):
-        if sum(col) < root:
-            bads[i] = None
+    bads = _bads_below(sums, root)
     # now stored in Experiment._zeros, used for getting more accurate z-scores
     return bads
 
@@ -240,32 +251,32 @@ def hic_filtering_for_modelling(matrx, method='mean', silent=False):
     Main filtering function, to remove artefactual columns in a given Hi-C
     matrix
     
-    :param matrx: Hi-C matrix of a given experiment
+    :param matrx: Hi-C matrix of a given experiment (list of lists, 2-D numpy
+       array or scipy sparse matrix)
     :param mean method: method to use for filtering Hi-C columns. Aims to
        remove columns with abnormally low count of interactions
 
     :returns: the indexes of the columns not to be considered for the
        calculation of the z-score
     """
+    matrx = _as_matrix(matrx)
+    sums = _column_sums(matrx)
     if method == 'mean':
-        bads = filter_by_mean(matrx, draw_hist=False, silent=silent)
+        bads = filter_by_mean(matrx, draw_hist=False, silent=silent, sums=sums)
     elif method == 'zeros':
         bads = filter_by_zero_count(matrx)
     elif method == 'mad':
-        bads = filter_by_mad(matrx)
+        bads = filter_by_mad(matrx, sums=sums)
     elif method == 'stdev':
-        bads = filter_by_stdev(matrx)
+        bads = filter_by_stdev(matrx, sums=sums)
     else:
         raise Exception
     # remove row and columns that have a zero in the diagonal
     # also removes rows or columns containing a NaN
-    has_nans = False
-    for i in xrange(len(matrx)):
-        if matrx[i][i] == 0:
-            if not i in bads:
-                bads[i] = None
-        elif repr(sum(matrx[i])) == 'nan':
-            has_nans = True
-            if not i in bads:
-                bads[i] = None
+    diag = np.asarray(matrx.diagonal())
+    nans = (diag != 0) & np.isnan(sums)
+    has_nans = bool(nans.any())
+    for i in np.flatnonzero((diag == 0) | nans).tolist():
+        if not i in bads:
+            bads[i] = None
     return bads, has_nans
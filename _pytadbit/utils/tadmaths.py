@@ -69,11 +69,19 @@ def transform(val):
 
 def nozero_log(values):
     # Set the virtual minimum of the matrix to half the non-null real minimum
-    minv = float(min([v for v in values.values() if v])) / 2
+    if isinstance(values, np.ndarray):
+        minv = float(values[values != 0].min()) / 2
+    else:
+        minv = float(min([v for v in values.values() if v])) / 2
     if minv > 1:
         warn('WARNING: probable problem with normalization, check.\n')
         minv /= 2  # TODO: something better
     logminv = transform(minv)
+    if isinstance(values, np.ndarray):
+        positive = values > 0
+        values[positive] = np.log10(values[positive])
+        values[~positive] = logminv
+        return
     for i in values:
         try:
             values[i] = transform(values[i])
@@ -120,6 +128,10 @@ def zscore(values):
     """
     # get the log trasnform values
     nozero_log(values)
+    if isinstance(values, np.ndarray):
+        values -= np.mean(values)
+        values /= np.std(values)
+        return
     mean_v = np.mean(values.values())
     std_v  = np.std (values.values())
     # replace values by z-score
@@ -127,6 +139,123 @@ def zscore(values):
         values[i] = (values[i] - mean_v) / std_v
 
 
+class ZScores(object):
+    """
+    Z-scores (or any other value) of the cells of the upper triangle of a
+    Hi-C matrix, stored in a flat array, with NaN for the cells not
+    available (e.g. cells of filtered columns).
+
+    For backward compatibility it can be used as a dictionary of
+    dictionaries keyed by the string of the bin numbers, i.e.:
+    zscores[str(i)][str(j)] with i < j.
+
+    :param values: flat array with the values of the upper triangle of the
+       matrix (diagonal excluded), row after row
+    :param size: number of rows/columns of the matrix
+    :param False integers: values are returned as integers (NaN is only
+       used to mark missing cells)
+    """
+    def __init__(self, values, size, integers=False):
+        self.data = values
+        self.size = size
+        self.integers = integers
+        # first cell of each row in the flat array
+        self._row_start = np.cumsum([0] + range(size - 1, 0, -1))
+        self._rows = [str(i) for i in xrange(size - 1)
+                      if not np.isnan(self._row(i)).all()]
+        self._row_set = frozenset(self._rows)
+
+    def _row(self, i):
+        start = self._row_start[i]
+        return self.data[start:start + self.size - i - 1]
+
+    def matrix(self):
+        """
+        :returns: a square numpy array with the values of both triangles of
+           the matrix (NaN on the diagonal and for the missing cells)
+        """
+        mtrx = np.empty((self.size, self.size))
+        mtrx.fill(float('nan'))
+        for i in xrange(self.size - 1):
+            mtrx[i, i + 1:] = self._row(i)
+            mtrx[i + 1:, i] = self._row(i)
+        return mtrx
+
+    def __getitem__(self, i):
+        if not i in self._row_set:
+            raise KeyError(i)
+        return _ZScoresRow(self, int(i))
+
+    def __contains__(self, i):
+        return i in self._row_set
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def keys(self):
+        return self._rows[:]
+
+    def values(self):
+        return [self[i] for i in self._rows]
+
+    def items(self):
+        return [(i, self[i]) for i in self._rows]
+
+    def get(self, i, default=None):
+        return self[i] if i in self._row_set else default
+
+
+class _ZScoresRow(object):
+    """
+    Dictionary-like view of one row of a ZScores object.
+    """
+    def __init__(self, zscores, i):
+        self._i = i
+        self._values = zscores._row(i)
+        self._cast = int if zscores.integers else float
+
+    def _col(self, j):
+        try:
+            col = int(j) - self._i - 1
+        except ValueError:
+            return None
+        if 0 <= col < len(self._values) and not np.isnan(self._values[col]):
+            return col
+        return None
+
+    def __getitem__(self, j):
+        col = self._col(j)
+        if col is None:
+            raise KeyError(j)
+        return self._cast(self._values[col])
+
+    def __contains__(self, j):
+        return self._col(j) is not None
+
+    def keys(self):
+        return [str(self._i + 1 + col)
+                for col in np.flatnonzero(~np.isnan(self._values))]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return int((~np.isnan(self._values)).sum())
+
+    def values(self):
+        return [self._cast(v) for v in self._values[~np.isnan(self._values)]]
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def get(self, j, default=None):
+        col = self._col(j)
+        return default if col is None else self._cast(self._values[col])
+
+
 def calinski_harabasz(scores, clusters):
     """
     Implementation of the CH score [CalinskiHarabasz1974]_, that has shown to be
@@ -172,3 +301,62 @@ def calinski_harabasz(scores, clusters):
             /
             (within_cluster / (nmodels - len(cluster_list))))
 
+
+
+def _matvec(matrix, vec, chunk=1024):
+    """
+    Product of a Hi-C matrix (dense numpy array or scipy sparse matrix) by a
+    vector of floats. Dense matrices are converted to floats by blocks of rows
+    to avoid copying the whole matrix.
+    """
+    if hasattr(matrix, 'tocsr'):
+        return matrix.dot(vec)
+    out = np.empty(len(vec))
+    for i in xrange(0, len(vec), chunk):
+        out[i:i + chunk] = np.dot(matrix[i:i + chunk], vec)
+    return out
+
+
+def iterative_correction(matrix, mask=None, tolerance=1e-5, max_iter=1000):
+    """
+    Iterative correction (ICE) of a Hi-C matrix, as described in:
+    Imakaev M. et al. (2012) Nature Methods, 9, 999-1003.
+    Finds the bias of each bin so that all the rows of the corrected matrix
+    (matrix[i][j] / (bias[i] * bias[j])) have the same sum. The matrix is
+    never copied, each iteration only needs one product of the matrix by a
+    vector.
+
+    :param matrix: square Hi-C matrix, as a numpy array or as a scipy sparse
+       matrix (e.g. holding only a band around the diagonal)
+    :param None mask: array of booleans, False for the bins to be discarded
+       (e.g. filtered columns)
+    :param 1e-5 tolerance: maximum relative deviation of the row sums of the
+       corrected matrix from their mean, to stop iterating
+    :param 1000 max_iter: maximum number of iterations
+
+    :returns: the bias of each bin (0 for discarded bins), scaled so that the
+       corrected matrix keeps the mean row sum of the input, and the number of
+       iterations done (max_iter + 1 if it did not converge)
+    """
+    size = matrix.shape[0]
+    valid = np.ones(size, dtype=bool) if mask is None else np.array(mask)
+    inv = valid.astype(float)
+    rowsums = _matvec(matrix, inv) * inv
+    valid &= rowsums > 0
+    if not valid.any():
+        raise Exception('ERROR: no valid rows to normalize\n')
+    mean_sum = rowsums[valid].mean()
+    bias = valid.astype(float)
+    for iteration in xrange(1, max_iter + 2):
+        inv = np.zeros(size)
+        inv[valid] = 1. / bias[valid]
+        rowsums = _matvec(matrix, inv) * inv
+        rowsums = rowsums[valid] / rowsums[valid].mean()
+        if np.abs(rowsums - 1).max() < tolerance or iteration > max_iter:
+            break
+        bias[valid] *= rowsums
+    # the corrected matrix has a mean row sum of mean(rowsums); scale it back
+    inv = np.zeros(size)
+    inv[valid] = 1. / bias[valid]
+    bias *= np.sqrt((_matvec(matrix, inv) * inv)[valid].mean() / mean_sum)
+    return bias, iteration
@@ -32,6 +32,18 @@ def generate_sphere_points(n=100):
     return points
 
 
+def list_of_floats(coords):
+    """
+    Coordinates as a list of python floats (coordinates of the models in a
+    StructuralModels object are numpy arrays).
+
+    :param coords: list or array of coordinates
+    """
+    if isinstance(coords, np.ndarray):
+        return coords.tolist()
+    return list(coords)
+
+
 def get_center_of_mass(x, y, z):
     """
     get the center of mass of a given object with list of x, y, z coordinates
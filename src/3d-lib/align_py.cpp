@@ -1,5 +1,6 @@
 #include "Python.h"
 #include "align.h"
+#include "py_coords.h"
 
 
 /* The function doc string */
@@ -33,8 +34,6 @@ static PyObject* aligner3d_wrapper(PyObject* self, PyObject* args)
  
   float **xyz1;
   float **xyz2;
-  int i;
-  int j;
 
  
   xyz1 = new float*[size];
@@ -47,13 +46,15 @@ static PyObject* aligner3d_wrapper(PyObject* self, PyObject* args)
   }
 
 
-  for (i=0; i<size; i++){
-    xyz1[i][0] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(py_xs1, i));
-    xyz1[i][1] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(py_ys1, i));
-    xyz1[i][2] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(py_zs1, i));
-    xyz2[i][0] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(py_xs2, i));
-    xyz2[i][1] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(py_ys2, i));
-    xyz2[i][2] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(py_zs2, i));
+  if (!getCoords(py_xs1, py_ys1, py_zs1, size, xyz1) ||
+      !getCoords(py_xs2, py_ys2, py_zs2, size, xyz2)) {
+    for (int i=0; i<size; i++) {
+      delete[] xyz1[i];
+      delete[] xyz2[i];
+    }
+    delete[] xyz1;
+    delete[] xyz2;
+    return NULL;
   }
 
   align(xyz2, xyz1, size);
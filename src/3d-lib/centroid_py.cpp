@@ -1,5 +1,6 @@
 #include "Python.h"
 #include "3dStats.h"
+#include "py_coords.h"
 #include <iostream>
 #include <string>
 using namespace std;
@@ -34,7 +35,6 @@ static PyObject* centroid_wrapper(PyObject* self, PyObject* args)
     return NULL;
  
   float **xyz;
-  int i;
   int j;
   int numP;
   float dist2Avg;
@@ -66,10 +66,19 @@ static PyObject* centroid_wrapper(PyObject* self, PyObject* args)
 
   for (j=0; j<nmodels; j++){
 
-    for (i=0; i<size; i++){
-      xyz[i][0] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(PyList_GET_ITEM(py_xs, j), i));
-      xyz[i][1] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(PyList_GET_ITEM(py_ys, j), i));
-      xyz[i][2] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(PyList_GET_ITEM(py_zs, j), i));
+    if (!getModelCoords(py_xs, py_ys, py_zs, j, size, xyz)) {
+      for (it1=xyzlist.begin(); it1!=xyzlist.end(); it1++) {
+	for (int i=0; i<size; i++)
+	  delete[] it1->second[i];
+	delete[] it1->second;
+      }
+      for (int i=0; i<size; i++) {
+	delete[] xyz[i];
+	delete[] avg[i];
+      }
+      delete[] xyz;
+      delete[] avg;
+      return NULL;
     }
     tmpStr.str("");
     tmpStr.clear();
@@ -120,7 +129,6 @@ static PyObject* centroid_wrapper(PyObject* self, PyObject* args)
     PyObject * py_result = NULL;
     PyObject * py_subresult = NULL;
     py_result = PyList_New(3);
-    i=0;
     for (int j = 0; j < 3; ++j) {
       py_subresult = PyList_New(size);
       for (int i = 0; i < size; ++i) {
@@ -1,5 +1,6 @@
 #include "Python.h"
 #include "3dStats.h"
+#include "py_coords.h"
 // #include <iostream>
 // using namespace std;
 
@@ -77,9 +78,21 @@ static PyObject* rmsdRMSD_wrapper(PyObject* self, PyObject* args)
     for (i=0; i<size; i++){
       xyzn[j][i] = new float[3];
       memset(xyzn[j][i], 0, 3*sizeof(float));
-      xyzn[j][i][0] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(PyList_GET_ITEM(py_xs, j ), i));
-      xyzn[j][i][1] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(PyList_GET_ITEM(py_ys, j ), i));
-      xyzn[j][i][2] = PyFloat_AS_DOUBLE(PyList_GET_ITEM(PyList_GET_ITEM(py_zs, j ), i));
+    }
+    if (!getModelCoords((PyObject*)py_xs, (PyObject*)py_ys, (PyObject*)py_zs,
+			j, size, xyzn[j])) {
+      for (jj=0; jj<nmodels; jj++){
+	if (jj <= j)
+	  for (i=0; i<size; i++)
+	    delete[] xyzn[jj][i];
+	delete[] xyzn[jj];
+      }
+      delete[] xyzn;
+      delete[] nrmsds;
+      delete[] drmsds;
+      delete[] scores;
+      Py_DECREF(py_result);
+      return NULL;
     }
   }
   // cout << "START2" << endl << flush;
@@ -0,0 +1,93 @@
+#ifndef PY_COORDS_H
+#define PY_COORDS_H
+
+#include "Python.h"
+
+/* Reads 'size' coordinates of one axis from an object exposing doubles
+   through the buffer interface (e.g. a numpy float64 array, possibly a
+   strided view), without converting it to python floats.
+   Returns 1 on success, 0 if the object does not hold native doubles (no
+   python exception set) and -1 on error (python exception set). */
+static inline int getBufferCoords(PyObject *py_seq, int size, float **xyz,
+				  int k)
+{
+  Py_buffer view;
+  const char *fmt;
+
+  if (!PyObject_CheckBuffer(py_seq))
+    return 0;
+  if (PyObject_GetBuffer(py_seq, &view, PyBUF_STRIDES | PyBUF_FORMAT) < 0) {
+    PyErr_Clear();
+    return 0;
+  }
+  fmt = view.format ? view.format : "B";
+  if (*fmt == '@' || *fmt == '=')
+    fmt++;
+  if (view.ndim != 1 || strcmp(fmt, "d") != 0) {
+    PyBuffer_Release(&view);
+    return 0;
+  }
+  if (view.shape[0] < size) {
+    PyErr_SetString(PyExc_ValueError, "not enough coordinates in model");
+    PyBuffer_Release(&view);
+    return -1;
+  }
+  for (int i = 0; i < size; i++)
+    xyz[i][k] = *(double *) ((char *) view.buf + i * view.strides[0]);
+  PyBuffer_Release(&view);
+  return 1;
+}
+
+/* Reads the coordinates of one model, passed as three sequences of numbers
+   (python lists or numpy arrays, read directly from their buffer when they
+   hold doubles), into xyz.
+   Returns 0 (with a python exception set) on failure. */
+static inline int getCoords(PyObject *py_x, PyObject *py_y, PyObject *py_z,
+			    int size, float **xyz)
+{
+  PyObject *py_seqs[3] = {py_x, py_y, py_z};
+  PyObject *py_fast;
+  int ok;
+
+  for (int k = 0; k < 3; k++) {
+    ok = getBufferCoords(py_seqs[k], size, xyz, k);
+    if (ok < 0)
+      return 0;
+    if (ok)
+      continue;
+    py_fast = PySequence_Fast(py_seqs[k], "coordinates should be a sequence");
+    if (py_fast == NULL)
+      return 0;
+    if (PySequence_Fast_GET_SIZE(py_fast) < size) {
+      PyErr_SetString(PyExc_ValueError, "not enough coordinates in model");
+      Py_DECREF(py_fast);
+      return 0;
+    }
+    for (int i = 0; i < size; i++)
+      xyz[i][k] = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(py_fast, i));
+    Py_DECREF(py_fast);
+    if (PyErr_Occurred())
+      return 0;
+  }
+  return 1;
+}
+
+/* Same as getCoords, for the jth model of a list of models (or of a 2D
+   array, with one model per row). */
+static inline int getModelCoords(PyObject *py_xs, PyObject *py_ys,
+				 PyObject *py_zs, int j, int size, float **xyz)
+{
+  PyObject *py_x = PySequence_GetItem(py_xs, j);
+  PyObject *py_y = PySequence_GetItem(py_ys, j);
+  PyObject *py_z = PySequence_GetItem(py_zs, j);
+  int ok = 0;
+
+  if (py_x && py_y && py_z)
+    ok = getCoords(py_x, py_y, py_z, size, xyz);
+  Py_XDECREF(py_x);
+  Py_XDECREF(py_y);
+  Py_XDECREF(py_z);
+  return ok;
+}
+
+#endif
@@ -1,15 +1,6 @@
 #include "tadbit.h"
 
 
-// Global variables. //
-
-int *_cache_index;
-int _max_cache_index;
-int n_processed;              // Number of slices processed so far.
-int n_to_process;             // Total number of slices to process.
-int taskQ_i;                  // Index used for task queue.
-pthread_mutex_t tadbit_lock;  // Mutex to access task queue.
-
 // Convenience function to erase tadbit_output data structure //
 void
 destroy_tadbit_output(
@@ -21,15 +12,165 @@ destroy_tadbit_output(
    free(seg->mllik);
    free(seg->bkpts);
    for (int i = 0 ; i < seg->m ; i++) {
-      free(seg->weights[i]);
+      free(seg->rowsums[i]);
    }   
-   free(seg->weights);
+   free(seg->rowsums);
    free(seg);
 
    return;
 }
 
 
+void *
+pool_worker(
+   void *arg
+){
+// SYNOPSIS:                                                            
+//   Thread function of the workers of a 'thread_pool'. Wait for jobs   
+//   submitted by 'run_pool' and run them until the pool is stopped.    
+//                                                                      
+// PARAMETERS:                                                          
+//   'arg': the thread pool (see header file).                          
+//                                                                      
+// RETURN:                                                              
+//   'void *'                                                           
+//                                                                      
+
+   thread_pool *pool = (thread_pool *) arg;
+   int generation = 0;
+
+   while (1) {
+      pthread_mutex_lock(&pool->lock);
+      while ((pool->generation == generation) && !pool->stop) {
+         pthread_cond_wait(&pool->start, &pool->lock);
+      }
+      if (pool->stop) {
+         pthread_mutex_unlock(&pool->lock);
+         break;
+      }
+      generation = pool->generation;
+      pthread_mutex_unlock(&pool->lock);
+
+      pool->func(pool->arg);
+
+      pthread_mutex_lock(&pool->lock);
+      if (--pool->n_running == 0) pthread_cond_signal(&pool->done);
+      pthread_mutex_unlock(&pool->lock);
+   }
+
+   return NULL;
+
+}
+
+int
+start_pool(
+   thread_pool *pool,
+   const int n_threads
+){
+// SYNOPSIS:                                                            
+//   Start the workers of a thread pool. The calling thread also runs   
+//   the jobs, so only 'n_threads-1' threads are created.               
+//                                                                      
+// PARAMETERS:                                                          
+//   'pool': the thread pool to initialize.                             
+//   'n_threads': the total number of threads running the jobs.         
+//                                                                      
+// RETURN:                                                              
+//   0 on success, the error code of 'pthread_create' otherwise.        
+//                                                                      
+
+   int i;
+   int err;
+
+   pool->func = NULL;
+   pool->arg = NULL;
+   pool->n_threads = 1;
+   pool->generation = 0;
+   pool->n_running = 0;
+   pool->stop = 0;
+   pool->tid = (pthread_t *) malloc(n_threads * sizeof(pthread_t));
+   pthread_mutex_init(&pool->lock, NULL);
+   pthread_cond_init(&pool->start, NULL);
+   pthread_cond_init(&pool->done, NULL);
+
+   for (i = 1 ; i < n_threads ; i++) {
+      err = pthread_create(&(pool->tid[i]), NULL, &pool_worker, pool);
+      if (err) {
+         fprintf(stderr, "error creating thread (%d)\n", err);
+         return err;
+      }
+      pool->n_threads++;
+   }
+
+   return 0;
+
+}
+
+void
+run_pool(
+   thread_pool *pool,
+   void *(*func)(void *),
+   void *arg
+){
+// SYNOPSIS:                                                            
+//   Run 'func(arg)' in every thread of the pool and return when all    
+//   of them are done. Tasks are shared by the threads through the      
+//   task queue of 'arg'.                                               
+//                                                                      
+// PARAMETERS:                                                          
+//   'pool': a thread pool initialized by 'start_pool'.                 
+//   'func': the thread function.                                       
+//   'arg': the arguments of 'func'.                                    
+//                                                                      
+// RETURN:                                                              
+//   'void'                                                             
+//                                                                      
+
+   pthread_mutex_lock(&pool->lock);
+   pool->func = func;
+   pool->arg = arg;
+   pool->n_running = pool->n_threads-1;
+   pool->generation++;
+   pthread_cond_broadcast(&pool->start);
+   pthread_mutex_unlock(&pool->lock);
+
+   func(arg);
+
+   pthread_mutex_lock(&pool->lock);
+   while (pool->n_running > 0) {
+      pthread_cond_wait(&pool->done, &pool->lock);
+   }
+   pthread_mutex_unlock(&pool->lock);
+
+}
+
+void
+stop_pool(
+   thread_pool *pool
+){
+// SYNOPSIS:                                                            
+//   Stop and join the workers of a thread pool and free its memory.    
+//                                                                      
+
+   int i;
+
+   pthread_mutex_lock(&pool->lock);
+   pool->stop = 1;
+   pthread_cond_broadcast(&pool->start);
+   pthread_mutex_unlock(&pool->lock);
+
+   for (i = 1 ; i < pool->n_threads ; i++) {
+      pthread_join(pool->tid[i], NULL);
+   }
+
+   pthread_cond_destroy(&pool->done);
+   pthread_cond_destroy(&pool->start);
+   pthread_mutex_destroy(&pool->lock);
+   free(pool->tid);
+
+}
+
+
 void
 fg(
   // input //
@@ -39,9 +180,7 @@ fg(
   const int    j_,
   const int    _j,
   const int    diag,
-  const int    *k,
-  const double *d,
-  const double *w,
+  const hic_view *obs,
   const double a,
   const double b,
   const double da,
@@ -57,7 +196,7 @@ fg(
 //                                                                      
 // ARGUMENTS:                                                           
 //   See the function 'll' for the description of 'n', 'i_', '_i',      
-//      'j_', '_j', 'diag', 'k', 'd', and 'w'.                          
+//      'j_', '_j', 'diag' and 'obs'.                                   
 //   'a': parameter 'a' of the Poisson regression (see 'poiss_reg').    
 //   'b': parameter 'b' of the Poisson regression (see 'poiss_reg').    
 //   'da': computed differential of 'a' (see 'poiss_reg').              
@@ -87,21 +226,27 @@ fg(
    int j_high = _j+1;
    int index;
 
+   const int *idx = obs->idx;
+   const double *rs = obs->rs;
+   const double *d = obs->d;
+   const int *k;
+
    *f = 0.0; *g = 0.0;
    // Initialize cache.
-   for (index = 0 ; index < _max_cache_index ; index++) c[index] = NAN;
+   for (index = 0 ; index < obs->N ; index++) c[index] = NAN;
 
    for (j = j_low ; j < j_high ; j++) {
       i_high = diag ? j : _i+1;
+      k = obs->k + idx[j]*obs->N;
       for (i = i_low ; i < i_high ; i++) {
          // Retrieve value of the exponential from cache.
-         index = _cache_index[i+j*n];
+         index = abs(idx[i]-idx[j]);
          if (c[index] != c[index]) {
-            c[index] = exp(a+da+(b+db)*d[i+j*n]);
+            c[index] = exp(a+da+(b+db)*d[index]);
          }
-         tmp  =  w[i+j*n] * c[index] - k[i+j*n];
+         tmp  =  rs[i]*rs[j] * c[index] - k[idx[i]];
          *f  +=  tmp;
-         *g  +=  tmp * d[i+j*n];
+         *g  +=  tmp * d[index];
       }
    }
 
@@ -117,10 +262,7 @@ ll(
   const int    j_,
   const int    _j,
   const int    diag,
-  const int    *k,
-  const double *d,
-  const double *w,
-  const double *lg,
+  const hic_view *obs,
         double *c
 ){
 // SYNOPSIS:                                                            
@@ -137,11 +279,10 @@ ll(
 //   'j_': first value of index j (column).                             
 //   '_j': last value of index j (column).                              
 //   'diag': whether the block is half-diagonal (middle block).         
-//   'k': raw hiC counts.                                               
-//   'd': distances from diagonal in log.                               
-//   'w': weights measuring hiC bias.                                   
-//   'lg': log-gamma terms.                                             
-//   'c': address of an array of double for caching.                    
+//   'obs': view of the raw hiC counts, with the row/column sums       
+//      (the weights measuring hiC bias are their products), the        
+//      distances from diagonal in log and the log-gamma terms.         
+//   'c': address of an array of 'obs->N' double for caching.           
 //                                                                      
 // RETURN:                                                              
 //   The maximum log-likelihood of a block of hiC data.                 
@@ -179,29 +320,35 @@ ll(
    // See the comment about 'tmp' in 'fg'.
    long double tmp; 
 
-   fg(n, i_, _i, j_, _j, diag, k, d, w, a, b, da, db, c, &f, &g);
+   const int *idx = obs->idx;
+   const double *rs = obs->rs;
+   const double *d = obs->d;
+   const double *lg = obs->lg;
+   const int *k;
+
+   fg(n, i_, _i, j_, _j, diag, obs, a, b, da, db, c, &f, &g);
 
    // Newton-Raphson until gradient function is less than TOLERANCE.
    // The gradient function is the square norm 'f*f + g*g'.
    while ((oldgrad = f*f + g*g) > TOLERANCE && iter++ < MAXITER) {
 
-      for (index = 0 ; index < _max_cache_index ; index++) c[index] = NAN;
+      for (index = 0 ; index < obs->N ; index++) c[index] = NAN;
       // Compute the derivatives.
       dfda = dfdb = dgda = dgdb = 0.0;
 
       for (j = j_low ; j < j_high ; j++) {
          i_high = diag ? j : _i+1;
          for (i = i_low ; i < i_high ; i++) {
-            index = _cache_index[i+j*n];
+            index = abs(idx[i]-idx[j]);
             // Retrieve value of the exponential from cache.
             if (c[index] != c[index]) { // ERROR.
-               c[index] = exp(a+b*d[i+j*n]);
+               c[index] = exp(a+b*d[index]);
             }
-            tmp   =   w[i+j*n] * c[index];
+            tmp   =   rs[i]*rs[j] * c[index];
             dfda +=   tmp;
-            tmp  *=   d[i+j*n];
+            tmp  *=   d[index];
             dgda +=   tmp;
-            tmp  *=   d[i+j*n];
+            tmp  *=   d[index];
             dgdb +=   tmp;
          }
       }
@@ -211,7 +358,7 @@ ll(
       da = (f*dgdb - g*dfdb) / denom;
       db = (g*dfda - f*dgda) / denom;
 
-      fg(n, i_, _i, j_, _j, diag, k, d, w, a, b, da, db, c, &f, &g);
+      fg(n, i_, _i, j_, _j, diag, obs, a, b, da, db, c, &f, &g);
 
       // Traceback if we are not going down the gradient. Cut the
       // length of the steps in half until this step goes down
@@ -219,7 +366,7 @@ ll(
       for (i = 0 ; (i < 20) && (f*f + g*g > oldgrad) ; i++) {
          da /= 2;
          db /= 2;
-         fg(n, i_, _i, j_, _j, diag, k, d, w, a, b, da, db, c, &f, &g);
+         fg(n, i_, _i, j_, _j, diag, obs, a, b, da, db, c, &f, &g);
       }
 
       // Update 'a' and 'b'.
@@ -240,10 +387,15 @@ ll(
    // No need to reset the cache.
    for (j = j_low ; j < j_high ; j++) {
       i_high = diag ? j : _i+1;
+      k = obs->k + idx[j]*obs->N;
       for (i = i_low ; i < i_high ; i++) {
-         index = _cache_index[i+j*n];
+         index = abs(idx[i]-idx[j]);
+         // Log-gamma terms are tabulated for the most frequent counts.
+         int kij = k[idx[i]];
+         double lgk = (kij >= 0 && kij < obs->n_lg) ?
+            lg[kij] : lgamma(kij+1);
          // Retrieve value of the exponential from cache.
-         llik += c[index] + k[i+j*n]*(a+b*d[i+j*n]) - lg[i+j*n];
+         llik += c[index] + kij*(a+b*d[index]) - lgk;
       }
    }
 
@@ -266,55 +418,50 @@ fill_DP(
 //   'void *'                                                           
 //                                                                      
 // SIDE-EFFECTS:                                                        
-//   Update 'old_llik', 'new_llik' and 'new_bkpt_list' in place.        
+//   Update 'new_llik' and 'from' in place.                             
 //                                                                      
 
    dpworker_arg *myargs = (dpworker_arg *) arg;
    const int n = myargs->n;
+   const int w = myargs->w;
    const double *llikmat = (const double *) myargs->llikmat;
-   double *old_llik = (double *) myargs->old_llik;
+   const double *old_llik = (const double *) myargs->old_llik;
    double *new_llik = (double *) myargs->new_llik;
    const int nbreaks = myargs->nbreaks;
-   int *new_bkpt_list = (int *) myargs->new_bkpt_list;
-   const int *old_bkpt_list = (const int *) myargs->old_bkpt_list;
+   int *from = (int *) myargs->from;
+   tadbit_context *ctx = myargs->ctx;
 
    int i;
+   int j;
+   int j0;
 
-   while (1) {
-      pthread_mutex_lock(&tadbit_lock);
-      if (taskQ_i > n-1) {
-         // Task queue is empty. Exit loop and return
-         pthread_mutex_unlock(&tadbit_lock);
-         break;
-      }
-      // A task gives an end point 'j'.
-      int j = taskQ_i;
-      taskQ_i++;
-      pthread_mutex_unlock(&tadbit_lock);
+   // Claim chunks of end points 'j' until the task queue is empty.
+   while ((j0 = __sync_fetch_and_add(&ctx->taskQ_i, DPCHUNK)) < n) {
+   for (j = j0 ; j < j0+DPCHUNK && j < n ; j++) {
 
       new_llik[j] = -INFINITY;
       int new_bkpt = -1;
 
-      // Cycle over start point 'i'.
-      for (i = 3 * nbreaks ; i < j-3 ; i++) {
+      // Cycle over start point 'i'. Slices longer than 'w' are not
+      // stored in 'llikmat' and cannot be part of a segmentation.
+      i = j-w > 3 * nbreaks ? j-w : 3 * nbreaks;
+      for ( ; i < j-3 ; i++) {
 
          // If NAN the following condition evaluates to false.
-         double tmp = old_llik[i-1] + llikmat[i+j*n];
+         double tmp = old_llik[i-1] + llikmat[i+(j-i)*n];
          if (tmp > new_llik[j]) {
             new_llik[j] = tmp;
             new_bkpt = i-1;
          }
       }
 
-      // Update breakpoint list (skip if log-lik is undefined).
+      // Record the last breakpoint (skip if log-lik is undefined).
       // No need to use mutex because 'j' is different for every thread.
       if (new_llik[j] > -INFINITY) {
-         for (i = 0 ; i < n ; i++) {
-            new_bkpt_list[j+i*n] = old_bkpt_list[new_bkpt+i*n];
-         }
-         new_bkpt_list[j+new_bkpt*n] = 1;
+         from[j] = new_bkpt;
       }
    }
+   }
 
    return NULL;
 
@@ -325,8 +472,9 @@ DPwalk(
   // input //
   const double *llikmat,
   const int n,
+  const int w,
   const int MAXBREAKS,
-  int n_threads,
+  tadbit_context *ctx,
   // output //
   double *mllik,
   int *breakpoints
@@ -336,9 +484,13 @@ DPwalk(
 //   of breakpoints given a matrix of slice maximum log-likelihood.     
 //                                                                      
 // PARAMETERS:                                                          
-//   '*llikmat': matrix of maximum log-likelihood values.               
+//   '*llikmat': matrix of maximum log-likelihood values, stored by     
+//      diagonals (the slice (i,j) is at 'i+(j-i)*n').                  
 //   'n': row/col number of 'llikmat'.                                  
+//   'w': maximum value of 'j-i' stored in 'llikmat'.                   
 //   'MAXBREAKS': The maximum number of breakpoints.                    
+//   'ctx': the context of the call, with the threads computing each    
+//      step of the walk.                                               
 //        -- output arguments --                                        
 //   '*mllik': maximum log-likelihood of the segmentations.             
 //   '*breakpoints': optimal breakpoints per number of breaks.          
@@ -351,26 +503,25 @@ DPwalk(
 //                                                                      
 
    int i;
+   int j;
    int nbreaks;
 
    double new_llik[n];
    double old_llik[n];
 
-   // Breakpoint lists. The first index (row) is the end of the slice,
-   // the second is 1 if this position is an end (breakpoint).
-   // These must be allocated from the heap because 'n' can be large.
-   int *new_bkpt_list = (int *) malloc(n*n * sizeof(int));
-   int *old_bkpt_list = (int *) malloc(n*n * sizeof(int));
+   // Traceback pointers. 'from[j+nbreaks*n]' is the last breakpoint
+   // of the best segmentation of (0,j) with 'nbreaks' breaks, or -1
+   // if this segmentation is the one with 'nbreaks-1' breaks (this
+   // is the case when the log-likelihood is undefined).
+   int *from = (int *) malloc(n*MAXBREAKS * sizeof(int));
 
    // Initializations.
    // 'breakpoints' is a 'n' x 'MAXBREAKS' array. The first index (row)
    // is 1 if there is a breakpoint at that location, the second index
    // (column) is the number of breakpoints.
-   for (i = 0 ; i < n*MAXBREAKS ; i++) breakpoints[i] = 0;
-
-   for (i = 0 ; i < n*n ; i++) {
-      new_bkpt_list[i] = 0;
-      old_bkpt_list[i] = 0;
+   for (i = 0 ; i < n*MAXBREAKS ; i++) {
+      breakpoints[i] = 0;
+      from[i] = -1;
    }
 
    for (i = 0 ; i < MAXBREAKS ; i++) {
@@ -380,66 +531,52 @@ DPwalk(
    // Initialize 'old_llik' to the first line of 'llikmat' containing
    // the log-likelihood of segments starting at index 0.
    for (i = 0 ; i < n ; i++) {
-      old_llik[i] = llikmat[i*n];
+      old_llik[i] = i > w ? NAN : llikmat[i*n];
       new_llik[i] = -INFINITY;
    }
 
-   int err = pthread_mutex_init(&tadbit_lock, NULL);
-   if (err) {
-      fprintf(stderr, "error initializing mutex (%d)\n", err);
-      return;
-   }
-
    dpworker_arg arg = {
       .n = n,
+      .w = w,
       .llikmat = llikmat,
       .old_llik = old_llik,
       .new_llik = new_llik,
       .nbreaks = 1,
-      .new_bkpt_list = new_bkpt_list,
-      .old_bkpt_list = old_bkpt_list,
+      .from = from,
+      .ctx = ctx,
    };
 
-   pthread_t *tid = (pthread_t *) malloc(n_threads * sizeof(pthread_t));
-
-   // Dynamic programming.
+   // Dynamic programming. Every step is run by all the threads of
+   // the pool, and all of them are done before the next step.
    for (nbreaks = 1 ; nbreaks < MAXBREAKS ; nbreaks++) {
 
       arg.nbreaks = nbreaks;
-      // Update breakpoint lists.
-      for (i = 0 ; i < n*n ; i++) {
-         old_bkpt_list[i] = new_bkpt_list[i];
-      }
-      taskQ_i = 3 * nbreaks + 2;
-
-      for (i = 0 ; i < n_threads ; i++) tid[i] = 0;
-      for (i = 0 ; i < n_threads ; i++) {
-         err = pthread_create(&(tid[i]), NULL, &fill_DP, &arg);
-         if (err) {
-            fprintf(stderr, "error creating thread (%d)\n", err);
-            return;
-         }
-      }
+      arg.from = from + nbreaks*n;
+      ctx->taskQ_i = 3 * nbreaks + 2;
 
-      // Wait for threads to return.
-      for (i = 0 ; i < n_threads ; i++) {
-         pthread_join(tid[i], NULL);
-      }
+      run_pool(&ctx->pool, &fill_DP, &arg);
 
       // Update full log-likelihoods.
       mllik[nbreaks] = new_llik[n-1];
 
-      // Record breakpoints.
       for (i = 0 ; i < n ; i++) {
          old_llik[i] = new_llik[i];
-         breakpoints[i+nbreaks*n] = new_bkpt_list[n-1+i*n];
       }
 
    }
 
-   free(tid);
-   free(new_bkpt_list);
-   free(old_bkpt_list);
+   // Record breakpoints by following the traceback pointers from the
+   // end of the last slice.
+   for (nbreaks = 1 ; nbreaks < MAXBREAKS ; nbreaks++) {
+      j = n-1;
+      for (i = nbreaks ; i > 0 ; i--) {
+         if (from[j+i*n] < 0) continue;
+         j = from[j+i*n];
+         breakpoints[j+nbreaks*n] = 1;
+      }
+   }
+
+   free(from);
 
    return;
 
@@ -453,8 +590,9 @@ fill_llikmat(
 //   Compute the log-likelihood of the slices. The element (i,j) of     
 //   the matrix 'llikmat' will contain the log-likelihood  of the       
 //   slice starting at i and ending at j. the matrix is initialized     
-//   with nan because not all elements will be computed. The lower      
-//   triangular part is left out.                                       
+//   with nan because not all elements will be computed. Only the       
+//   slices with 'j-i' up to 'w' are stored, by diagonals: the slice    
+//   (i,j) is at 'i+(j-i)*n'.                                           
 //                                                                      
 // PARAMETERS:                                                          
 //   'arg': thread arguments (see header file for definition).          
@@ -469,45 +607,32 @@ fill_llikmat(
    llworker_arg *myargs = (llworker_arg *) arg;
    const int n = myargs->n;
    const int m = myargs->m;
-   const int **k = (const int **) myargs->k;
-   const double *d = (const double*) myargs->d;
-   const double **w = (const double **) myargs->w;
-   const double **lg= (const double **) myargs->lg;
-   const char *skip = (const char *) myargs->skip;
+   const hic_view *obs = myargs->obs;
+   const int *jobs = (const int *) myargs->jobs;
    double *llikmat = myargs->llikmat;
    const int verbose = myargs->verbose;
+   tadbit_context *ctx = myargs->ctx;
 
    int i;
    int j;
    int l;
 
-   // Cache to speed up computation. Get the max of '_cache_index'
-   // in order to allocate the right size.
-   double *c= (double *) malloc(_max_cache_index * sizeof(double));
-   for (i = 0 ; i < _max_cache_index ; i++) c[i] = 0.0;
+   // Cache to speed up computation, indexed by the distance to the
+   // main diagonal (which is less than the size of the input).
+   double *c= (double *) malloc(obs->N * sizeof(double));
+   for (i = 0 ; i < obs->N ; i++) c[i] = 0.0;
 
+   int job;
    int job_index;
    
    // Break out of the loop when task queue is empty.
-   while (1) {
+   while ((job = __sync_fetch_and_add(&ctx->taskQ_i, 1)) < ctx->n_to_process) {
 
-      pthread_mutex_lock(&tadbit_lock);
-      while ((taskQ_i < n*n) && (skip[taskQ_i] > 0)) {
-         // Fast forward to the next job.
-         taskQ_i++;
-      }
-      if (taskQ_i >= n*n) {
-         // Task queue is empty. Exit loop and return
-         pthread_mutex_unlock(&tadbit_lock);
-         break;
-      }
-      job_index = taskQ_i;
-      taskQ_i++;
-      pthread_mutex_unlock(&tadbit_lock);
+      job_index = jobs[job];
 
       // Compute the log-likelihood of slice '(i,j)'.
       i = job_index % n;
-      j = job_index / n;
+      j = job_index / n + i;
 
       // Make sure that slices have minimum width 3.
       int cornered = (i == 1) || (i == 2) || (j == n-2) || (j == n-3);
@@ -515,19 +640,19 @@ fill_llikmat(
       if (cornered || slice_too_thin) continue;
 
       // Distinct parts of the array, no lock needed.
-      llikmat[i+j*n] = 0.0;
+      llikmat[job_index] = 0.0;
       for (l = 0 ; l < m ; l++) {
          // LABEL: slice ll summation.
-         llikmat[i+j*n] += 
-            ll(n,   0, i-1, i, j, 0, k[l], d, w[l], lg[l], c) / 2 +
-            ll(n,   i,   j, i, j, 1, k[l], d, w[l], lg[l], c) +
-            ll(n, j+1, n-1, i, j, 0, k[l], d, w[l], lg[l], c) / 2;
+         llikmat[job_index] += 
+            ll(n,   0, i-1, i, j, 0, obs+l, c) / 2 +
+            ll(n,   i,   j, i, j, 1, obs+l, c) +
+            ll(n, j+1, n-1, i, j, 0, obs+l, c) / 2;
       }
 
-      n_processed++;
+      int done = __sync_add_and_fetch(&ctx->n_processed, 1);
       if (verbose) {
          fprintf(stderr, "computing likelihood (%0.f%% done)\r",
-            99 * n_processed / (float) n_to_process);
+            99 * done / (float) ctx->n_to_process);
       }
    }
 
@@ -541,7 +666,8 @@ allocate_heur_job(
   char *skip,
   const int i0,
   const int j0,
-  const int n
+  const int n,
+  const int w
 ){
 // SYNOPSIS:                                                            
 //   Create or update thread jobs (used in pre-heuristic).
@@ -551,6 +677,7 @@ allocate_heur_job(
 //   'i0': start position of the approximate TAD.                       
 //   'j0': end position of the approximate TAD.                         
 //   'n': number of rows/columns of the hiC matrix (or 'skip').         
+//   'w': maximum slice length 'j-i' stored in 'skip'.                  
 //                                                                      
 // RETURN:                                                              
 //   'void'                                                             
@@ -564,7 +691,8 @@ allocate_heur_job(
 
    for (j = j0-2 ; j < j0+3 ; j++)
    for (i = i0-2 ; i < i0+3 ; i++)
-      if ((i+j*n > 0) && (i+j*n < n*n)) skip[i+j*n] = 0;
+      if ((i >= 0) && (j < n) && (j-i > 0) && (j-i <= w))
+         skip[i+(j-i)*n] = 0;
 
 }
 
@@ -574,7 +702,8 @@ allocate_new_jobs(
   const int *bkpts,
   const int MAXBREAKS,
   const int nbreaks_opt,
-  const int n
+  const int n,
+  const int w
 ){
 // SYNOPSIS:                                                            
 //   Create or update thread jobs. For an approximate TAD defined by    
@@ -585,6 +714,7 @@ allocate_new_jobs(
 // TODO Update parameters
 //   'skip': the job matrix to update in place.                         
 //   'n': number of rows/columns of the hiC matrix (or 'skip').         
+//   'w': maximum slice length 'j-i' stored in 'skip'.                  
 //                                                                      
 // RETURN:                                                              
 //   'void'                                                             
@@ -612,10 +742,10 @@ allocate_new_jobs(
          if (bkpts[j0+(shift+nbreaks_opt)*n]) {
 
             // Jobs for splitting the TAD.
-            for (j = i0 ; j < j0 ; j++)
-               skip[i0+j*n] = 0;
-            for (i = i0 ; i < j0 ; i++)
-               skip[i+j0*n] = 0;
+            for (j = i0 ; j < j0 && j-i0 <= w ; j++)
+               skip[i0+(j-i0)*n] = 0;
+            for (i = j0 > i0+w ? j0-w : i0 ; i < j0 ; i++)
+               skip[i+(j0-i)*n] = 0;
 
             starts[i0] = 1;
             ends[j0] = 1;
@@ -626,9 +756,9 @@ allocate_new_jobs(
 
    // Jobs for merging the TADs.
    for (i = 0 ; i < n ; i++)
-   for (j = 0 ; j < n ; j++)
-      if (starts[i] && ends[j] && (j-i < 500) && (i < j))
-         skip[i+j*n] = 0;
+   for (j = i+1 ; j < n && j-i <= w ; j++)
+      if (starts[i] && ends[j] && (j-i < 500))
+         skip[i+(j-i)*n] = 0;
 
    free(starts);
    free(ends);
@@ -731,19 +861,6 @@ tadbit
    int i0;
 
 
-   // Allocate memory and initialize variables. The distance
-   // matrix 'dist' is the distance to the main diagonal. Every
-   // element of coordinate (i,j) is on a diagonal; the distance
-   // is the log-shift to the main diagonal 'i-j'.
-   double *init_dist = (double *) malloc(N*N * sizeof(double));
-
-   for (l = 0, i = 0; i < N ; i++) {
-   for (j = 0; j < N ; j++) {
-      init_dist[l] = log(abs(i-j));
-      l++;
-   }
-   }
-
    // Simplify input. Remove line and column if 0 on the diagonal.
    char *remove = (char *) malloc (N * sizeof(char));
    for (i = 0 ; i < N ; i++) {
@@ -767,7 +884,6 @@ tadbit
       // Signal failure.
       seg->maxbreaks = -1;
       // Clean before exit.
-      free(init_dist);
       free(remove);
       // Bye-bye.
       return;
@@ -775,37 +891,65 @@ tadbit
 
    const int MAXBREAKS = nbrks ? nbrks : n/5;
 
-   _cache_index = (int *) malloc(n*n * sizeof(int));
-   _max_cache_index = N+1;
-   // Allocate and copy.
-   double **log_gamma = (double **) malloc(m * sizeof(double *));
-   int **new_obs = (int **) malloc(m * sizeof(int *));
-   double *dist = (double *) malloc(n*n * sizeof(double));
-   for (k = 0 ; k < m ; k++) {
-      l = 0;
-      log_gamma[k] = (double *) malloc(n*n * sizeof(double));
-      new_obs[k] = (int *) malloc(n*n * sizeof(int));
-      for (j = 0 ; j < N ; j++) {
-      for (i = 0 ; i < N ; i++) {
-         if (remove[i] || remove[j]) continue;
-         _cache_index[l] = i > j ? i-j : j-i;
-         log_gamma[k][l] = lgamma(obs[k][i+j*N]+1);
-         new_obs[k][l] = obs[k][i+j*N];
-         dist[l] = init_dist[i+j*N];
-         l++;
-      }
-      }
+   // Slices longer than 'max_tad_size' are never computed, so all the
+   // matrices indexed by slices are stored by diagonals, the slice
+   // (i,j) being at 'i+(j-i)*n'. They have 'n*(w+1)' elements.
+   const int w = (max_tad_size > 0) && (max_tad_size < n-1) ?
+      max_tad_size : n-1;
+
+   // The state of the call is kept in 'ctx' (there is no global
+   // state), and the same threads are used for all the computations.
+   tadbit_context ctx;
+   err = start_pool(&ctx.pool, n_threads);
+   if (err) {
+      stop_pool(&ctx.pool);
+      seg->maxbreaks = -1;
+      free(remove);
+      return;
    }
 
-   // We will not need the initial observations any more.
-   free(init_dist);
-   obs = new_obs;
+   // The input is not copied: 'idx' gives the rows/columns of the
+   // observations that are used.
+   int *idx = (int *) malloc(n * sizeof(int));
+   for (l = 0, i = 0 ; i < N ; i++) {
+      if (!remove[i]) idx[l++] = i;
+   }
 
-   // Make sure the data is symmetric.
-   enforce_symmetry(obs, n, m);
+   // The distance to the main diagonal is the log-shift 'i-j'. The
+   // value is cached by shift (the index in the cache of 'll').
+   double *dist = (double *) malloc(N * sizeof(double));
+   for (i = 0 ; i < N ; i++) {
+      dist[i] = log(i);
+   }
 
+   // Make sure the data is symmetric. If it is not, a symmetrized
+   // copy is used instead of the input.
+   int **sym_obs = NULL;
+   int symmetric = 1;
+   for (k = 0 ; k < m && symmetric ; k++) {
+   for (i = 0 ; i < n && symmetric ; i++) {
+   for (j = i+1 ; j < n && symmetric ; j++) {
+      if (obs[k][idx[i]+idx[j]*N] != obs[k][idx[j]+idx[i]*N]) {
+         symmetric = 0;
+      }
+   }
+   }
+   }
 
-   // Compute row/column sums (identical by symmetry).
+   if (!symmetric) {
+      sym_obs = (int **) malloc(m * sizeof(int *));
+      for (k = 0 ; k < m ; k++) {
+         sym_obs[k] = (int *) malloc(N*N * sizeof(int));
+         for (i = 0 ; i < N*N ; i++) sym_obs[k][i] = obs[k][i];
+      }
+      enforce_symmetry(sym_obs, N, m);
+      obs = sym_obs;
+   }
+
+
+   // Compute row/column sums (identical by symmetry). The weights
+   // are their products, computed on the fly.
+   int maxcount = 0;
    double **rowsums = (double **) malloc(m * sizeof(double *));
    for (k = 0 ; k < m ; k++) {
       rowsums[k] = (double *) malloc(n * sizeof(double));
@@ -814,70 +958,72 @@ tadbit
 
    for (k = 0 ; k < m ; k++)
    for (i = 0 ; i < n ; i++)
-   for (j = 0 ; j < n ; j++)
-      rowsums[k][i] += obs[k][i+j*n];
-
-   // Compute the weights.
-   double **weights = (double **) malloc(m * sizeof(double *));
-   for (k = 0 ; k < m ; k++) {
-      weights[k] = (double *) malloc(n*n * sizeof(double));
-      for (i = 0 ; i < n*n ; i++) weights[k][i] = 0.0;
-      // Compute product.
-      for (j = 0 ; j < n ; j++) {
-      for (i = 0 ; i < n ; i++) {
-         weights[k][i+j*n] = rowsums[k][i]*rowsums[k][j];
-      }
+   for (j = 0 ; j < n ; j++) {
+      rowsums[k][i] += obs[k][idx[i]+idx[j]*N];
+      if (obs[k][idx[i]+idx[j]*N] > maxcount) {
+         maxcount = obs[k][idx[i]+idx[j]*N];
       }
    }
 
-   // We don't need the row/column sums any more.
-   for (l = 0 ; l < m ; l++) free(rowsums[l]);
-   free(rowsums);
+   // Tabulate the log-gamma terms of the counts.
+   const int n_lg = maxcount < MAXLGAMMA ? maxcount+1 : MAXLGAMMA;
+   double *log_gamma = (double *) malloc(n_lg * sizeof(double));
+   for (i = 0 ; i < n_lg ; i++) {
+      log_gamma[i] = lgamma(i+1);
+   }
+
+   hic_view *views = (hic_view *) malloc(m * sizeof(hic_view));
+   for (k = 0 ; k < m ; k++) {
+      views[k].k = obs[k];
+      views[k].N = N;
+      views[k].idx = idx;
+      views[k].rs = rowsums[k];
+      views[k].d = dist;
+      views[k].lg = log_gamma;
+      views[k].n_lg = n_lg;
+   }
 
    double *mllik = (double *) malloc(MAXBREAKS * sizeof(double));
    int *bkpts = (int *) malloc(MAXBREAKS*n * sizeof(int));
-   double *llikmat = (double *) malloc(n*n * sizeof(double));
-   for (i = 0 ; i < n*n ; i++)
+   double *llikmat = (double *) malloc(n*(w+1) * sizeof(double));
+   for (i = 0 ; i < n*(w+1) ; i++)
       llikmat[i] = NAN;
 
    // 'skip' will contain only 0 or 1 and can be stored as 'char'.
-   char *skip = (char *) malloc(n*n * sizeof(char));
+   char *skip = (char *) malloc(n*(w+1) * sizeof(char));
 
    // Use the heuristic by default (hence the name of the parameter).
-   // The parameter 'max_tad_size' is needed only in case the heuristic
-   // is not used.
    if (do_not_use_heuristic) {
-      for (j = 0 ; j < n ; j++)
+      for (j = 0 ; j < w+1 ; j++)
       for (i = 0 ; i < n ; i++)
-         // Also sets the lower triangular part of 'skip'.
-         skip[i+j*n] = (i >= j) || ((j-i) > max_tad_size) ? 1 : 0;
+         // Also sets the elements past the end of the diagonals.
+         skip[i+j*n] = (j == 0) || (i+j >= n) ? 1 : 0;
    }
    else {
       if (verbose) {
          fprintf(stderr, "running pre-heuristic\n");
       }
 
-      for (i = 0 ; i < n*n ; i++) skip[i] = 1;
-
       // 'S[i+j*n]' is the weighted sum of reads within the triangle
-      // defined by ('i','j') in the upper triangular matrix of
+      // defined by ('i','i+j') in the upper triangular matrix of
       // observations.
-      double *S = (double *) malloc(n*n * sizeof(double));
-      for (i = 0 ; i < n*n ; i++) S[i] = 0.0;
-      for (j = 1 ; j < n ; j++) {
+      double *S = (double *) malloc(n*(w+1) * sizeof(double));
+      for (i = 0 ; i < n*(w+1) ; i++) S[i] = 0.0;
+      for (j = 1 ; j < w+1 ; j++) {
       for (i = 0 ; i < n-j ; i++) {
          double weighted_value = 0.0;
          for (l = 0 ; l < m ; l++)
-            weighted_value += obs[l][i+(i+j)*n]/weights[l][i+(i+j)*n];
-         S[i+(i+j)*n] = S[i+(i+j-1)*n] + S[i+1+(i+j)*n] -
-            S[i+1+(i+j-1)*n] + weighted_value;
+            weighted_value += obs[l][idx[i]+idx[i+j]*N] /
+               (rowsums[l][i]*rowsums[l][i+j]);
+         S[i+j*n] = S[i+(j-1)*n] + S[i+1+(j-1)*n] -
+            (j > 1 ? S[i+1+(j-2)*n] : 0.0) + weighted_value;
       }
       }
 
-      double *heur_score = (double *) malloc(n*n * sizeof(double));
-      for (i = 0 ; i < n*n ; i++) heur_score[i] = NAN;
-      for (j = 1 ; j < n ; j++)
-      for (i = 0 ; i < j ; i++)
+      double *heur_score = (double *) malloc(n*(w+1) * sizeof(double));
+      for (i = 0 ; i < n*(w+1) ; i++) heur_score[i] = NAN;
+      for (j = 1 ; j < w+1 ; j++)
+      for (i = 0 ; i < n-j ; i++)
         heur_score[i+j*n] = log(S[i+j*n]);
 
       // Use dynamic programming to find approximate break points.
@@ -885,75 +1031,58 @@ tadbit
       // (it is updated in place, but the value is disregarded), and
       // the heuristic score 'heur_score' plays the role of the
       // log-likelihood 'llikmat'.
-      DPwalk(heur_score, n, MAXBREAKS, n_threads, mllik, bkpts);
+      DPwalk(heur_score, n, w, MAXBREAKS, &ctx, mllik, bkpts);
 
       free(heur_score);
       free(S);
 
       // Create a thread job for each approximate TAD.
-      for (i = 0 ; i < n*n ; i++) skip[i] = 1;
+      for (i = 0 ; i < n*(w+1) ; i++) skip[i] = 1;
       for (j = 1 ; j < MAXBREAKS ; j++) {
          i0 = 0;
          for (i = 0 ; i < n ; i++) {
             if (bkpts[i+j*n]) {
-               allocate_heur_job(skip, i0, i, n);
+               allocate_heur_job(skip, i0, i, n, w);
                i0 = i+1;
             }
          }
       }
 
-      // Erase the lower triangular part of 'skip'.
-      for (j = 0 ; j < n ; j++)
-      for (i = j ; i < n ; i++)
-         skip[i+j*n] = 1;
-
       // Allocate estimation of the log likelihood for all small
       // TADs (less than 3 bins).
       for (j = 6 ; j < n ; j++)
       for (i = j-6 ; i < j-3 ; i++)
-         skip[i+j*n] = 0;
+         if (j-i <= w) skip[i+(j-i)*n] = 0;
 
       // Allocate jobs at the ends of the chromosomes/units because
       // these regions are a bit noisier.
       for (j = 1 ; j < 51 ; j++)
       for (i = 0 ; i < j-3 ; i++)
-         if (i < n && j < n) skip[i+j*n] = 0;
+         if (i < n && j < n && j-i <= w) skip[i+(j-i)*n] = 0;
       for (j = n-51 ; j < n ; j++)
       for (i = n-51 ; i < j-3 ; i++)
-         if (i > 0 && j > 0) skip[i+j*n] = 0;
+         if (i > 0 && j > 0 && j-i <= w) skip[i+(j-i)*n] = 0;
 
-      // Reset lower triangular part of 'skip'.
-      for (j = 0 ; j < n ; j++)
-      for (i = j ; i < n ; i++)
-         skip[i+j*n] = 1;
+      // Reset the main diagonal of 'skip'.
+      for (i = 0 ; i < n ; i++)
+         skip[i] = 1;
 
    } // End of pre-heuristic.
 
 
-   // Allocate 'tid'.
-   pthread_t *tid = (pthread_t *) malloc(n_threads * sizeof(pthread_t));
+   // The jobs of a cycle are the indices of the slices not skipped.
+   int *jobs = (int *) malloc(n*(w+1) * sizeof(int));
 
    llworker_arg arg = {
       .n = n,
       .m = m,
-      .k = (const int **) obs,
-      .d = dist,
-      .w = (const double **) weights,
-      .lg = (const double **) log_gamma,
-      .skip = skip,
+      .obs = views,
+      .jobs = jobs,
       .llikmat = llikmat,
       .verbose = verbose,
+      .ctx = &ctx,
    };
 
-   err = pthread_mutex_init(&tadbit_lock, NULL);
-   if (err) {
-      fprintf(stderr, "error initializing mutex (%d)\n", err);
-      // Signal failure.
-      seg->maxbreaks = -1;
-      // TODO: free memory before exit.
-      return;
-   }
-
    int n_params;
    int nbreaks_opt = 0;
    double AIC = -INFINITY;
@@ -968,31 +1097,17 @@ tadbit
       AIC = newAIC;
 
       // Initialize task queue.
-      n_to_process = 0;
-      for (i = 0 ; i < n*n ; i++) {
+      ctx.n_to_process = 0;
+      for (i = 0 ; i < n*(w+1) ; i++) {
          // Skip all computation done in previous cycles.
          if (!isnan(llikmat[i])) skip[i] = 1;
-         n_to_process += (1-skip[i]);
+         if (!skip[i]) jobs[ctx.n_to_process++] = i;
       }
-      n_processed = 0;
-      taskQ_i = 0;
+      ctx.n_processed = 0;
+      ctx.taskQ_i = 0;
       
-      // Instantiate threads and start running jobs.
-      for (i = 0 ; i < n_threads ; i++) tid[i] = 0;
-      for (i = 0 ; i < n_threads ; i++) {
-         err = pthread_create(&(tid[i]), NULL, &fill_llikmat, &arg);
-         if (err) {
-            fprintf(stderr, "error creating thread (%d)\n", err);
-            seg->maxbreaks = -1;
-            // TODO: free memory before exit.
-            return;
-         }
-      }
-
-      // Wait for threads to return.
-      for (i = 0 ; i < n_threads ; i++) {
-         pthread_join(tid[i], NULL);
-      }
+      // Run the jobs in all threads.
+      run_pool(&ctx.pool, &fill_llikmat, &arg);
       if (verbose) {
          fprintf(stderr, "computing likelihood (100%% done)\n");
       }
@@ -1001,7 +1116,7 @@ tadbit
       // segments. The breakpoints are found by dynamic programming.
       int maxbreaks = nbreaks_opt ? nbreaks_opt + 11 : MAXBREAKS;
       if (maxbreaks > MAXBREAKS) maxbreaks = MAXBREAKS;
-      DPwalk(llikmat, n, maxbreaks, n_threads, mllik, bkpts);
+      DPwalk(llikmat, n, w, maxbreaks, &ctx, mllik, bkpts);
 
       // Get optimal number of breaks by AIC.
       newAIC = -INFINITY;
@@ -1012,26 +1127,31 @@ tadbit
       }
       nbreaks_opt -= 1;
 
-      allocate_new_jobs(skip, bkpts, MAXBREAKS, nbreaks_opt, n);
+      allocate_new_jobs(skip, bkpts, MAXBREAKS, nbreaks_opt, n, w);
 
    }
 
    AIC = newAIC;
 
-   pthread_mutex_destroy(&tadbit_lock);
    free(skip);
-   free(tid);
-   free(_cache_index);
+   free(jobs);
+   free(views);
+   free(log_gamma);
+   free(dist);
+   if (sym_obs != NULL) {
+      for (k = 0 ; k < m ; k++) free(sym_obs[k]);
+      free(sym_obs);
+   }
 
    nbreaks_opt = nbrks ? (int) nbrks - 1 : nbreaks_opt;
 
    // Compute breakpoint confidence by penalized dynamic progamming.
-   double *llikmatcpy = (double *) malloc (n*n * sizeof(double));
+   double *llikmatcpy = (double *) malloc (n*(w+1) * sizeof(double));
    double *mllikcpy = (double *) malloc(MAXBREAKS * sizeof(double));
    int *bkptscpy = (int *) malloc(n*MAXBREAKS * sizeof(int));
    int *passages = (int *) malloc(n * sizeof(int));
    for (i = 0 ; i < n*MAXBREAKS ; i++) bkptscpy[i] = bkpts[i];
-   for (i = 0 ; i < n*n ; i++) llikmatcpy[i] = llikmat[i];
+   for (i = 0 ; i < n*(w+1) ; i++) llikmatcpy[i] = llikmat[i];
    for (i = 0 ; i < n ; i++) passages[i] = 0;
 
    for (l = 0 ; l < 10 ; l++) {
@@ -1042,37 +1162,29 @@ tadbit
             // in the final decomposition. The penalty is set to
             // 'm*6' because it is the expected log-likelihood gain
             // for adding a new TAD around the optimum log-likelihood.
-            llikmatcpy[i+j*n] -= m*6;
+            if (j-i <= w) llikmatcpy[i+(j-i)*n] -= m*6;
             passages[j] += bkpts[j+nbreaks_opt*n];
             i = j+1;
          }
       }
-      if (i < n) llikmatcpy[i+(n-1)*n] -= m*6;
-      DPwalk(llikmatcpy, n, nbreaks_opt+1, n_threads, mllikcpy, bkptscpy);
+      if (i < n && n-1-i <= w) llikmatcpy[i+(n-1-i)*n] -= m*6;
+      DPwalk(llikmatcpy, n, w, nbreaks_opt+1, &ctx, mllikcpy, bkptscpy);
    }
+   stop_pool(&ctx.pool);
    free(llikmatcpy);
    free(mllikcpy);
    free(bkptscpy);
 
    
    // Resize output to match original.
-   int p;
-   double **resized_weights = (double **) malloc(m * sizeof(double *));
-   for (l = 0 ; l < m ; l++) {
-      resized_weights[l] = (double *) malloc(N*N * sizeof(double));
-      for (i = 0 ; i < N*N ; i++) resized_weights[l][i] = 0.0;
-   }
+   double **resized_rowsums = (double **) malloc(m * sizeof(double *));
    for (k = 0 ; k < m ; k++) {
-      for (l = 0, i = 0 ; i < N ; i++) {
-         if (remove[i]) continue;
-         for (p = 0, j = 0 ; j < N ; j++) {
-            if (remove[j]) continue;
-            resized_weights[k][i+j*N] = weights[k][l+p*n];
-	    p++;
-	 }
-	 l++;
-      }
+      resized_rowsums[k] = (double *) malloc(N * sizeof(double));
+      for (i = 0 ; i < N ; i++) resized_rowsums[k][i] = 0.0;
+      for (i = 0 ; i < n ; i++) resized_rowsums[k][idx[i]] = rowsums[k][i];
+      free(rowsums[k]);
    }
+   free(rowsums);
 
    int *resized_bkpts = (int *) malloc(N*MAXBREAKS * sizeof(int));
    int *resized_passages = (int *) malloc(N * sizeof(int));
@@ -1090,39 +1202,33 @@ tadbit
    free(passages);
    free(bkpts);
 
-   double *resized_llikmat = (double *) malloc(N*N * sizeof(double));
-   for (i = 0 ; i < N*N ; i++) {
-      resized_llikmat[i] = NAN;
+   // The slices of length up to 'w' may be longer in the original
+   // coordinates because of the removed rows/columns.
+   int band = 0;
+   for (i = 0 ; i < n ; i++) {
+      j = i+w < n ? i+w : n-1;
+      if (idx[j]-idx[i] > band) band = idx[j]-idx[i];
    }
 
-   for (l = 0, i = 0 ; i < N ; i++) {
-      if (remove[i]) continue;
-      for (k = 0, j = 0 ; j < N ; j++) {
-         if (remove[j]) continue;
-         resized_llikmat[i+j*N] = llikmat[l+k*n];
-         k++;
-      }
-      l++;
+   double *resized_llikmat = (double *) malloc(N*(band+1) * sizeof(double));
+   for (i = 0 ; i < N*(band+1) ; i++) {
+      resized_llikmat[i] = NAN;
    }
 
-   free(llikmat);
+   for (j = 0 ; j < w+1 ; j++)
+   for (i = 0 ; i < n-j ; i++)
+      resized_llikmat[idx[i]+(idx[i+j]-idx[i])*N] = llikmat[i+j*n];
 
-   for (k = 0 ; k < m ; k++) {
-      free(new_obs[k]);
-      free(log_gamma[k]);
-      free(weights[k]);
-   }
-   free(weights);
-   free(new_obs);
-   free(log_gamma);
-   free(dist);
+   free(llikmat);
+   free(idx);
    free(remove);
 
    // Update output struct.
    seg->m = m;
    seg->maxbreaks = MAXBREAKS;
    seg->nbreaks_opt = nbreaks_opt;
-   seg->weights = resized_weights;
+   seg->band = band;
+   seg->rowsums = resized_rowsums;
    seg->passages = resized_passages;
    seg->llikmat = resized_llikmat;
    seg->mllik = mllik;
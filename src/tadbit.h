@@ -13,41 +13,82 @@
 
 #define TOLERANCE 1e-6
 #define MAXITER 10000
+#define MAXLGAMMA 1048576
+#define DPCHUNK 16
+
+// Threads waiting for jobs (see 'run_pool'). The calling thread also
+// runs the jobs, so there are 'n_threads-1' workers in 'tid'.
+typedef struct {
+   void *(*func)(void *);
+   void *arg;
+   int n_threads;
+   int generation;
+   int n_running;
+   int stop;
+   pthread_t *tid;
+   pthread_mutex_t lock;
+   pthread_cond_t start;
+   pthread_cond_t done;
+} thread_pool;
+
+// State of a call to 'tadbit', shared by its threads. There is no
+// global state, so that 'tadbit' can run in several threads at once.
+typedef struct {
+   thread_pool pool;
+   int taskQ_i;         // Index used for task queue.
+   int n_processed;     // Number of slices processed so far.
+   int n_to_process;    // Total number of slices to process.
+} tadbit_context;
+
+// Read-only view of the counts of one replicate. Only the rows and
+// columns listed in 'idx' are used, so the input matrix is never
+// copied. The weights are the products of the row/column sums 'rs'.
+typedef struct {
+   const int *k;        // Raw counts ('N' x 'N').
+   int N;
+   const int *idx;      // Rows/columns of 'k' in use.
+   const double *rs;    // Row/column sums.
+   const double *d;     // Log-distances by distance on 'k'.
+   const double *lg;    // Log-gamma terms by count.
+   int n_lg;            // Size of 'lg'.
+} hic_view;
 
 typedef struct {
    const int n;
    const int m;
-   const int **k;
-   const double *d;
-   const double **w;
-   const double **lg;
-   const char *skip;
+   const hic_view *obs;
+   const int *jobs;
    double *llikmat;
    const int verbose;
+   tadbit_context *ctx;
 } llworker_arg;
 
 typedef struct {
    const int n;
+   const int w;
    const double *llikmat;
    double *old_llik;
    double *new_llik;
    int nbreaks;
-   int *new_bkpt_list;
-   const int *old_bkpt_list;
+   int *from;
+   tadbit_context *ctx;
 } dpworker_arg;
 
 
 
-// 'tadbit' output struct.
+// 'tadbit' output struct. The log-likelihood of the slice (i,j) is
+// stored in 'llikmat[i+(j-i)*N]' for 'j-i <= band', and the weights of
+// replicate 'l' are the products 'rowsums[l][i]*rowsums[l][j]'.
 typedef struct {
    int m;
    int maxbreaks;
    int nbreaks_opt;
+   int band;
    int *passages;
    double *llikmat;
    double *mllik;
    int *bkpts;
-   double **weights;
+   double **rowsums;
 } tadbit_output;
 
 
@@ -12,19 +12,217 @@ PyDoc_STRVAR(tadbit_py__doc__,
 /* The function doc string */
 PyDoc_STRVAR(_tadbit_wrapper__doc__,
 "Run tadbit function in tadbit.c.\n\
-    :argument obs: a python list of lists of floats, representing a list of linearized matrices.\n\
+    :argument obs: a python list of linearized matrices, each being either a tuple of integers or\n\
+       any contiguous object exposing the buffer interface (e.g. a numpy array).\n\
     :argument 0 n: number of rows or columns in the matrix\n\
     :argument 0 m: number of matrices\n\
     :argument 0 n_threads: number of threads to use\n\
     :argument 0 verbose: whether to display more/less information about process\n\
     :argument 0 max_tad_size: an integer defining maximum size of TAD. Default defines it to the number of rows/columns.\n\
     :argument 1 do_not_use_heuristic: whether to use or not some heuristics\n\
+    :argument 0 as_arrays: if 1, passages, llikmat, mllik and bkpts are returned as objects\n\
+       owning the C arrays (ints or doubles, to be read with numpy.frombuffer), and the\n\
+       row/column sums of each matrix are returned instead of the weights (their products).\n\
+       llikmat is then stored by diagonals: row d of llikmat.reshape(-1, n) holds the\n\
+       log-likelihoods of the slices (i, i+d), up to max_tad_size\n\
     :returns: a python list with each\n");
 
 
+/* Python object owning an array allocated by the C library, exposed
+   through the buffer interface (old and new) so that numpy.frombuffer reads
+   it without any copy. The array is freed with the object. */
+typedef struct {
+  PyObject_HEAD
+  void *buf;
+  Py_ssize_t len;
+} c_array;
+
+
+static void c_array_dealloc(c_array *self){
+  free(self->buf);
+  PyObject_Del(self);
+}
+
+
+static Py_ssize_t c_array_getreadbuf(c_array *self, Py_ssize_t segment,
+                                     void **ptr){
+  if (segment != 0){
+    PyErr_SetString(PyExc_SystemError, "accessing non-existent segment");
+    return -1;
+  }
+  *ptr = self->buf;
+  return self->len;
+}
+
+
+static Py_ssize_t c_array_getsegcount(c_array *self, Py_ssize_t *lenp){
+  if (lenp)
+    *lenp = self->len;
+  return 1;
+}
+
+
+static int c_array_getbuffer(c_array *self, Py_buffer *view, int flags){
+  return PyBuffer_FillInfo(view, (PyObject *) self, self->buf, self->len, 0,
+                           flags);
+}
+
+
+static PyBufferProcs c_array_as_buffer = {
+  (readbufferproc) c_array_getreadbuf,
+  (writebufferproc) c_array_getreadbuf,
+  (segcountproc) c_array_getsegcount,
+  NULL,
+  (getbufferproc) c_array_getbuffer,
+  NULL,
+};
+
+
+static PyTypeObject c_array_type = {
+  PyVarObject_HEAD_INIT(NULL, 0)
+  .tp_name      = "tadbit_py.c_array",
+  .tp_basicsize = sizeof(c_array),
+  .tp_dealloc   = (destructor) c_array_dealloc,
+  .tp_as_buffer = &c_array_as_buffer,
+  .tp_flags     = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_NEWBUFFER,
+  .tp_doc       = "array allocated by the TADbit C library",
+};
+
+
+/* Wrap 'len' bytes at 'buf' (allocated with malloc) in a new c_array,
+   which takes ownership of them (they are freed here on failure). */
+static PyObject *_wrap_c_array(void *buf, Py_ssize_t len){
+  c_array *self = PyObject_New(c_array, &c_array_type);
+  if (self == NULL){
+    free(buf);
+    return NULL;
+  }
+  self->buf = buf;
+  self->len = len;
+  return (PyObject *) self;
+}
+
+
+/* Format characters of the buffer interface that can be read as counts */
+static const char _integer_formats[] = "bBhHiIlLqQ";
+static const char _float_formats[]   = "fd";
+
+
+/* Round a count stored as a float, as the python parser does (see
+   hic_parser.autoreader). NaN, infinite values and values out of the range
+   of C integers cannot be converted (the cast would be undefined). */
+static int _round_count(const double value, int *count){
+  const double rounded = value + .5;
+  if (!isfinite(value) || rounded < INT_MIN || rounded >= (double) INT_MAX + 1){
+    PyErr_Format(PyExc_ValueError,
+                 "matrix values must be finite numbers (found %g)", value);
+    return -1;
+  }
+  *count = (int) rounded;
+  return 0;
+}
+
+
+/* Convert the i-th replicate of 'obs' to a C array of 'size' integers.
+   Tuples are read element by element. Objects exposing the buffer interface
+   are read directly: if they already hold native C integers the buffer is
+   used as is (no copy), otherwise values are cast into a new array. On
+   success, 'owned' tells whether 'dest' has to be freed by the caller, and
+   'view' has to be released if 'view->obj' is not NULL. */
+static int _read_replicate(PyObject *item, const int size, int **dest,
+                           Py_buffer *view, int *owned){
+  int j;
+  char fmt;
+  const char *p;
+
+  view->obj = NULL;
+  *owned = 0;
+  if (PyTuple_Check(item)){
+    if (PyTuple_GET_SIZE(item) != size){
+      PyErr_SetString(PyExc_ValueError, "matrix size does not match 'n'");
+      return -1;
+    }
+    *dest = malloc(size * sizeof(int));
+    *owned = 1;
+    for (j = 0 ; j < size ; j++)
+      (*dest)[j] = PyInt_AsLong(PyTuple_GET_ITEM(item, j));
+    if (PyErr_Occurred())
+      return -1;
+    return 0;
+  }
+  if (!PyObject_CheckBuffer(item)){
+    PyErr_SetString(PyExc_TypeError,
+                    "matrices should be tuples or objects exposing the buffer interface");
+    return -1;
+  }
+  if (PyObject_GetBuffer(item, view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0)
+    return -1;
+  if (view->len / view->itemsize != size){
+    PyErr_SetString(PyExc_ValueError, "matrix size does not match 'n'");
+    return -1;
+  }
+  // skip byte order/alignment character, only native formats are handled
+  p = view->format ? view->format : "B";
+  if (*p == '@' || *p == '=')
+    p++;
+  fmt = *p;
+  if (fmt == '\0' || p[1] != '\0' ||
+      (!strchr(_integer_formats, fmt) && !strchr(_float_formats, fmt))){
+    PyErr_Format(PyExc_TypeError, "unsupported matrix format '%s'",
+                 view->format);
+    return -1;
+  }
+  // native integers: use the buffer directly
+  if ((fmt == 'i' || (fmt == 'l' && sizeof(long) == sizeof(int))) &&
+      view->itemsize == sizeof(int)){
+    *dest = (int *) view->buf;
+    return 0;
+  }
+  *dest = malloc(size * sizeof(int));
+  *owned = 1;
+  for (j = 0 ; j < size ; j++){
+    switch (fmt){
+    case 'b': (*dest)[j] = ((signed char *)        view->buf)[j]; break;
+    case 'B': (*dest)[j] = ((unsigned char *)      view->buf)[j]; break;
+    case 'h': (*dest)[j] = ((short *)              view->buf)[j]; break;
+    case 'H': (*dest)[j] = ((unsigned short *)     view->buf)[j]; break;
+    case 'i': (*dest)[j] = ((int *)                view->buf)[j]; break;
+    case 'I': (*dest)[j] = ((unsigned int *)       view->buf)[j]; break;
+    case 'l': (*dest)[j] = ((long *)               view->buf)[j]; break;
+    case 'L': (*dest)[j] = ((unsigned long *)      view->buf)[j]; break;
+    case 'q': (*dest)[j] = ((long long *)          view->buf)[j]; break;
+    case 'Q': (*dest)[j] = ((unsigned long long *) view->buf)[j]; break;
+    case 'f':
+    case 'd':
+      if (_round_count(fmt == 'f' ? ((float *) view->buf)[j] :
+                       ((double *) view->buf)[j], &(*dest)[j]) < 0)
+        return -1;
+      break;
+    }
+  }
+  return 0;
+}
+
+
+/* Free the integer arrays obtained with '_read_replicate' */
+static void _free_replicates(int **list, Py_buffer *views, int *owned,
+                             const int m){
+  int i;
+  for (i = 0 ; i < m ; i++){
+    if (owned[i])
+      free(list[i]);
+    if (views[i].obj != NULL)
+      PyBuffer_Release(&views[i]);
+  }
+  free(list);
+  free(views);
+  free(owned);
+}
+
+
 /* The wrapper to the underlying C function */
 static PyObject *_tadbit_wrapper (PyObject *self, PyObject *args){
-  PyObject **obs;
+  PyObject *obs;
   int n;
   int m;
   int n_threads;
@@ -32,32 +230,57 @@ static PyObject *_tadbit_wrapper (PyObject *self, PyObject *args){
   const int max_tad_size;
   const int nbks;
   const int do_not_use_heuristic;
+  int as_arrays = 0;
   /* output */
-  tadbit_output *seg = (tadbit_output *) malloc(sizeof(tadbit_output));
+  tadbit_output *seg;
 
-  if (!PyArg_ParseTuple(args, "Oiiiiiii:tadbit", &obs, &n, &m, &n_threads, &verbose, &max_tad_size, &nbks, &do_not_use_heuristic))
+  if (!PyArg_ParseTuple(args, "O!iiiiiii|i:tadbit", &PyList_Type, &obs, &n, &m, &n_threads, &verbose, &max_tad_size, &nbks, &do_not_use_heuristic, &as_arrays))
+    return NULL;
+  if (PyList_GET_SIZE(obs) != m){
+    PyErr_SetString(PyExc_ValueError, "number of matrices does not match 'm'");
     return NULL;
+  }
 
-  // convert list of lists to pointer o pointers
-  // if something goes wrong, it is probably from there :S
+  // get a pointer to the integer values of each matrix, copying them only
+  // when they are not already stored as C integers
   int i, j;
-  int ** list;
-  list = malloc(m * sizeof(int*));
-  for (i = 0 ; i < m ; i++ )
-    list[i] = malloc(n*n * sizeof(int));
-  for (i = 0 ; i < m ; i++)
-    for (j = 0 ; j < n*n ; j++)
-      list[i][j] = PyInt_AS_LONG(PyTuple_GET_ITEM(PyList_GET_ITEM(obs, i), j));
-
-  // run tadbit
+  int ** list = malloc(m * sizeof(int*));
+  Py_buffer * views = malloc(m * sizeof(Py_buffer));
+  int * owned = malloc(m * sizeof(int));
+  for (i = 0 ; i < m ; i++){
+    owned[i] = 0;
+    views[i].obj = NULL;
+  }
+  for (i = 0 ; i < m ; i++){
+    if (_read_replicate(PyList_GET_ITEM(obs, i), n*n, &list[i], &views[i],
+                        &owned[i]) < 0){
+      _free_replicates(list, views, owned, m);
+      return NULL;
+    }
+  }
+
+  seg = (tadbit_output *) malloc(sizeof(tadbit_output));
+  // run tadbit, releasing the GIL: the C core has no global state and the
+  // buffers of the matrices are held until '_free_replicates'
+  Py_BEGIN_ALLOW_THREADS
   tadbit(list, n, m, n_threads, verbose, max_tad_size, nbks, do_not_use_heuristic, seg);
+  Py_END_ALLOW_THREADS
+  _free_replicates(list, views, owned, m);
+
+  if (seg->maxbreaks < 0){
+    free(seg);
+    PyErr_SetString(PyExc_ValueError,
+                    "too few rows/columns with data in the diagonal");
+    return NULL;
+  }
 
   // store each tadbit output
   int       mbreaks     = seg->maxbreaks;
   int       nbreaks_opt = seg->nbreaks_opt;
   int    *  passages    = seg->passages;
   double *  llikmat     = seg->llikmat;
-  double ** weights     = seg->weights;
+  double ** rowsums     = seg->rowsums;
+  int       band        = seg->band;
   double *  mllik       = seg->mllik;
   int    *  bkpts       = seg->bkpts;
 
@@ -70,49 +293,76 @@ static PyObject *_tadbit_wrapper (PyObject *self, PyObject *args){
   PyObject * py_weights;
   PyObject * temp;
 
-  // get bkpts
-  /* int dim = nbreaks_opt*n; */
-  const int MAXBREAKS = nbks ? nbks : n/5;
-  int dim = MAXBREAKS * n;
-  py_bkpts = PyList_New(dim);
-  for(i = 0 ; i < dim; i++)
-    PyList_SetItem(py_bkpts, i, PyInt_FromLong(bkpts[i]));
-
-  /* This is to return directly the list of breaks found
-  j = 0;
-  py_bkpts = PyList_New(nbreaks_opt);
-  for(i = 0 ; i < n; i++){
-    if (bkpts[i+dim]==1){
-      PyList_SetItem(py_bkpts, j, PyInt_FromLong(i));
-      j++;
+  // breakpoints are stored for each number of breaks, up to 'mbreaks'
+  int dim = mbreaks * n;
+
+  if (as_arrays){
+    // raw C arrays, to be read with numpy.frombuffer. The python objects
+    // take ownership of them, so they are not freed with 'seg'. Weights are
+    // not returned as they are the products of the row/column sums.
+    py_passages = _wrap_c_array(passages, n * sizeof(int));
+    py_llikmat  = _wrap_c_array(llikmat, n*(band+1) * sizeof(double));
+    py_mllik    = _wrap_c_array(mllik, mbreaks * sizeof(double));
+    py_bkpts    = _wrap_c_array(bkpts, dim * sizeof(int));
+    seg->passages = NULL;
+    seg->llikmat  = NULL;
+    seg->mllik    = NULL;
+    seg->bkpts    = NULL;
+    py_weights  = PyList_New(m);
+    for(i = 0 ; i < m; i++){
+      temp = _wrap_c_array(rowsums[i], n * sizeof(double));
+      seg->rowsums[i] = NULL;
+      if (py_weights != NULL && temp != NULL)
+        PyList_SET_ITEM(py_weights, i, temp);
+      else
+        Py_XDECREF(temp);
     }
-  }
-  */
-
-  // get passages
-  py_passages = PyList_New(n);
-  for(i = 0 ; i < n; i++)
-    PyList_SetItem(py_passages, i, PyFloat_FromDouble(passages[i]));
-
-  // get llikmat
-  py_llikmat = PyList_New(n*n);
-  for(i = 0 ; i < n*n; i++)
-    PyList_SetItem(py_llikmat, i, PyFloat_FromDouble(llikmat[i]));
-
-  // get weights
-  py_weights = PyList_New(m);
-  for(i = 0 ; i < m; i++){
-    temp = PyList_New(n*n);
-    PyList_SetItem(py_weights, i, temp);
-    for(j = 0 ; j < n*n; j++){
-      PyList_SetItem(temp, j, PyFloat_FromDouble(weights[i][j]));
+    if (py_passages == NULL || py_llikmat == NULL || py_mllik == NULL ||
+        py_bkpts == NULL || py_weights == NULL ||
+        PyErr_Occurred()){
+      Py_XDECREF(py_passages);
+      Py_XDECREF(py_llikmat);
+      Py_XDECREF(py_mllik);
+      Py_XDECREF(py_bkpts);
+      Py_XDECREF(py_weights);
+      destroy_tadbit_output(seg);
+      return NULL;
     }
   }
+  else{
+    // get bkpts
+    py_bkpts = PyList_New(dim);
+    for(i = 0 ; i < dim; i++)
+      PyList_SetItem(py_bkpts, i, PyInt_FromLong(bkpts[i]));
+
+    // get passages
+    py_passages = PyList_New(n);
+    for(i = 0 ; i < n; i++)
+      PyList_SetItem(py_passages, i, PyFloat_FromDouble(passages[i]));
+
+    // get llikmat (slices longer than 'band' were not computed)
+    py_llikmat = PyList_New(n*n);
+    for(j = 0 ; j < n; j++)
+      for(i = 0 ; i < n; i++)
+        PyList_SetItem(py_llikmat, i+j*n, PyFloat_FromDouble(
+                           (j >= i && j-i <= band) ? llikmat[i+(j-i)*n] : NAN));
 
-  // get mllik
-  py_mllik = PyList_New(mbreaks);
-  for(i = 0 ; i < mbreaks ; i++)
-    PyList_SetItem(py_mllik, i, PyFloat_FromDouble(mllik[i]));
+    // get weights
+    py_weights = PyList_New(m);
+    for(i = 0 ; i < m; i++){
+      temp = PyList_New(n*n);
+      PyList_SetItem(py_weights, i, temp);
+      for(j = 0 ; j < n*n; j++){
+        PyList_SetItem(temp, j, PyFloat_FromDouble(rowsums[i][j%n] *
+                                                   rowsums[i][j/n]));
+      }
+    }
+
+    // get mllik
+    py_mllik = PyList_New(mbreaks);
+    for(i = 0 ; i < mbreaks ; i++)
+      PyList_SetItem(py_mllik, i, PyFloat_FromDouble(mllik[i]));
+  }
 
   // group results into a python list
   py_result = PyList_New(7);
@@ -126,27 +376,7 @@ static PyObject *_tadbit_wrapper (PyObject *self, PyObject *args){
   PyList_SetItem(py_result, 6, py_weights);
 
   // free many things... no leaks here!!
-  // TODO: use 'destroy_tadbit_output'
-  free(seg);
-  free(passages);
-  free(llikmat);
-  int k;
-  for (k = 0 ; k < m ; k++){
-    //free(obs[k]);
-    free(weights[k]);
-    free(list[k]);
-  }
-  //free(obs);
-  free(weights);
-  free(list);
-  free(mllik);
-  free(bkpts);
-  //free(py_bkpts);
-  //free(py_llikmat);
-  //free(py_mllik);
-  //free(py_result);
-  //free(py_passages);
-  //free(py_weights);
+  destroy_tadbit_output(seg);
 
   return py_result;
 }
@@ -165,6 +395,8 @@ static PyMethodDef tadbit_py_methods[] = {
 PyMODINIT_FUNC
 inittadbit_py(void)
 {
+	if (PyType_Ready(&c_array_type) < 0)
+		return;
 	/* There have been several InitModule functions over time */
 	Py_InitModule3("tadbit_py", tadbit_py_methods,
                    tadbit_py__doc__);
@@ -8,9 +8,6 @@
 #include <fcntl.h>
 #include "tadbit.h"
 
-int _max_cache_index;
-int *_cache_index;
-
 double
 ll
 (
@@ -20,10 +17,7 @@ ll
   const int    j_,
   const int    _j,
   const int    diag,
-  const int    *k,
-  const double *d,
-  const double *w,
-  const double *lg,
+  const hic_view *obs,
         double *c
 );
 
@@ -183,7 +183,8 @@ test_tadbit
    for (int j = 0 ; j < 20 ; j++) {
    for (int i = j ; i < 20 ; i++) {
       g_assert_cmpfloat(
-         seg->weights[0][i+j*20], ==,  expected_weights[i+j*20]
+         seg->rowsums[0][i]*seg->rowsums[0][j], ==,
+         expected_weights[i+j*20]
       );
    }
    }
@@ -197,39 +198,44 @@ test_ll
 (void)
 {
 
-   double lg[400] = {0};
+   double lg[100] = {0};
    double *c = malloc(21 * sizeof(double));
 
-   double w[400] = {[0 ... 399] = 1.0};
-   double d[400];
-   int C[400];
+   double rs[20] = {[0 ... 19] = 1.0};
+   double d[20];
+   int idx[20];
 
-   _cache_index = C;
-   _max_cache_index = 21;
-
-   for (int j = 0 ; j < 20 ; j++) {
-      for (int i = 0 ; i < 20 ; i++) {
-         d[i+j*20] = log(abs(j-i));
-         C[i+j*20] = abs(j-i);
-      }
+   for (int i = 0 ; i < 20 ; i++) {
+      d[i] = log(i);
+      idx[i] = i;
    }
 
-   double loglik1 = ll(20, 0, 9, 0, 9, 1, ideal_matrix_20x20, d, w, lg, c);
+   hic_view obs = {
+      .k = ideal_matrix_20x20,
+      .N = 20,
+      .idx = idx,
+      .rs = rs,
+      .d = d,
+      .lg = lg,
+      .n_lg = 100,
+   };
+
+   double loglik1 = ll(20, 0, 9, 0, 9, 1, &obs, c);
    // Value checked manually with R. The value is sensitive to
    // the value of the estimates, which is why the  precision
    // cannot be higher than 0.1.
    g_assert_cmpfloat(abs(loglik1-6138.2), <, 1e-1);
 
    // Check symmetry/reproducibility.
-   double loglik2 = ll(20, 10, 19, 10, 19, 1, ideal_matrix_20x20, d, w, lg, c);
+   double loglik2 = ll(20, 10, 19, 10, 19, 1, &obs, c);
    g_assert_cmpfloat(abs(loglik1-loglik2), <, 1e-12);
 
    // Same as above, checked manually with R.
-   loglik1 = ll(20, 0, 9, 10, 19, 0, ideal_matrix_20x20, d, w, lg, c);
+   loglik1 = ll(20, 0, 9, 10, 19, 0, &obs, c);
    g_assert_cmpfloat(abs(loglik1-3036.8), <, 1e-1);
 
    // Check symmetry/reproducibility again.
-   loglik2 = ll(20, 10, 19, 0, 9, 0, ideal_matrix_20x20, d, w, lg, c);
+   loglik2 = ll(20, 10, 19, 0, 9, 0, &obs, c);
    g_assert_cmpfloat(abs(loglik1-loglik2), <, 1e-12);
 
    free(c);
@@ -6,14 +6,25 @@ unittest for pytadbit functions
 
 import unittest
 from pytadbit                        import Chromosome, load_chromosome
+from pytadbit                        import Experiment, merge_experiments
 from pytadbit                        import tadbit, batch_tadbit
+from pytadbit                        import genome_tadbit
+from pytadbit.tadbit_py              import _tadbit_wrapper
 from pytadbit.tad_clustering.tad_cmo import optimal_cmo
 from pytadbit.imp.structuralmodels   import load_structuralmodels
-from pytadbit.imp.impmodel           import load_impmodel_from_cmm
+from pytadbit.imp.impmodel           import load_impmodel_from_cmm, IMPmodel
+from pytadbit.imp.modelstore         import ModelStore
 from pytadbit.eqv_rms_drms           import rmsdRMSD_wrapper
-from os                              import system, path, chdir
+from pytadbit.parsers.hic_parser     import read_matrix, autoreader
+from pytadbit.parsers.hic_parser     import AutoReadFail, save_hic_matrix
+from pytadbit.utils.extraviews       import _tad_heights
+from numpy                           import array, fromfile
+from os                              import system, path, chdir, listdir
 from warnings                        import warn
 from distutils.spawn                 import find_executable
+from threading                       import Thread
+from gzip                            import GzipFile
+from cPickle                         import loads, dumps
 
 CHKTIME = False
 
@@ -107,6 +118,18 @@ class TestTadbit(unittest.TestCase):
         for exp in test_chr.experiments:
             exp.normalize_hic(silent=True)
 
+        # heights of the TADs in the density plot, from the arrays of data
+        exp = test_chr.experiments['exp2']
+        heights = _tad_heights(exp)
+        raw_heights = _tad_heights(exp, normalized=False)
+        self.assertEqual(sorted(heights), sorted(exp.tads))
+        norm = exp.norm
+        exp.norm = [list(norm[0])]
+        self.assertEqual(_tad_heights(exp), heights)
+        exp.norm = norm
+        self.assertNotEqual(heights, raw_heights)
+        self.assertTrue(all([h > 0 for h in heights.values()]))
+
         test_chr.align_experiments(verbose=False, randomize=False,
                                    method='global')
         score1, pval1 = test_chr.align_experiments(verbose=False,
@@ -264,6 +287,17 @@ class TestTadbit(unittest.TestCase):
         check_hic(exp.hic_data[0], exp.size)
         self.assertTrue(sum20 == sum80 == sum160 == sum360 == sum40 \
                         == sum21 == sum2400 == sum41)
+        exp.cache_budget = 0
+        hic160 = exp.get_hic_matrix(resolution=160000)
+        self.assertEqual(exp.resolution, 40000)
+        exp.set_resolution(160000)
+        self.assertEqual(hic160, exp.get_hic_matrix())
+        self.assertEqual(sorted(exp._pyramid.keys()), [20000, 160000])
+        mtrx = exp.get_hic_matrix(focus=(3, 6), as_array=True)
+        self.assertEqual(mtrx.tolist(), exp.get_hic_matrix(focus=(3, 6)))
+        self.assertEqual([exp.get_hic_matrix(focus=(3, 6),
+                                             diagonal=False)[i][i]
+                          for i in xrange(4)], [1, 1, 1, 1])
         if CHKTIME:
             print '8', time() - t0
 
@@ -286,6 +320,36 @@ class TestTadbit(unittest.TestCase):
         sumz = sum([exp._zscores[k1][k2] for k1 in exp._zscores.keys()
                     for k2 in exp._zscores[k1]])
         self.assertEqual(round(sumz, 4), round(3993.7842, 4))
+        self.assertEqual(len(exp._zscores.data), exp.size * (exp.size - 1) / 2)
+        zsc_mtrx = exp._zscores.matrix()
+        self.assertEqual(zsc_mtrx[3][40], exp._zscores['3']['40'])
+        self.assertEqual(zsc_mtrx[40][3], exp._zscores['3']['40'])
+        exp.load_hic_data([PATH + '/20Kb/chrT/chrT_A.tsv',
+                           PATH + '/20Kb/chrT/chrT_B.tsv'], silent=True)
+        exp.normalize_hic(silent=True)
+        norm = exp.norm
+        exp.normalize_hic(silent=True, replicates=True)
+        self.assertEqual(len(exp.norm), 2)
+        self.assertEqual(exp.norm[0].tolist(), norm[0].tolist())
+        exp.normalize_hic(silent=True, method='ICE', tolerance=1e-6)
+        rowsums = exp.norm[0].reshape(exp.size, exp.size).sum(axis=1)
+        rowsums = rowsums[exp.bias[0] != 0]
+        self.assertTrue(rowsums.max() - rowsums.min() < 1e-3 * rowsums.mean())
+        # z-scores and models use the ICE normalization
+        bias = exp.bias[0].tolist()
+        exp._sub_experiment_zscore(1, 20)
+        try:
+            __import__('IMP')
+            exp.model_region(1, 20, n_models=2, n_keep=1)
+        except ImportError:
+            warn('IMP not found, skipping modelling\n')
+        self.assertEqual(exp._normalization, 'ICE')
+        self.assertEqual(exp.bias[0].tolist(), bias)
+        # products of the row sums do not fit in 64 bit integers
+        deep = Experiment('deep', 20000, filter_columns=False,
+                          hic_data=array([[3, 1], [1, 3]]) * 10**9)
+        deep.normalize_hic(silent=True)
+        self.assertEqual(deep.norm[0].tolist(), [1.5, 0.5, 0.5, 1.5])
         if CHKTIME:
             print '9', time() - t0
 
@@ -329,7 +393,22 @@ class TestTadbit(unittest.TestCase):
         self.assertEqual(len(lines), 4851)
         self.assertEqual(lines[25], '1\t28\t0.933380667098\n')
         self.assertEqual(lines[2000], '24\t100\t0.233201219512\n')
-        system('rm -f lala')
+        exp.write_interaction_pairs('lala.gz', gzip=True, chunk=100)
+        self.assertEqual(GzipFile('lala.gz').readlines(), lines)
+        exp.write_interaction_pairs('lala.bin', binary=True)
+        pairs = fromfile('lala.bin', dtype=[('elt1', '<i8'), ('elt2', '<i8'),
+                                            ('value', '<f8')])
+        self.assertEqual(len(pairs), 4851)
+        self.assertEqual(lines[2000], '%s\t%s\t%s\n' % pairs[2000].item())
+        # with a focus, both bins of each pair are inside it
+        exp.write_interaction_pairs('lala', zscored=False, normalized=False,
+                                    uniq=False, focus=(10, 19))
+        size = exp.size
+        self.assertEqual(open('lala').readlines(), [
+            '%s\t%s\t%s\n' % (i - 9, j - 9, exp.hic_data[0][i * size + j])
+            for i in xrange(10, 20) for j in xrange(10, 20)
+            if i != j and not i in exp._zeros and not j in exp._zeros])
+        system('rm -f lala lala.gz lala.bin')
         if CHKTIME:
             print '11', time() - t0
 
@@ -562,6 +641,385 @@ class TestTadbit(unittest.TestCase):
             print '17', time() - t0
 
 
+    def test_18_tadbit_buffer_input(self):
+        """
+        TADbit on numpy arrays should give the same result as on files
+        """
+        if CHKTIME:
+            t0 = time()
+
+        nums, size = read_matrix(PATH + '/40Kb/chrT/chrT_A.tsv')
+        for dtype in ['int32', 'int64', 'float64']:
+            matrix = array(nums[0], dtype=dtype).reshape(size, size)
+            result = tadbit(matrix, max_tad_size="auto", verbose=False,
+                            no_heuristic=False, n_cpus='max')
+            self.assertEqual(result, exp1)
+        # values that can not be rounded to C integers are rejected
+        for bad in (float('nan'), float('inf'), 1e20, -1e20):
+            for dtype in ['float32', 'float64']:
+                matrix = array(nums[0], dtype=dtype)
+                matrix[size + 1] = bad
+                self.assertRaises(ValueError, _tadbit_wrapper, [matrix],
+                                  size, 1, 1, 0, size, 0, 0)
+        if CHKTIME:
+            print '18', time() - t0
+
+
+    def test_19_tadbit_weights(self):
+        """
+        weights computed in python should match those of the C library
+        """
+        if CHKTIME:
+            t0 = time()
+
+        nums, size = read_matrix([PATH + '/20Kb/chrT/chrT_C.tsv',
+                                  PATH + '/20Kb/chrT/chrT_D.tsv'])
+        weights = _tadbit_wrapper(nums, size, 2, 1, 0, 20, 0, 1)[6]
+        oks = [i for i in xrange(size) if nums[0][i*size+i]]
+        total = sum([nums[0][i*size+j] for i in oks for j in oks])
+        _, tadbit_wghts = tadbit(nums, verbose=False, max_tad_size=20,
+                                 get_weights=True)
+        self.assertEqual(len(tadbit_wghts), 2)
+        # weights are computed from the row sums of the C library on access
+        self.assertEqual(tadbit_wghts._wghts, {})
+        for num, wght, tadbit_wght in zip(nums, weights, tadbit_wghts):
+            self.assertEqual([i/j*total if j else 0.0
+                              for i, j in zip(num, wght)],
+                             tadbit_wght.tolist())
+        self.assertTrue(tadbit_wghts[-1] is tadbit_wghts[1])
+        self.assertEqual([w.tolist() for w in loads(dumps(tadbit_wghts))],
+                         [w.tolist() for w in tadbit_wghts])
+        if CHKTIME:
+            print '19', time() - t0
+
+
+    def test_20_tadbit_concurrent(self):
+        """
+        TADbit calls running in parallel threads should not interfere
+        """
+        if CHKTIME:
+            t0 = time()
+
+        paths = [PATH + '/20Kb/chrT/chrT_%s.tsv' % crm for crm in 'ABCD']
+        results = [None] * len(paths)
+        def run(i):
+            results[i] = tadbit(paths[i], max_tad_size="auto", n_cpus=2,
+                                verbose=False)
+        threads = [Thread(target=run, args=(i, )) for i in xrange(len(paths))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for pth, result in zip(paths, results):
+            self.assertEqual(result, tadbit(pth, max_tad_size="auto",
+                                            verbose=False))
+        if CHKTIME:
+            print '20', time() - t0
+
+
+    def test_21_genome_tadbit(self):
+        """
+        TADbit on several chromosomes at once
+        """
+        if CHKTIME:
+            t0 = time()
+
+        matrices = dict([(crm, PATH + '/20Kb/chrT/chrT_%s.tsv' % crm)
+                         for crm in 'ABCD'])
+        genome = genome_tadbit(matrices, 20000, n_cpus=4, n_jobs=2,
+                               max_tad_size="auto")
+        self.assertEqual(sorted(genome.keys()), list('ABCD'))
+        for crm in genome:
+            result = tadbit(matrices[crm], max_tad_size="auto", verbose=False)
+            tads = genome[crm].experiments['hic'].tads
+            self.assertEqual([tads[t]['end'] for t in sorted(tads)],
+                             [float(e) for e in result['end']])
+        if CHKTIME:
+            print '21', time() - t0
+
+
+    def test_22_autoreader_formats(self):
+        """
+        Hi-C text matrices with or without header and row information
+        """
+        if CHKTIME:
+            t0 = time()
+
+        values = '1\t2\t3\n2\t4\t5\n3\t5\t6\n'
+        names = ['chr_%d' % i for i in xrange(3)]
+        formats = [values,
+                   '\t'.join(names) + '\n' + ''.join(
+                       [n + '\t' + l + '\n'
+                        for n, l in zip(names, values.split('\n'))]),
+                   ''.join(['%s\t%d\t%s\n' % (n, i * 100, l) for i, (n, l)
+                            in enumerate(zip(names, values.split('\n')))])]
+        for fmt in formats:
+            hic, size = autoreader(fmt.split('\n'))
+            self.assertEqual(size, 3)
+            self.assertEqual(hic.tolist(), [1, 2, 3, 2, 4, 5, 3, 5, 6])
+        hic, size = read_matrix(PATH + '/20Kb/chrT/chrT_A.tsv')
+        self.assertEqual(size, 100)
+        self.assertEqual(check_hic(hic[0], size), True)
+        if CHKTIME:
+            print '22', time() - t0
+
+
+    def test_23_sparse_input(self):
+        """
+        Hi-C data given as sparse (bin1, bin2, count) triplets
+        """
+        if CHKTIME:
+            t0 = time()
+
+        (hic, ), size = read_matrix(PATH + '/20Kb/chrT/chrT_A.tsv')
+        out = GzipFile('lala.gz', 'w')
+        out.write('bin1\tbin2\tcount\n')
+        for i in xrange(size):
+            for j in xrange(i, size):
+                if hic[i * size + j]:
+                    out.write('%d\t%d\t%d\n' % (i + 1, j + 1,
+                                                 hic[i * size + j]))
+        out.close()
+        (sparse, ), sparse_size = read_matrix('lala.gz', sparse=True, base=1)
+        self.assertEqual(sparse_size, size)
+        self.assertEqual(sparse.tolist(), hic.tolist())
+        exp = Experiment('sparse', 20000)
+        exp.load_hic_data('lala.gz', sparse=True, base=1)
+        self.assertEqual(exp.size, size)
+        # triplets are not guessed from the shape of the file
+        self.assertRaises(AutoReadFail, autoreader, GzipFile('lala.gz'))
+        system('rm -f lala.gz')
+        small = '0 0 10\n0 1 5\n1 1 7\n'
+        self.assertEqual(autoreader(small.split('\n'))[1], 3)
+        (sparse, ), sparse_size = read_matrix(small, sparse=True)
+        self.assertEqual((sparse.tolist(), sparse_size), ([10, 5, 5, 7], 2))
+        # empty first and last bins are kept
+        (sparse, ), sparse_size = read_matrix('1 1 10\n1 2 5\n2 2 7\n',
+                                              sparse=True, size=4)
+        self.assertEqual(sparse_size, 4)
+        self.assertEqual(sparse.reshape(4, 4)[1:3, 1:3].tolist(),
+                         [[10, 5], [5, 7]])
+        self.assertEqual(sparse.sum(), 27)
+        try:
+            from scipy.sparse import coo_matrix
+        except ImportError:
+            warn('scipy not found, skipping sparse matrix test')
+            return
+        dense = array(hic).reshape(size, size)
+        (sparse, ), sparse_size = read_matrix(coo_matrix(dense))
+        self.assertEqual(sparse.tolist(), hic.tolist())
+        if CHKTIME:
+            print '23', time() - t0
+
+
+    def test_24_save_load_hic_data(self):
+        """
+        Hi-C data saved in binary format and memory-mapped when loaded
+        """
+        if CHKTIME:
+            t0 = time()
+
+        test_chr = Chromosome(name='Test Chromosome')
+        test_chr.add_experiment('exp1', 20000,
+                                hic_data=PATH + '/20Kb/chrT/chrT_A.tsv',
+                                silent=True)
+        test_chr.add_experiment('exp2', 20000,
+                                hic_data=[PATH + '/20Kb/chrT/chrT_B.tsv',
+                                          PATH + '/20Kb/chrT/chrT_C.tsv'],
+                                silent=True)
+        test_chr.save_chromosome('lolo', fast=False, force=True)
+        for fast in [0, 1]:
+            loaded = load_chromosome('lolo', fast=fast)
+            for xpr in test_chr.experiments:
+                hic_data = loaded.get_experiment(xpr.name).hic_data
+                self.assertEqual(len(hic_data), len(xpr.hic_data))
+                for hic1, hic2 in zip(xpr.hic_data, hic_data):
+                    self.assertEqual(list(hic1), hic2.tolist())
+        self.assertEqual(load_chromosome('lolo').experiments[0].hic_data,
+                         None)
+        # saved again over the files it is memory-mapped from
+        loaded = load_chromosome('lolo', fast=0)
+        loaded.save_chromosome('lolo', fast=False, force=True)
+        loaded = load_chromosome('lolo', fast=0)
+        for xpr in test_chr.experiments:
+            hic_data = loaded.get_experiment(xpr.name).hic_data
+            for hic1, hic2 in zip(xpr.hic_data, hic_data):
+                self.assertEqual(list(hic1), hic2.tolist())
+        # files of experiments no longer in the chromosome are removed
+        single = Chromosome(name='Test Chromosome')
+        single.add_experiment('exp1', 20000,
+                              hic_data=PATH + '/20Kb/chrT/chrT_A.tsv',
+                              silent=True)
+        system('touch lolo_hic_12.npy lolo_hic_x.npy')
+        single.save_chromosome('lolo', fast=False, force=True)
+        self.assertEqual(sorted([f for f in listdir('.')
+                                 if f.startswith('lolo')]),
+                         ['lolo', 'lolo_hic', 'lolo_hic_0.npy',
+                          'lolo_hic_x.npy'])
+        # nothing is left when the data can not be written
+        self.assertRaises(ValueError, save_hic_matrix,
+                          [array([None] * 4)], 'lolo_hic_0.npy')
+        self.assertEqual(len([f for f in listdir('.')
+                              if f.endswith('.npy')]), 2)
+        system('rm -f lolo lolo_hic lolo_hic_*.npy')
+        if CHKTIME:
+            print '24', time() - t0
+
+
+    def test_25_merge_experiments(self):
+        """
+        sum of experiments at different resolutions
+        """
+        if CHKTIME:
+            t0 = time()
+
+        test_chr = Chromosome(name='Test Chromosome')
+        for name in 'ABC':
+            test_chr.add_experiment(name, 20000, silent=True,
+                                    hic_data=PATH + '/20Kb/chrT/chrT_%s.tsv' % (
+                                        name))
+        exp1, exp2, exp3 = test_chr.experiments
+        exp2.set_resolution(60000)
+        hic1 = exp1.get_hic_matrix(resolution=60000, as_array=True)
+        exp = merge_experiments([exp1, exp2, exp3])
+        self.assertEqual(exp.name, 'A+B+C')
+        self.assertEqual((exp.resolution, exp1.resolution, exp2.resolution),
+                         (60000, 20000, 60000))
+        self.assertEqual(exp.get_hic_matrix(),
+                         (hic1 + exp2.get_hic_matrix(as_array=True) +
+                          exp3.get_hic_matrix(resolution=60000,
+                                              as_array=True)).tolist())
+        self.assertEqual((exp1 + exp2).get_hic_matrix(),
+                         (hic1 + exp2.get_hic_matrix(as_array=True)).tolist())
+        # with replicates, only the first one is added by '+'
+        exp3.load_hic_data([PATH + '/20Kb/chrT/chrT_C.tsv',
+                            PATH + '/20Kb/chrT/chrT_D.tsv'], silent=True)
+        hic1 = exp1.get_hic_matrix(as_array=True)
+        hic3 = exp3.get_hic_matrix(as_array=True)
+        self.assertEqual((exp1 + exp3).get_hic_matrix(),
+                         (hic1 + hic3).tolist())
+        (hic4, ), _ = read_matrix(PATH + '/20Kb/chrT/chrT_D.tsv')
+        self.assertEqual(merge_experiments([exp1, exp3]).get_hic_matrix(),
+                         (hic1 + hic3 + hic4.reshape(hic3.shape)).tolist())
+        if CHKTIME:
+            print '25', time() - t0
+
+
+    def test_26_model_store(self):
+        """
+        models appended to a store, and lazily loaded
+        """
+        if CHKTIME:
+            t0 = time()
+
+        models = load_structuralmodels('models.pick')
+        system('rm -f lala.store')
+        store = ModelStore('lala.store')
+        store.append_metadata({'nloci': models.nloci, 'n_keep': 3,
+                               'resolution': models.resolution,
+                               'original_data': None, 'zscores': None,
+                               'config': models._config})
+        store.append([(int(m['rand_init']), m) for m in models][::2])
+        # record of a killed job
+        open('lala.store', 'ab').write(open('lala.store', 'rb').read(50))
+        store.append([(int(m['rand_init']), m) for m in models])
+        self.assertEqual(len(store), len(models))
+        # loading the store reads only its metadata
+        reads = []
+        read = ModelStore.read
+        def counted_read(self, *args):
+            reads.append(args)
+            return read(self, *args)
+        ModelStore.read = counted_read
+        try:
+            stored = load_structuralmodels('lala.store')
+            self.assertEqual(len(reads), 1)
+            self.assertEqual(stored[1]['rand_init'], models[1]['rand_init'])
+            self.assertEqual(len(reads), 2)
+        finally:
+            ModelStore.read = read
+        self.assertEqual(len(stored), 3)
+        self.assertEqual(len(stored._bad_models), len(models) - 3)
+        for i in xrange(3):
+            self.assertEqual(stored[i]['rand_init'], models[i]['rand_init'])
+            self.assertEqual(list(stored[i]['x']), list(models[i]['x']))
+        self.assertEqual(stored._coordinates()[2, :, 0].tolist(),
+                         list(models[2]['x']))
+        system('rm -f lala.store')
+        if CHKTIME:
+            print '26', time() - t0
+
+
+    def test_27_models_array(self):
+        """
+        coordinates of the models stored in a single array
+        """
+        if CHKTIME:
+            t0 = time()
+
+        models = load_structuralmodels('models.pick')
+        coords = models._coordinates()
+        self.assertEqual(coords.shape, (len(models), models.nloci, 3))
+        self.assertEqual(models[3]['y'].tolist(), coords[3, :, 1].tolist())
+        # contacts computed from the coordinates of each model
+        cutoff = int(2 * models.resolution * models._config['scale'])
+        matrix = models.get_contact_matrix()
+        for i, j in ((0, 1), (2, 9), (4, 20)):
+            self.assertEqual(matrix[i][j], sum(
+                [m.distance(i + 1, j + 1) < cutoff for m in models]) /
+                             float(len(models)))
+        # models aligned in place are still stored in the array
+        aligned = models.align_models()
+        models.align_models(in_place=True)
+        self.assertEqual(models[2]['x'].tolist(), aligned[2][0])
+        self.assertEqual(models._coordinates()[2, :, 0].tolist(), aligned[2][0])
+        # only the views on the array of the models are written in place
+        coords = models._coords
+        models[3]['x'] = aligned[4][0]
+        self.assertEqual(models._coordinates()[3, :, 0].tolist(),
+                         aligned[4][0])
+        self.assertTrue(models._coords is coords)
+        mine = array(aligned[3][0] + aligned[3][1])
+        model = IMPmodel((('x', mine[:models.nloci]), ))
+        model['x'] = mine[models.nloci:]
+        self.assertEqual(mine[:models.nloci].tolist(), aligned[3][0])
+        self.assertTrue(model['x'].base is mine)
+        # models are saved with lists of coordinates
+        models.save_models('lala.pick')
+        saved = load_structuralmodels('lala.pick')
+        self.assertEqual(list(saved[2]['x']), aligned[2][0])
+        self.assertEqual(type(models._reduce_models()['models'][2]['x']), list)
+        system('rm -f lala.pick')
+        if CHKTIME:
+            print '27', time() - t0
+
+
+    def test_28_small_max_tad_size(self):
+        """
+        no slice longer than max_tad_size is computed, also when the heuristic
+        or the refinement of the breaks would have used longer ones
+        """
+        if CHKTIME:
+            t0 = time()
+
+        nums, size = read_matrix(PATH + '/20Kb/chrT/chrT_B.tsv')
+        kept = [i for i in xrange(size) if nums[0][i * size + i]]
+        ends = [4, 12, 19, 28, 35, 42, 47, 53, 61, 66, 74, 82, 89, 94, 99]
+        for no_heuristic in (False, True):
+            result = tadbit(nums, max_tad_size=7, verbose=False,
+                            no_heuristic=no_heuristic)
+            self.assertEqual(result['end'], ends)
+            # TADs have at most max_tad_size + 1 rows with data
+            self.assertTrue(all([
+                len([i for i in kept if beg <= i <= end]) <= 8
+                for beg, end in zip(result['start'], result['end'])]))
+        # longer TADs are found otherwise
+        result = tadbit(nums, max_tad_size="auto", verbose=False)
+        self.assertEqual(result['end'][:4], [3, 13, 18, 34])
+        if CHKTIME:
+            print '28', time() - t0
+
+
 if __name__ == "__main__":
     unittest.main()
     